@@ -15,32 +15,38 @@ class Config:
         'pics': {
             'fid': '7',
             'name': '技术交流',
-            'url_template': '{base}/thread0806.php?fid=7&search=&page={page}'
+            'url_template': '{base}/thread0806.php?fid=7&search=&page={page}',
+            'weight': 1.0
         },
         'new_era': {
             'fid': '8',
             'name': '新時代的我們',
-            'url_template': '{base}/thread0806.php?fid=8&search=&page={page}'
+            'url_template': '{base}/thread0806.php?fid=8&search=&page={page}',
+            'weight': 1.0
         },
         'daguerre_flag': {
             'fid': '16',
             'name': '達蓋爾的旗幟',
-            'url_template': '{base}/thread0806.php?fid=16&search=&page={page}'
+            'url_template': '{base}/thread0806.php?fid=16&search=&page={page}',
+            'weight': 1.0
         },
         'literature': {
             'fid': '20',
             'name': '文学',
-            'url_template': '{base}/thread0806.php?fid=20&search=&page={page}'
+            'url_template': '{base}/thread0806.php?fid=20&search=&page={page}',
+            'weight': 1.0
         },
         'story': {
             'fid': '2',
             'name': '故事',
-            'url_template': '{base}/thread0806.php?fid=2&search=&page={page}'
+            'url_template': '{base}/thread0806.php?fid=2&search=&page={page}',
+            'weight': 1.0
         },
         'poem': {
             'fid': '3',
             'name': '诗歌',
-            'url_template': '{base}/thread0806.php?fid=3&search=&page={page}'
+            'url_template': '{base}/thread0806.php?fid=3&search=&page={page}',
+            'weight': 1.0
         }
     }
     
@@ -53,6 +59,14 @@ class Config:
     # 日志文件路径
     PIC_LOG_FILE = os.path.join(LOG_DIR, 'pic_crawled.log')
     LITERATURE_LOG_FILE = os.path.join(LOG_DIR, 'literature_crawled.log')
+    PIC_CHECKPOINT_FILE = os.path.join(LOG_DIR, 'pic_progress.json')  # 未完成帖子的逐图下载进度
+    PIC_COMPLETION_FILE = os.path.join(LOG_DIR, 'pic_completed.jsonl')  # 已完成帖子的逐图下载结果
+    
+    # 日志配置：控制台输出文本，日志文件（scraper_日期.jsonl）每行一条JSON，由后台线程写出
+    LOG_LEVEL = 'INFO'
+    LOG_MODULE_LEVELS = {}  # 按来源模块（文件名）设置的最低级别，如 {'request_utils': 'WARNING'}
+    LOG_RATE_LIMIT = 5  # 同一行代码每秒最多输出的INFO日志条数（如每个请求一条的日志），0表示不限速
+    LOG_RATE_BURST = 20  # 同一行代码可以连续输出的INFO日志条数，超过后按LOG_RATE_LIMIT限速
     
     # 请求头配置
     HEADERS = {
@@ -63,9 +77,111 @@ class Config:
     DEFAULT_PAGE_RANGE = (1, 2)  # 默认爬取页面范围
     DOWNLOAD_DELAY = 1  # 下载延迟（秒）
     MAX_RETRY = 3  # 最大重试次数
+    SHUTDOWN_GRACE_PERIOD = 30  # 收到终止信号后进行中的下载可继续的时间（秒）
+    POST_SUCCESS_THRESHOLD = 1.0  # 帖子图片成功比例达到该值才视为已完成，否则下次运行补下缺失的图片
+    POST_MAX_ATTEMPTS = 3  # 帖子最多完整尝试的次数，超过后记录缺失的图片并不再重试
+    
+    # 调度配置
+    SCHEDULER_AGING_RATE = 0.5  # 任务每等待1秒提升的优先级，避免低优先级任务饿死
+    SCHEDULER_ASSET_DECAY = 5.0  # 图片序号每增加1降低的优先级
+    
+    # 分片模式配置
+    SHARD_LEASE_DB = os.path.join(LOG_DIR, 'shard_leases.db')  # 租约数据库，多个工作进程共享
+    SHARD_LEASE_TTL = 600  # 分片租约有效期（秒），工作进程每隔1/3有效期续租一次
+    SHARD_WORKERS = 4  # 分片模式默认工作进程数量
+    
+    # 运行指标：运行结束时写入Prometheus文本文件（每次覆盖）和JSON运行报告（每次运行一个文件）
+    METRICS_DIR = os.path.join(LOG_DIR, 'metrics')
+    METRICS_TEXTFILE = os.path.join(METRICS_DIR, 'crawler.prom')
+    METRICS_REPORT_DIR = METRICS_DIR
+    
+    # 追踪配置（--trace）：记录列表页、帖子、图片、下载和打包的Span，运行结束时导出Chrome trace和OTLP/JSON文件
+    TRACE_ENABLED = False
+    TRACE_DIR = os.path.join(LOG_DIR, 'traces')
+    TRACE_MAX_SPANS = 200000  # 最多保存的Span数量（约每个200字节），超过后丢弃
+    TRACE_SERVICE_NAME = 'caoliu_scraper'
+    
+    # 运行预算配置（--deadline）
+    PACKAGING_THROUGHPUT = 20 * 1024 * 1024  # 预估打包吞吐量：20MB/s
+    BUDGET_SAFETY_MARGIN = 300  # 打包之外额外预留的时间（秒）
+    BUDGET_MIN_PICS = 5  # 预算调整后每个帖子最少下载的图片数量
+    BUDGET_MAX_PICS = 200  # 预算调整后每个帖子最多下载的图片数量
     
     # ZIP打包配置
     ZIP_CHUNK_SIZE = 10 * 1024 * 1024  # 10MB分块大小
+    ZIP_WORKERS = os.cpu_count() or 1  # 并行压缩的进程数
+    ZIP_COMPRESS_LEVEL = 6  # DEFLATE压缩级别
+    ZIP_VOLUME_WORKERS = os.cpu_count() or 1  # 分卷打包时同时创建分卷的进程数，1表示按顺序流式写入
+    ZIP_PARALLEL_INLINE_LIMIT = 64 * 1024 * 1024  # 超过该大小的文件在主进程中流式压缩
+    ZIP_TEXT_COMPRESS_LEVEL = 9  # 文本文件（如文学.txt）使用的DEFLATE压缩级别
+    ZIP_PROBE_RATIO = 0.95  # 未知类型试压后体积低于原来的95%才使用DEFLATE，否则直接存储
+    ZIP_DEFLATE_THROUGHPUT = 30 * 1024 * 1024  # 尚无实测数据时估算的DEFLATE吞吐量（字节/CPU秒）
+    INVENTORY_WORKERS = min(32, (os.cpu_count() or 1) + 4)  # 扫描待打包目录时并行扫描子目录的线程数
+    
+    # 归档格式配置
+    ARCHIVE_FORMAT = 'zip'  # zip 或 tar.zst（tar.zst需要安装zstandard）
+    ZSTD_LEVEL = 10  # zstd压缩级别（1-22）
+    ZSTD_THREADS = os.cpu_count() or 1  # zstd压缩线程数
+    ZSTD_LONG_DISTANCE = True  # 启用长距离匹配，大量相似文本（文学内容）压缩率更高
+    ZSTD_WINDOW_LOG = 27  # 长距离匹配窗口（2^27=128MB，zstd命令行默认即可解压）
+    
+    # 归档校验配置
+    VERIFY_WORKERS = os.cpu_count() or 1  # 并行校验归档的进程数
+    VERIFY_LEVEL = 'full'  # full（读取全部数据比对CRC32和SHA-256）或 quick（只检查文件大小和ZIP中央目录）
+    
+    # 增量打包配置
+    PACKAGING_MODE = 'full'  # full（每次打包整个目录）或 incremental（只打包清单中没有的新增或修改文件）
+    ARCHIVE_MANIFEST_DIR = os.path.join(LOG_DIR, 'manifests')  # 已归档文件清单目录
+    ARCHIVE_CHAIN_DIR = os.path.join(ZIP_OUTPUT_DIR, 'chain')  # 全量和增量归档链的保存目录
+    
+    # 图片存储方式: files（保存为散文件，爬取结束后打包）或 archive（下载后直接写入ZIP，超过分卷大小自动换卷）
+    PIC_STORAGE = 'files'
+    
+    # 图片去重: files方式下图片按内容哈希只保存一份，帖子目录中为硬链接；已下载过的图片URL不再下载
+    PIC_DEDUP = True
+    PIC_BLOB_DIR = os.path.join(PIC_DIR, '.blobs')  # 内容文件目录（不在板块目录下，不会被打包）
+    PIC_BLOB_INDEX_NAME = 'index.db'  # URL到内容哈希的索引，保存在内容文件目录中
+    
+    # 图片字节预算（0表示不限制）：下载前按响应头的Content-Length检查，缺少时下载超过上限即中止
+    PIC_MAX_FILE_BYTES = 20 * 1024 * 1024  # 单张图片上限，超过的图片跳过（不影响帖子的完成判定）
+    PIC_POST_BYTE_BUDGET = 200 * 1024 * 1024  # 每个帖子每次运行最多下载的字节数，超出的图片推迟到下次运行
+    PIC_RUN_BYTE_BUDGET = 5 * 1024 * 1024 * 1024  # 每次运行最多下载的字节数，用完后保存进度并停止（下载的图片和打包后的归档都占用运行器磁盘，约14GB可用）
+    
+    # 图片校验: files方式下载完成后在进程池中校验图片能否解码（需要Pillow，未安装时只检查文件头），损坏的图片删除后重新下载
+    IMAGE_VERIFY = True
+    IMAGE_VERIFY_WORKERS = os.cpu_count() or 1  # 校验进程数
+    IMAGE_VERIFY_RETRIES = 1  # 校验失败的图片重新下载的次数
+    IMAGE_CONTACT_SHEET = False  # 是否为每个帖子生成缩略图索引图（--contact_sheet）
+    IMAGE_CONTACT_SHEET_NAME = '_contact_sheet.jpg'  # 索引图文件名，保存在帖子目录中
+    IMAGE_THUMB_SIZE = 200  # 缩略图最长边的像素数
+    IMAGE_THUMB_QUALITY = 80  # 缩略图和索引图的JPEG质量
+    IMAGE_SHEET_COLUMNS = 5  # 索引图每行的缩略图数量
+    # 图片转码（需要Pillow，在校验进程中完成，动图和转码后没有变小的图片保留原样）
+    IMAGE_TRANSCODE = None  # 转码目标格式 'webp' 或 'avif'，None表示不转码（--transcode）
+    IMAGE_TRANSCODE_QUALITY = 80  # 转码质量（0-100）
+    IMAGE_MAX_DIMENSION = 2560  # 转码时最长边的像素数，超过时缩小，0表示不缩小
+    IMAGE_KEEP_ORIGINAL = False  # 转码后是否保留原图（--keep_original）
+    
+    # 文学存储方式: files（每篇作品一个txt文件）或 sqlite（写入板块目录下的SQLite作品库，支持FTS5全文搜索）
+    LITERATURE_STORAGE = 'files'
+    LITERATURE_DB_NAME = 'literature.db'  # 作品库文件名，保存在 literature/板块名称/ 下，随板块目录一起打包
+    LITERATURE_STORE_BATCH = 50  # 作品库每批提交的帖子数量
+    LITERATURE_INDEX_ON_WRITE = False  # 写入时同步建立全文索引；默认在第一次搜索时建立，数据库体积与txt相当
+    LITERATURE_COMPRESSION = 'zstd'  # 作品库正文压缩: zstd（在本库作品上训练字典后逐篇压缩，需要zstandard）或 none
+    LITERATURE_ZSTD_LEVEL = 3  # 按字典压缩的zstd级别
+    LITERATURE_DICT_SIZE = 112640  # 压缩字典大小（字节）
+    LITERATURE_DICT_MIN_POSTS = 200  # 作品库达到该数量时训练字典，之前的作品不压缩，训练后一并压缩
+    LITERATURE_DICT_SAMPLES = 2000  # 训练字典最多使用的作品数量
+    
+    # 小说格式化（scripts/format_novel.py 和 --format_novels）
+    FORMATTED_DIR = os.path.join(base_dir, 'literature_formatted')  # 格式化结果目录，与 literature/ 的结构相同
+    FORMAT_CACHE_FILE = os.path.join(LOG_DIR, 'format_cache.json')  # 已格式化文件的大小、修改时间和哈希，未变化时跳过
+    FORMAT_WORKERS = os.cpu_count() or 1  # 格式化进程数
+    
+    @staticmethod
+    def get_literature_db(forum_key):
+        """获取板块的文学作品库路径"""
+        return os.path.join(Config.LITERATURE_DIR, Config.get_forum_name(forum_key), Config.LITERATURE_DB_NAME)
     
     @staticmethod
     def get_forum_url(forum_key, page):
@@ -82,6 +198,23 @@ class Config:
             return Config.FORUMS[forum_key]['name']
         return '其他'
     
+    @staticmethod
+    def get_forum_weight(forum_key):
+        """获取板块调度权重"""
+        if forum_key in Config.FORUMS:
+            return Config.FORUMS[forum_key].get('weight', 1.0)
+        return 1.0
+    
+    @staticmethod
+    def get_archive_manifest_file(category, forum_key):
+        """获取指定分类和板块的已归档文件清单路径"""
+        return os.path.join(Config.ARCHIVE_MANIFEST_DIR, f"{category}_{forum_key}.json")
+    
+    @staticmethod
+    def get_archive_chain_dir(category, forum_key):
+        """获取指定分类和板块的归档链目录"""
+        return os.path.join(Config.ARCHIVE_CHAIN_DIR, category, forum_key)
+    
     @staticmethod
     def get_today_zip_filename(prefix):
         """获取包含当前日期和时间的ZIP文件名"""
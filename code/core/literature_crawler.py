@@ -9,6 +9,12 @@ from config.settings import Config
 from utils.logger import logger, load_crawled_urls, save_crawled_url
 from utils.request_utils import request_utils
 from utils.file_utils import file_utils
+from utils.scheduler import CrawlScheduler
+from utils.shutdown import shutdown
+from utils.metrics import metrics
+from utils.literature_store import format_literature
+
+PARSE_SECONDS = metrics.histogram('crawler_parse_seconds', '页面解析耗时（不含请求）', ['stage'])
 
 class LiteratureCrawler:
     """文学爬虫类"""
@@ -18,6 +24,10 @@ class LiteratureCrawler:
         self.base_url = Config.BASE_URL
         self.literature_dir = Config.LITERATURE_DIR
         self.log_file = Config.LITERATURE_LOG_FILE
+        # 设置后作品写入该作品库（LiteratureStore），不再每篇保存一个txt文件
+        self.store = None
+        # 作品保存为txt文件后依次调用的回调，参数为文件路径（如 NovelFormatter.submit）
+        self.post_save_hooks = []
     
     def get_urls_from_page(self, page, forum_key):
         """
@@ -40,7 +50,8 @@ class LiteratureCrawler:
             return []
         
         # 提取URL列表
-        urls = re.findall('a href="(.*?)html"', text)
+        with PARSE_SECONDS.time(stage='list_page'):
+            urls = re.findall('a href="(.*?)html"', text)
         logger.info(f"从页面 {page} 获取到 {len(urls)} 个URL")
         return urls
     
@@ -59,6 +70,7 @@ class LiteratureCrawler:
         if not text:
             return "default", "未知作者", ""
         
+        parse_start = time.perf_counter()
         try:
             soup = BeautifulSoup(text, 'html.parser')
             
@@ -106,20 +118,25 @@ class LiteratureCrawler:
         except Exception as e:
             logger.exception(f"解析文学内容失败: {full_url}")
             return "default", "未知作者", ""
+        finally:
+            PARSE_SECONDS.observe(time.perf_counter() - parse_start, stage='literature_post')
     
-    def save_literature(self, title, author, content, forum_key):
+    def save_literature(self, title, author, content, forum_key, post_url=None):
         """
-        保存文学内容到文件
+        保存文学内容到文件（设置了作品库时写入作品库）
         
         参数:
             title: 标题
             author: 作者
             content: 内容
             forum_key: 板块键名
+            post_url: 帖子URL，写入作品库时用于提取帖子ID
         
         返回:
             True（成功）或False（失败）
         """
+        if self.store:
+            return self.store.add(title, author, content, forum_key, post_url)
         try:
             # 获取板块名称
             forum_name = Config.get_forum_name(forum_key)
@@ -135,29 +152,36 @@ class LiteratureCrawler:
             file_name = os.path.join(literature_dir, f"{safe_title}.txt")
             
             # 格式化内容
-            formatted_content = f"标题：{title}\n"
-            formatted_content += f"作者：{author}\n"
-            formatted_content += f"\n{content}\n"
+            formatted_content = format_literature(title, author, content)
             
             # 写入文件
             with open(file_name, 'w', encoding='utf-8') as f:
                 f.write(formatted_content)
             
             logger.info(f"成功保存文学作品：{file_name}")
+            for hook in self.post_save_hooks:
+                hook(file_name)
             return True
         except Exception as e:
             logger.exception(f"保存文学内容失败: {title}")
             return False
     
-    def crawl(self, forum_key, start_page, end_page, max_posts=None):
+    def _save_crawled_urls(self, urls):
+        """记录作品已提交的帖子为已爬取，并清空列表"""
+        for url in urls:
+            save_crawled_url(url, self.log_file)
+        urls.clear()
+    
+    def crawl(self, forum_key, start_page, end_page, max_posts=None, budget=None):
         """
-        执行文学爬虫任务
+        执行文学爬虫任务，帖子按优先级调度
         
         参数:
             forum_key: 板块键名
             start_page: 起始页面
             end_page: 结束页面
             max_posts: 每页最多处理的帖子数量，None表示无限制
+            budget: 运行预算（RunBudget），设置后在打包预留时间前停止
         
         返回:
             成功爬取的帖子数量
@@ -166,47 +190,55 @@ class LiteratureCrawler:
         logger.info(f"性能限制参数: 每页最多{max_posts if max_posts else '无限制'}个帖子")
         
         # 加载已爬取的URL
-        crawled_urls = load_crawled_urls(self.log_file)
+        crawled_urls = set(load_crawled_urls(self.log_file))
         logger.info(f"已爬取 {len(crawled_urls)} 个帖子")
         
+        scheduler = CrawlScheduler()
+        scheduler.submit_pages(self.get_urls_from_page, forum_key, start_page, end_page, max_posts, crawled_urls)
+        
         success_count = 0
+        # 作品库按批次提交，作品所在的批次提交后才记录为已爬取，
+        # 否则进程被强制结束时缓冲中的作品丢失，而帖子已记录为已爬取，以后不会再抓取
+        uncommitted_urls = []
         
-        # 遍历页面
-        for page in range(start_page, end_page + 1):
-            post_urls = self.get_urls_from_page(str(page), forum_key)
+        # 按优先级处理帖子
+        while True:
+            if shutdown.requested():
+                logger.warning(f"收到退出请求，停止调度，队列中还有 {len(scheduler)} 个任务")
+                break
+            if budget and budget.should_stop():
+                break
             
-            # 应用每页最大帖子数量限制
-            if max_posts and max_posts > 0 and len(post_urls) > max_posts:
-                logger.info(f"页面 {page} 有 {len(post_urls)} 个帖子，限制为 {max_posts} 个")
-                post_urls = post_urls[:max_posts]
+            job = scheduler.next_job()
+            if job is None:
+                break
             
-            # 遍历帖子
-            processed_posts = 0
-            for post_url in post_urls:
-                # 如果已达到每页最大处理数量，跳出循环
-                if max_posts and max_posts > 0 and processed_posts >= max_posts:
-                    logger.info(f"已达到每页最大处理数量 {max_posts}，停止处理此页面")
-                    break
+            try:
+                # 获取文学内容
+                parse_start = time.time()
+                title, author, content = self.get_literature_content(job.url)
+                if budget:
+                    budget.record_post(time.time() - parse_start)
+                
+                # 如果有内容，保存
+                if content:
+                    if self.save_literature(title, author, content, forum_key, job.url):
+                        success_count += 1
                 
-                if post_url not in crawled_urls:
-                    try:
-                        # 获取文学内容
-                        title, author, content = self.get_literature_content(post_url)
-                        
-                        # 如果有内容，保存
-                        if content:
-                            if self.save_literature(title, author, content, forum_key):
-                                success_count += 1
-                                processed_posts += 1
-                        
-                        # 保存已爬取的URL
-                        save_crawled_url(post_url, self.log_file)
-                        
-                    except Exception as e:
-                        logger.exception(f"处理文学帖子失败: {post_url}")
+                # 保存已爬取的URL
+                if self.store:
+                    uncommitted_urls.append(job.url)
+                    if not self.store.pending():
+                        self._save_crawled_urls(uncommitted_urls)
                 else:
-                    logger.info(f"已爬取，跳过: {post_url}")
+                    save_crawled_url(job.url, self.log_file)
+                
+            except Exception as e:
+                logger.exception(f"处理文学帖子失败: {job.url}")
         
+        # 提交最后一批不足批次大小的作品
+        if self.store and self.store.flush():
+            self._save_crawled_urls(uncommitted_urls)
         logger.info(f"爬取完成，成功处理 {success_count} 个文学帖子")
         return success_count
 
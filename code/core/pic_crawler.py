@@ -6,10 +6,23 @@ import re
 import time
 from config.settings import Config
 from utils.logger import logger, load_crawled_urls, save_crawled_url
-from utils.request_utils import request_utils
+from utils.request_utils import request_utils, ContentTooLarge
 from utils.file_utils import file_utils
+from utils.blob_store import BlobStore
+from utils.compression_policy import detect_type, sniff_type, IMAGE_KINDS, SNIFF_SIZE
+from utils.byte_budget import ByteBudget
+from utils.scheduler import CrawlScheduler, CrawlJob
+from utils.checkpoint import CrawlCheckpoint, save_completion_record
+from utils.shutdown import shutdown
+from utils.metrics import metrics
+from utils.tracing import tracer, traced, NOOP_SPAN
 from bs4 import BeautifulSoup
 
+PARSE_SECONDS = metrics.histogram('crawler_parse_seconds', '页面解析耗时（不含请求）', ['stage'])
+POST_SECONDS = metrics.histogram('crawler_post_seconds', '图片帖子从开始下载到结算的耗时',
+                                 buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800))
+IMAGES_TOTAL = metrics.counter('crawler_images_total', '图片下载结果', ['outcome'])
+
 class PicCrawler:
     """图片爬虫类"""
     
@@ -18,7 +31,26 @@ class PicCrawler:
         self.base_url = Config.BASE_URL
         self.pic_dir = Config.PIC_DIR
         self.log_file = Config.PIC_LOG_FILE
+        self.checkpoint_file = Config.PIC_CHECKPOINT_FILE
+        self.completion_file = Config.PIC_COMPLETION_FILE
+        # 设置后图片直接写入该归档（StreamingArchiveSink），不在磁盘上保存散文件
+        self.archive_sink = None
+        # 图片按内容哈希只保存一份，帖子目录中为硬链接（BlobStore），None表示直接保存
+        self.blob_store = BlobStore() if Config.PIC_DEDUP else None
+        # 设置后下载的图片提交到该处理器（ImageProcessor）校验，校验通过才计入帖子进度
+        self.image_processor = None
+        # 单张图片、每个帖子和整次运行的下载字节上限
+        self.byte_budget = ByteBudget()
+    
+    def load_crawled(self):
+        """加载已爬取的帖子URL集合"""
+        return set(load_crawled_urls(self.log_file))
+    
+    def mark_crawled(self, post_url):
+        """记录帖子已爬取完成"""
+        return save_crawled_url(post_url, self.log_file)
     
+    @traced('get_urls_from_page', ('page', 'forum_key'))
     def get_urls_from_page(self, page, forum_key):
         """
         从指定页面获取帖子URL列表
@@ -40,10 +72,12 @@ class PicCrawler:
             return []
         
         # 提取URL列表
-        urls = re.findall('a href="(.*?)html"', text)
+        with PARSE_SECONDS.time(stage='list_page'):
+            urls = re.findall('a href="(.*?)html"', text)
         logger.info(f"从页面 {page} 获取到 {len(urls)} 个URL")
         return urls
     
+    @traced('get_pic_list', ('post_url',))
     def get_pic_list(self, post_url, max_pics=None):
         """
         从帖子页面获取图片列表
@@ -60,6 +94,7 @@ class PicCrawler:
         if not text:
             return "default", []
         
+        parse_start = time.perf_counter()
         try:
             # 提取标题
             title_match = re.findall(r'<title>(.*?)\|', text)
@@ -92,8 +127,11 @@ class PicCrawler:
         except Exception as e:
             logger.exception(f"解析帖子页面失败: {full_url}")
             return "default", []
+        finally:
+            PARSE_SECONDS.observe(time.perf_counter() - parse_start, stage='pic_post')
     
-    def save_pic(self, url, count, title, forum_key):
+    @traced('save_pic', ('url', 'count'), falsy_is_error=True)
+    def save_pic(self, url, count, title, forum_key, max_bytes=None):
         """
         保存单张图片
         
@@ -102,9 +140,13 @@ class PicCrawler:
             count: 图片序号
             title: 标题
             forum_key: 板块键名
+            max_bytes: 允许下载的最大字节数，None表示不限制
         
         返回:
-            True（成功）或False（失败）
+            保存的文件路径（写入归档时为True），失败时返回False
+        
+        异常:
+            ContentTooLarge: 图片超过max_bytes
         """
         try:
             # 获取板块名称
@@ -113,29 +155,46 @@ class PicCrawler:
             # 清理标题，避免文件名非法
             safe_title = file_utils.clean_filename(title)
             
+            # 文件名的扩展名按下载内容的文件头确定，无法识别时依次参考Content-Type和URL路径
+            base_name = f"{safe_title}{count + 1}"
+            _, url_extension, _, _ = detect_type(b'', url=url)
+            fallback_extension = url_extension or '.jpg'  # 默认使用jpg扩展名
+            
+            # 直接写入归档，压缩包内路径与打包散文件时一致，压缩方式与扩展名一起确定
+            if self.archive_sink:
+                info = {}
+                data = request_utils.fetch_content(url, max_bytes=max_bytes, info=info)
+                if data is None:
+                    return False
+                # 归档模式不经过校验进程池，按同样的规则检查文件头，HTML错误页之类不写入归档，稍后重试
+                kind, _ = sniff_type(data[:SNIFF_SIZE])
+                if kind not in IMAGE_KINDS:
+                    logger.warning(f"下载的内容不是图片（{kind or '未知类型'}）: {url}")
+                    return False
+                _, extension, method, level = detect_type(data[:SNIFF_SIZE], info.get('content_type'), url,
+                                                          self.archive_sink.compress_level)
+                arcname = os.path.join(safe_title, base_name + (extension or fallback_extension))
+                return self.archive_sink.add_bytes(arcname, data, method=method, level=level)
+            
             # 创建保存目录
             pic_dir = os.path.join(self.pic_dir, forum_name, safe_title)
             file_utils.create_directory(pic_dir)
             
-            # 确定文件扩展名
-            if '.gif' in url:
-                extension = '.gif'
-            elif '.png' in url:
-                extension = '.png'
-            elif '.jpg' in url:
-                extension = '.jpg'
-            elif '.jpeg' in url:
-                extension = '.jpeg'
-            else:
-                extension = os.path.splitext(url)[1]
-                if not extension:
-                    extension = '.jpg'  # 默认使用jpg扩展名
-            
-            # 构建保存路径
-            file_name = os.path.join(pic_dir, f"{safe_title}{count + 1}{extension}")
-            
             # 下载图片
-            return request_utils.download_file(url, file_name)
+            file_path = os.path.join(pic_dir, base_name + fallback_extension)
+            if self.blob_store:
+                return self.blob_store.fetch(url, file_path, max_bytes=max_bytes)
+            info = {}
+            if not request_utils.download_file(url, file_path, max_bytes=max_bytes, info=info):
+                return False
+            _, extension, _, _ = detect_type(info.get('head', b''), info.get('content_type'), url)
+            if extension and extension != fallback_extension:
+                final_path = os.path.join(pic_dir, base_name + extension)
+                os.replace(file_path, final_path)
+                return final_path
+            return file_path
+        except ContentTooLarge:
+            raise
         except Exception as e:
             logger.exception(f"保存图片失败: {url}")
             return False
@@ -190,6 +249,7 @@ class PicCrawler:
         end_time = time.time()
         logger.info(f"下载完成，成功 {success_count}/{len(url_list)} 张图片")
         logger.info(f"总耗时：{end_time - start_time:.2f} 秒")
+        POST_SECONDS.observe(end_time - start_time)
         
         return success_count
     
@@ -197,18 +257,17 @@ class PicCrawler:
         """多进程下载的包装函数"""
         self.save_pic(url, count, title, forum_key)
     
-    def crawl(self, forum_key, start_page, end_page, use_multiprocess=False, 
-              max_posts=None, max_pics=None):
+    def crawl(self, forum_key, start_page, end_page, max_posts=None, max_pics=None, budget=None):
         """
-        执行爬虫任务
+        执行爬虫任务，帖子与图片均按优先级调度
         
         参数:
             forum_key: 板块键名
             start_page: 起始页面
             end_page: 结束页面
-            use_multiprocess: 是否使用多进程下载
             max_posts: 每页最多处理的帖子数量，None表示无限制
             max_pics: 每个帖子最多下载的图片数量，None表示无限制
+            budget: 运行预算（RunBudget），设置后按实测吞吐量调整图片上限并在打包预留时间前停止
         
         返回:
             成功爬取的帖子数量
@@ -217,49 +276,280 @@ class PicCrawler:
         logger.info(f"性能限制参数: 每页最多{max_posts if max_posts else '无限制'}个帖子，每个帖子最多{max_pics if max_pics else '无限制'}张图片")
         
         # 加载已爬取的URL
-        crawled_urls = load_crawled_urls(self.log_file)
+        crawled_urls = self.load_crawled()
         logger.info(f"已爬取 {len(crawled_urls)} 个帖子")
         
+        scheduler = CrawlScheduler()
+        checkpoint = CrawlCheckpoint(self.checkpoint_file)
+        
+        # 上次运行中断的帖子优先恢复，只下载缺失的图片
+        resumed_urls = set(url for url in checkpoint.posts_for_forum(forum_key) if url not in crawled_urls)
+        for post_url in resumed_urls:
+            scheduler.submit_post(post_url, forum_key, 0)
+        if resumed_urls:
+            logger.info(f"从检查点恢复 {len(resumed_urls)} 个未完成的帖子")
+        
+        scheduler.submit_pages(self.get_urls_from_page, forum_key, start_page, end_page, max_posts,
+                               crawled_urls | resumed_urls)
+        
         success_count = 0
+        # 进行中的帖子：post_url -> 下载进度
+        posts = {}
         
-        # 遍历页面
-        for page in range(start_page, end_page + 1):
-            post_urls = self.get_urls_from_page(str(page), forum_key)
+        while True:
+            if self.image_processor:
+                success_count += self._apply_verified(self.image_processor.collect(), posts, scheduler,
+                                                      checkpoint, forum_key)
+            if shutdown.requested():
+                logger.warning(f"收到退出请求，停止调度，队列中还有 {len(scheduler)} 个任务")
+                break
+            if budget and budget.should_stop():
+                break
+            if self.byte_budget.run_exhausted():
+                break
             
-            # 应用每页最大帖子数量限制
-            if max_posts and max_posts > 0 and len(post_urls) > max_posts:
-                logger.info(f"页面 {page} 有 {len(post_urls)} 个帖子，限制为 {max_posts} 个")
-                post_urls = post_urls[:max_posts]
+            job = scheduler.next_job()
+            if job is None:
+                if self.image_processor and self.image_processor.pending():
+                    # 队列已空，等待校验结果（损坏的图片会重新排队下载）
+                    success_count += self._apply_verified(self.image_processor.collect(timeout=None), posts,
+                                                          scheduler, checkpoint, forum_key)
+                    continue
+                break
             
-            # 遍历帖子
-            processed_posts = 0
-            for post_url in post_urls:
-                # 如果已达到每页最大处理数量，跳出循环
-                if max_posts and max_posts > 0 and processed_posts >= max_posts:
-                    logger.info(f"已达到每页最大处理数量 {max_posts}，停止处理此页面")
-                    break
-                
-                if post_url not in crawled_urls:
-                    try:
+            if job.kind == CrawlJob.POST:
+                post_max_pics = max_pics
+                if budget:
+                    if not budget.can_start_post(scheduler.pending(CrawlJob.ASSET)):
+                        logger.info(f"剩余时间不足，跳过帖子: {job.url}")
+                        continue
+                    post_max_pics = budget.adjust_max_pics(max_pics, scheduler.pending(CrawlJob.POST) + 1)
+                # 帖子的Span从取出任务到结算，其中的图片与其他帖子交错执行，父节点显式传递
+                post_span = tracer.start_span('post', parent=job.payload.get('trace_parent'), track=True,
+                                              url=job.url, forum=forum_key)
+                try:
+                    saved = checkpoint.get(job.url)
+                    attempts = 0
+                    if saved:
+                        title, pic_urls = saved['title'], saved['pic_urls']
+                        done_indices = set(saved['done'])
+                        attempts = saved.get('attempts', 0)
+                    else:
                         # 获取图片列表（带数量限制）
-                        title, pic_urls = self.get_pic_list(post_url, max_pics=max_pics)
-                        
-                        # 如果有图片，下载
-                        if pic_urls:
-                            self.download_pics(pic_urls, title, forum_key, use_multiprocess)
+                        parse_start = time.time()
+                        with tracer.use(post_span):
+                            title, pic_urls = self.get_pic_list(job.url, max_pics=post_max_pics)
+                        if budget:
+                            budget.record_post(time.time() - parse_start)
+                        done_indices = set()
+                    
+                    post_span.set('images', len(pic_urls))
+                    if not pic_urls:
+                        self.mark_crawled(job.url)
+                        post_span.end()
+                    else:
+                        # 将图片拆分为独立任务，与其他帖子的图片一起按优先级排队
+                        missing = [i for i in range(len(pic_urls)) if i not in done_indices]
+                        posts[job.url] = {'title': title, 'pic_urls': pic_urls, 'succeeded': done_indices,
+                                          'remaining': len(missing), 'attempts': attempts,
+                                          'start_time': time.time(), 'job': job, 'retries': {}, 'thumbs': {},
+                                          'oversized': set(), 'deferred': set(), 'span': post_span}
+                        logger.info(f"开始下载 '{title}' 的 {len(missing)}/{len(pic_urls)} 张图片")
+                        for i in missing:
+                            scheduler.submit_asset(pic_urls[i], job, i, payload={'title': title})
+                        if not missing and self._finish_post(job.url, posts, checkpoint, forum_key):
                             success_count += 1
-                            processed_posts += 1
-                        
-                        # 保存已爬取的URL
-                        save_crawled_url(post_url, self.log_file)
-                        
-                    except Exception as e:
-                        logger.exception(f"处理帖子失败: {post_url}")
-                else:
-                    logger.info(f"已爬取，跳过: {post_url}")
+                except Exception as e:
+                    logger.exception(f"处理帖子失败: {job.url}")
+                    post_span.error(e)
+                    if job.url not in posts:
+                        post_span.end()
+                continue
+            
+            progress = posts[job.post_url]
+            asset_start = time.time()
+            bytes_before = request_utils.downloaded_bytes
+            max_bytes = self.byte_budget.allowance(job.post_url)
+            saved = False
+            outcome = 'failed'
+            if max_bytes is not None and max_bytes <= 0:
+                self.byte_budget.defer(job.url)
+                progress['deferred'].add(job.index)
+                outcome = 'deferred'
+            else:
+                try:
+                    with tracer.use(progress.get('span')):
+                        saved = self.save_pic(job.url, job.index, progress['title'], forum_key, max_bytes)
+                except ContentTooLarge as e:
+                    if self.byte_budget.reject(e):
+                        progress['oversized'].add(job.index)
+                        outcome = 'oversized'
+                    else:
+                        progress['deferred'].add(job.index)
+                        outcome = 'deferred'
+            IMAGES_TOTAL.inc(outcome='saved' if saved else outcome)
+            # 只计入保存下来的字节数（中止下载的部分已删除），用于预算和打包时间估算
+            if isinstance(saved, str):
+                saved_bytes = os.path.getsize(saved)
+            else:
+                saved_bytes = request_utils.downloaded_bytes - bytes_before if saved else 0
+            self.byte_budget.record(job.post_url, saved_bytes)
+            if budget:
+                budget.record_asset(time.time() - asset_start, saved_bytes)
+            if saved and self.image_processor and not self.archive_sink:
+                # 在进程池中校验，结果返回后再计入帖子进度
+                self.image_processor.submit(saved, (job.post_url, job.index))
+                continue
+            if saved:
+                progress['succeeded'].add(job.index)
+            progress['remaining'] -= 1
+            
+            if progress['remaining'] == 0 and self._finish_post(job.post_url, posts, checkpoint, forum_key):
+                success_count += 1
+        
+        if self.image_processor:
+            # 取回进行中的校验结果，不再重新下载
+            success_count += self._apply_verified(self.image_processor.collect_all(), posts, scheduler,
+                                                  checkpoint, forum_key, requeue=False)
+        
+        # 被中断的帖子记录逐张图片的进度，下次运行只下载缺失部分（中断不计入尝试次数）
+        for post_url, progress in posts.items():
+            checkpoint.record(post_url, forum_key, progress['title'], progress['pic_urls'],
+                              progress['succeeded'], progress['attempts'])
+            progress.get('span', NOOP_SPAN).end(succeeded=len(progress['succeeded']), interrupted=True)
+        if posts:
+            logger.warning(f"{len(posts)} 个帖子未下载完成，已保存进度，下次运行时继续")
+        checkpoint.save()
+        logger.info(self.byte_budget.summary())
+        if self.blob_store and not self.archive_sink:
+            logger.info(self.blob_store.summary())
+        if self.image_processor:
+            logger.info(self.image_processor.summary())
         
         logger.info(f"爬取完成，成功处理 {success_count} 个帖子")
         return success_count
+    
+    def _apply_verified(self, results, posts, scheduler, checkpoint, forum_key, requeue=True):
+        """
+        处理图片校验结果：有效的图片计入帖子进度（有转码结果时替换原图），损坏的图片删除后重新排队下载
+        
+        参数:
+            results: ImageProcessor.collect 的返回值
+            posts: 进行中的帖子
+            scheduler: 调度器实例
+            checkpoint: 下载进度检查点
+            forum_key: 板块键名
+            requeue: 是否重新下载损坏的图片
+        
+        返回:
+            因此达到完成阈值的帖子数量
+        """
+        finished = 0
+        for (post_url, index), file_path, ok, reason, thumb, transcoded in results:
+            progress = posts.get(post_url)
+            if progress is None:
+                if transcoded and os.path.exists(transcoded[0]):
+                    os.remove(transcoded[0])
+                continue
+            if ok:
+                if transcoded:
+                    self._apply_transcoded(progress['pic_urls'][index], file_path, *transcoded)
+                progress['succeeded'].add(index)
+                if thumb:
+                    progress['thumbs'][index] = thumb
+            else:
+                url = progress['pic_urls'][index]
+                logger.warning(f"图片校验失败，已删除: {file_path}，原因: {reason}")
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                if self.blob_store:
+                    self.blob_store.discard(url)
+                retries = progress['retries'].get(index, 0)
+                if requeue and retries < Config.IMAGE_VERIFY_RETRIES:
+                    progress['retries'][index] = retries + 1
+                    scheduler.submit_asset(url, progress['job'], index, payload={'title': progress['title']})
+                    continue
+            progress['remaining'] -= 1
+            if progress['remaining'] == 0 and self._finish_post(post_url, posts, checkpoint, forum_key):
+                finished += 1
+        return finished
+    
+    def _apply_transcoded(self, url, file_path, part_path, extension):
+        """
+        用转码后的文件替换原图（处理器设置了 keep_original 时保留原图，转码文件另存）
+        
+        参数:
+            url: 图片URL
+            file_path: 原图路径
+            part_path: 转码后的临时文件
+            extension: 转码后的扩展名
+        """
+        try:
+            keep_original = self.image_processor.keep_original
+            if self.blob_store and not keep_original:
+                self.blob_store.replace(url, part_path, file_path, extension)
+                return
+            os.replace(part_path, os.path.splitext(file_path)[0] + extension)
+            if not keep_original:
+                os.remove(file_path)
+        except OSError as e:
+            logger.error(f"替换转码图片失败，保留原图: {file_path}, 错误: {e}")
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    
+    def _finish_post(self, post_url, posts, checkpoint, forum_key):
+        """
+        帖子的图片任务全部执行完毕后结算
+        
+        成功比例达到 POST_SUCCESS_THRESHOLD 时记录为已爬取（超过单张字节上限而跳过的图片不计入总数）；
+        否则保留检查点，下次运行只补下缺失的图片，直到尝试次数达到 POST_MAX_ATTEMPTS。
+        因字节预算不足推迟的图片不算失败：帖子保留在检查点中等下次运行下载，只有其余图片未达到阈值时才计入尝试次数。
+        
+        返回:
+            帖子是否达到完成阈值
+        """
+        progress = posts.pop(post_url)
+        self.byte_budget.finish_post(post_url)
+        succeeded = progress['succeeded']
+        total = len(progress['pic_urls'])
+        oversized = len(progress.get('oversized', ()))
+        deferred = len(progress.get('deferred', set()) - succeeded)
+        attempts = progress['attempts'] + 1
+        logger.info(f"下载完成，成功 {len(succeeded)}/{total} 张图片"
+                    + (f"，{oversized} 张超过单张上限已跳过" if oversized else "")
+                    + (f"，{deferred} 张因字节预算推迟到下次运行" if deferred else ""))
+        logger.info(f"总耗时：{time.time() - progress['start_time']:.2f} 秒")
+        POST_SECONDS.observe(time.time() - progress['start_time'])
+        
+        complete = len(succeeded) >= (total - oversized - deferred) * Config.POST_SUCCESS_THRESHOLD
+        progress.get('span', NOOP_SPAN).end(succeeded=len(succeeded), oversized=oversized, deferred=deferred,
+                                            complete=complete and not deferred)
+        if deferred:
+            # 推迟的图片还没有尝试下载，不能结算；其余图片都达到阈值时不计入尝试次数
+            if complete:
+                attempts = progress['attempts']
+            checkpoint.record(post_url, forum_key, progress['title'], progress['pic_urls'], succeeded, attempts)
+            logger.info(f"帖子 '{progress['title']}' 有 {deferred} 张图片因字节预算推迟，已保存进度，下次运行继续下载")
+            return False
+        if not complete and attempts < Config.POST_MAX_ATTEMPTS:
+            checkpoint.record(post_url, forum_key, progress['title'], progress['pic_urls'], succeeded, attempts)
+            logger.warning(f"帖子 '{progress['title']}' 未达到完成阈值，第 {attempts} 次尝试，"
+                           f"下次运行补下缺失的 {total - len(succeeded)} 张图片")
+            return False
+        
+        if self.image_processor and progress.get('thumbs'):
+            post_dir = os.path.join(self.pic_dir, Config.get_forum_name(forum_key),
+                                    file_utils.clean_filename(progress['title']))
+            self.image_processor.submit_contact_sheet([progress['thumbs'][i] for i in sorted(progress['thumbs'])],
+                                                      os.path.join(post_dir, Config.IMAGE_CONTACT_SHEET_NAME))
+        
+        if not complete:
+            missing = [i for i in range(total) if i not in succeeded]
+            logger.warning(f"帖子 '{progress['title']}' 已尝试 {attempts} 次仍缺少图片 {missing}，不再重试: {post_url}")
+        save_completion_record(self.completion_file, post_url, progress['title'], total, succeeded, complete)
+        self.mark_crawled(post_url)
+        checkpoint.remove(post_url)
+        return complete
 
 # 创建全局图片爬虫实例
 pic_crawler = PicCrawler()
\ No newline at end of file
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import threading
+from contextlib import nullcontext
+from config.settings import Config
+from utils.logger import logger, use_worker_log_file
+from utils.lease_store import LeaseStore
+from utils.checkpoint import CrawlCheckpoint
+from utils.run_budget import RunBudget
+from utils.shutdown import shutdown
+from core.pic_crawler import PicCrawler
+from utils.image_processor import ImageProcessor
+from utils.metrics import metrics
+from utils.tracing import tracer
+
+# 恢复分片：负责处理检查点中上次未完成的帖子
+RESUME_PAGE = 'resume'
+
+def shard_key(run_id, forum_key, page):
+    """构造分片键，例如 20240101080000:pics:0003"""
+    if page == RESUME_PAGE:
+        return f"{run_id}:{forum_key}:{RESUME_PAGE}"
+    return f"{run_id}:{forum_key}:{int(page):04d}"
+
+def parse_shard(shard):
+    """解析分片键，返回 (板块键名, 页面号或RESUME_PAGE)"""
+    _, forum_key, page = shard.rsplit(':', 2)
+    if page == RESUME_PAGE:
+        return forum_key, RESUME_PAGE
+    return forum_key, int(page)
+
+def worker_checkpoint_file(worker_id):
+    """工作进程专属的下载进度检查点路径"""
+    base, ext = os.path.splitext(Config.PIC_CHECKPOINT_FILE)
+    return f"{base}.{worker_id}{ext}"
+
+class ShardedPicCrawler(PicCrawler):
+    """分片模式下的图片爬虫，已爬取状态读写共享的租约存储"""
+
+    def __init__(self, store, worker_id):
+        """
+        初始化分片图片爬虫
+
+        参数:
+            store: 共享的租约存储（LeaseStore）
+            worker_id: 工作进程标识
+        """
+        super().__init__()
+        self.store = store
+        self.worker_id = worker_id
+        self.checkpoint_file = worker_checkpoint_file(worker_id)
+
+    def load_crawled(self):
+        """已爬取状态 = 历史日志 + 本次运行中所有工作进程已完成的帖子"""
+        return super().load_crawled() | self.store.crawled_urls('pic')
+
+    def mark_crawled(self, post_url):
+        """记录到共享存储，运行结束后统一合并到日志文件"""
+        self.store.mark_crawled('pic', post_url)
+        return True
+
+class LeaseHeartbeat(threading.Thread):
+    """后台续租线程，防止长时间运行的分片租约过期被其他进程接管"""
+
+    def __init__(self, store, shard, owner, ttl):
+        super().__init__(daemon=True)
+        self.store = store
+        self.shard = shard
+        self.owner = owner
+        self.ttl = ttl
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.ttl / 3):
+            if not self.store.renew(self.shard, self.owner, self.ttl):
+                logger.warning(f"分片 {self.shard} 续租失败，租约可能已被其他进程接管")
+                return
+
+    def stop(self):
+        self._stopped.set()
+
+def run_shard_worker(worker_id, lease_db, run_id, max_posts=None, max_pics=None,
+                     deadline=None, start_time=None, separate_log=True):
+    """
+    分片工作进程主函数：循环租用分片并爬取，直到没有可租用的分片
+
+    参数:
+        worker_id: 工作进程标识
+        lease_db: 租约数据库路径
+        run_id: 本次运行标识，只租用属于本次运行的分片
+        max_posts: 每页最多处理的帖子数量
+        max_pics: 每个帖子最多下载的图片数量
+        deadline: 运行时间预算（秒），None表示不限制
+        start_time: 运行预算的计时起点
+        separate_log: 是否使用工作进程专属的日志文件
+
+    返回:
+        成功爬取的帖子数量
+    """
+    if separate_log:
+        use_worker_log_file(worker_id)
+    # fork出的进程会继承父进程的指标和追踪，工作进程只统计自己的部分
+    metrics.reset()
+    tracer.reset()
+    shutdown.install()
+
+    store = LeaseStore(lease_db)
+    crawler = ShardedPicCrawler(store, worker_id)
+    if Config.IMAGE_VERIFY:
+        # 多个工作进程同时运行，每个工作进程只用一个校验进程
+        crawler.image_processor = ImageProcessor(workers=1)
+    budget = RunBudget(deadline, start_time=start_time) if deadline else None
+    ttl = Config.SHARD_LEASE_TTL
+    success_count = 0
+
+    logger.info(f"工作进程 {worker_id} 启动，运行标识 {run_id}")
+    while not shutdown.requested() and not (budget and budget.should_stop()):
+        shard = store.acquire(worker_id, ttl, prefix=f"{run_id}:")
+        if shard is None:
+            break
+
+        forum_key, page = parse_shard(shard)
+        logger.info(f"工作进程 {worker_id} 租用分片 {shard}")
+        heartbeat = LeaseHeartbeat(store, shard, worker_id, ttl)
+        heartbeat.start()
+        try:
+            if page == RESUME_PAGE:
+                # 恢复分片处理主检查点中的帖子，不抓取列表页；先把帖子移到本进程的检查点，
+                # 主检查点只在租约数据库写锁内读写，不会与其他工作进程的合并互相覆盖
+                claim_checkpoint_posts(store, worker_id, forum_key)
+                success_count += crawler.crawl(forum_key, 1, 0, max_pics=max_pics, budget=budget)
+            else:
+                success_count += crawler.crawl(forum_key, page, page, max_posts=max_posts,
+                                               max_pics=max_pics, budget=budget)
+
+            if shutdown.requested() or (budget and budget.should_stop()):
+                # 分片未处理完，释放租约让其他进程（或下次运行）接手
+                store.release(shard, worker_id)
+            else:
+                store.complete(shard, worker_id)
+        except Exception as e:
+            logger.exception(f"处理分片失败: {shard}")
+            store.release(shard, worker_id)
+        finally:
+            heartbeat.stop()
+
+    if crawler.image_processor:
+        crawler.image_processor.close()
+    logger.info(f"工作进程 {worker_id} 结束，成功爬取 {success_count} 个帖子")
+    metrics.write(extra={'mode': 'shard_worker', 'worker_id': worker_id, 'run_id': run_id,
+                         'success_count': success_count}, suffix=worker_id)
+    tracer.write(suffix=worker_id)
+    return success_count
+
+def claim_checkpoint_posts(store, worker_id, forum_key):
+    """
+    把主检查点中该板块未完成的帖子移到工作进程的检查点（在租约数据库写锁内）
+
+    参数:
+        store: 共享的租约存储
+        worker_id: 工作进程标识
+        forum_key: 板块键名
+
+    返回:
+        移过来的帖子数量
+    """
+    with store.locked():
+        main_checkpoint = CrawlCheckpoint(Config.PIC_CHECKPOINT_FILE)
+        worker_checkpoint = CrawlCheckpoint(worker_checkpoint_file(worker_id))
+        claimed = main_checkpoint.posts_for_forum(forum_key)
+        for post_url in claimed:
+            entry = main_checkpoint.get(post_url)
+            worker_checkpoint.record(post_url, entry['forum'], entry['title'], entry['pic_urls'], entry['done'],
+                                     entry.get('attempts', 0))
+            main_checkpoint.remove(post_url)
+        if claimed:
+            # 先写工作进程的检查点，中途失败时帖子最多在两边各有一份，不会丢失
+            worker_checkpoint.save()
+            main_checkpoint.save()
+    return len(claimed)
+
+def merge_worker_checkpoints(worker_ids=None, store=None):
+    """
+    将工作进程的下载进度检查点合并到主检查点并删除
+
+    参数:
+        worker_ids: 只合并这些工作进程的检查点，None表示合并全部（所有工作进程退出后调用）
+        store: 设置后在该租约存储的写锁内合并（独立运行的工作进程退出时，其他工作进程可能仍在运行）
+
+    返回:
+        合并的未完成帖子数量
+    """
+    if worker_ids is None:
+        base, ext = os.path.splitext(Config.PIC_CHECKPOINT_FILE)
+        paths = glob.glob(f"{glob.escape(base)}.*{ext}")
+    else:
+        paths = [worker_checkpoint_file(worker_id) for worker_id in worker_ids]
+    merged = 0
+    with store.locked() if store else nullcontext():
+        main_checkpoint = CrawlCheckpoint(Config.PIC_CHECKPOINT_FILE)
+        paths = [path for path in paths if os.path.exists(path)]
+        for path in paths:
+            worker_checkpoint = CrawlCheckpoint(path)
+            for post_url, entry in worker_checkpoint.posts.items():
+                main_checkpoint.record(post_url, entry['forum'], entry['title'], entry['pic_urls'], entry['done'],
+                                       entry.get('attempts', 0))
+                merged += 1
+        if paths:
+            main_checkpoint.save()
+            for path in paths:
+                os.remove(path)
+    return merged
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+打包性能基准测试
+
+在临时目录中生成合成的图片目录树和文学目录树，对比原有的单核 zipfile 打包方式、
+OptimizedZipper 的并行压缩打包方式（按内容选择压缩方式）以及 tar.zst 格式
+（多线程zstd，需要安装zstandard）的耗时和归档大小。
+
+用法:
+    python scripts/benchmark_zip.py --size_mb 2048 --workers 4 --tree all
+"""
+
+import os
+import sys
+
+# 确保能够正确导入项目模块
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+import argparse
+import random
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from config.settings import Config
+from utils.file_utils import OptimizedZipper
+from utils.file_inventory import FileInventory
+from utils.tar_zst_writer import zstd_available, zstandard
+
+def generate_image_tree(root, size_mb, seed=1024):
+    """
+    生成合成图片目录树：每个帖子一个目录，图片为不可压缩的随机数据（与JPEG相近）
+
+    参数:
+        root: 输出根目录
+        size_mb: 目标总大小（MB）
+        seed: 随机种子
+
+    返回:
+        (文件数, 总字节数)
+    """
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    total = 0
+    count = 0
+    post = 0
+    while total < target:
+        post_dir = os.path.join(root, f"帖子{post:04d}")
+        os.makedirs(post_dir, exist_ok=True)
+        for i in range(rng.randint(5, 30)):
+            size = min(rng.randint(50 * 1024, 3 * 1024 * 1024), target - total)
+            with open(os.path.join(post_dir, f"帖子{post:04d}{i + 1}.jpg"), 'wb') as f:
+                # JPEG文件头 + 随机数据
+                f.write(b'\xff\xd8\xff\xe0' + os.urandom(max(size - 4, 0)))
+            total += size
+            count += 1
+            if total >= target:
+                break
+        post += 1
+    return count, total
+
+def generate_literature_tree(root, size_mb, seed=1024):
+    """
+    生成合成文学目录树：每篇文章一个txt文件，由常用汉字组成的段落构成（可压缩、篇与篇之间相似）
+
+    参数:
+        root: 输出根目录
+        size_mb: 目标总大小（MB）
+        seed: 随机种子
+
+    返回:
+        (文件数, 总字节数)
+    """
+    rng = random.Random(seed)
+    words = [chr(c) for c in range(0x4e00, 0x4e00 + 500)] + ['，', '。', '“', '”', '\n']
+    phrases = [''.join(rng.choice(words) for _ in range(rng.randint(4, 12))) for _ in range(2000)]
+    os.makedirs(root, exist_ok=True)
+    target = size_mb * 1024 * 1024
+    total = 0
+    count = 0
+    while total < target:
+        text = ''.join(rng.choice(phrases) for _ in range(rng.randint(2000, 20000)))
+        data = f"标题：文章{count:05d}\n\n{text}\n".encode('utf-8')[:target - total]
+        with open(os.path.join(root, f"文章{count:05d}.txt"), 'wb') as f:
+            f.write(data)
+        total += len(data)
+        count += 1
+    return count, total
+
+def list_entries(source_dir):
+    """返回 (文件路径, 压缩包内路径, 文件大小, stat结果) 列表"""
+    inventory = FileInventory.scan(source_dir)
+    return OptimizedZipper.build_entries(source_dir, inventory.file_sizes, inventory)
+
+def bench_legacy(entries, output_path):
+    """原有方式：单进程 zipfile + ZIP_DEFLATED"""
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for file_path, arcname, _, _ in entries:
+            zipf.write(file_path, arcname)
+
+def bench_parallel(entries, output_path, workers):
+    """并行压缩方式"""
+    zipper = OptimizedZipper(workers=workers)
+    zipper.write_zip(entries, output_path)
+    print(zipper.compression_stats.summary())
+
+def bench_tar_zst(source_dir, output_path):
+    """tar.zst格式：多线程zstd"""
+    zipper = OptimizedZipper(archive_format='tar.zst')
+    _, file_sizes = zipper.get_file_sizes(source_dir)
+    # zip_file_list 按归档格式将 .zip 扩展名替换为 .tar.zst
+    zip_path = output_path[:-len('.tar.zst')] + '.zip'
+    success, _, _, paths = zipper.zip_file_list(source_dir, file_sizes, zip_path)
+    if not success or paths != [output_path]:
+        raise RuntimeError(f"tar.zst打包失败: {paths}")
+
+def verify_zip(output_path):
+    """校验ZIP中所有成员的CRC"""
+    with zipfile.ZipFile(output_path) as zf:
+        return zf.testzip()
+
+def verify_tar_zst(output_path):
+    """解压tar.zst并读取所有成员"""
+    with open(output_path, 'rb') as f:
+        reader = zstandard.ZstdDecompressor(max_window_size=2 ** Config.ZSTD_WINDOW_LOG).stream_reader(f)
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+            for member in tar:
+                if member.isfile():
+                    tar.extractfile(member).read()
+    return None
+
+def run_case(name, func, output_path, verify=verify_zip):
+    """执行一个测试用例并校验结果"""
+    start = time.time()
+    func(output_path)
+    elapsed = time.time() - start
+    size = os.path.getsize(output_path)
+    bad = verify(output_path)
+    status = "校验通过" if bad is None else f"校验失败: {bad}"
+    print(f"{name:<12} 耗时 {elapsed:8.2f} 秒  归档 {size/1024/1024:10.2f} MB  {status}")
+    os.remove(output_path)
+    return elapsed
+
+def bench_tree(name, source_dir, work_dir, workers):
+    """对一个目录树执行所有测试用例"""
+    entries = list_entries(source_dir)
+    total = sum(entry[2] for entry in entries)
+    print(f"\n[{name}] {len(entries)} 个文件，{total/1024/1024:.2f} MB，CPU核数 {os.cpu_count()}，并行进程 {workers}")
+
+    legacy = run_case('zipfile', lambda o: bench_legacy(entries, o), os.path.join(work_dir, 'legacy.zip'))
+    parallel = run_case('parallel', lambda o: bench_parallel(entries, o, workers),
+                        os.path.join(work_dir, 'parallel.zip'))
+    print(f"加速比: {legacy / parallel:.2f}x")
+    if zstd_available():
+        zst = run_case('tar.zst', lambda o: bench_tar_zst(source_dir, o),
+                       os.path.join(work_dir, 'bench.tar.zst'), verify_tar_zst)
+        print(f"tar.zst 相对 zipfile 加速比: {legacy / zst:.2f}x "
+              f"(级别 {Config.ZSTD_LEVEL}，线程 {Config.ZSTD_THREADS}，长距离匹配 {Config.ZSTD_LONG_DISTANCE})")
+    else:
+        print("未安装zstandard，跳过tar.zst测试")
+
+def main():
+    parser = argparse.ArgumentParser(description='打包性能基准测试')
+    parser.add_argument('--size_mb', type=int, default=2048, help='每个合成目录树的总大小（MB）')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='并行压缩进程数')
+    parser.add_argument('--tree', type=str, default='all', choices=['image', 'literature', 'all'],
+                        help='测试的目录树类型')
+    parser.add_argument('--work_dir', type=str, default=None, help='临时目录（默认使用系统临时目录）')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='zip_bench_', dir=args.work_dir)
+    try:
+        if args.tree in ('image', 'all'):
+            source_dir = os.path.join(work_dir, 'pic')
+            generate_image_tree(source_dir, args.size_mb)
+            bench_tree('图片', source_dir, work_dir, args.workers)
+            shutil.rmtree(source_dir)
+        if args.tree in ('literature', 'all'):
+            source_dir = os.path.join(work_dir, 'literature')
+            generate_literature_tree(source_dir, args.size_mb)
+            bench_tree('文学', source_dir, work_dir, args.workers)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
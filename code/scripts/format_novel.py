@@ -1,67 +1,54 @@
+import argparse
 import os
+import sys
 
+# 确保能够正确导入项目模块
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.append(project_root)
 
-def format_novel(input_file_path, output_file_path):
-    """格式化小说文本文件，处理章节标题、对话和段落"""
-    try:
-        with open(input_file_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
-
-        formatted_lines = []
-        in_dialogue = False
+from config.settings import Config
+from utils.novel_formatter import NovelFormatter, format_file
 
-        for line in lines:
-            stripped_line = line.strip()
-            
-            if stripped_line.startswith('##'):
-                # 章节标题
-                formatted_lines.append('\n' + stripped_line + '\n')
-                in_dialogue = False
-            elif stripped_line.startswith('"') and stripped_line.endswith('"'):
-                # 对话行
-                if not in_dialogue:
-                    formatted_lines.append('\n')
-                formatted_lines.append(stripped_line)
-                in_dialogue = True
-            elif stripped_line:
-                # 普通段落
-                if in_dialogue:
-                    formatted_lines.append('\n')
-                formatted_lines.append('    ' + stripped_line)
-                in_dialogue = False
-            else:
-                # 空行
-                formatted_lines.append('\n')
 
-        # 确保输出目录存在
-        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-        
-        with open(output_file_path, 'w', encoding='utf-8') as file:
-            file.writelines(formatted_lines)
-        
+def format_novel(input_file_path, output_file_path):
+    """格式化小说文本文件，处理章节标题、对话和段落（逐行流式处理）"""
+    try:
+        format_file(input_file_path, output_file_path)
         print(f"小说格式化成功: {output_file_path}")
         return True
-        
+
     except Exception as e:
         print(f"小说格式化失败: {e}")
         return False
 
 
+def format_novel_tree(source_dir, output_dir, workers=Config.FORMAT_WORKERS):
+    """批量格式化目录下所有txt文件，输出到相同结构的目录，未变化的文件跳过"""
+    formatter = NovelFormatter(source_dir, output_dir, workers=workers)
+    formatted, skipped, failed = formatter.format_tree()
+    print(f"小说格式化完成: 格式化 {formatted} 个，跳过 {skipped} 个，失败 {failed} 个，输出目录: {output_dir}")
+    return failed == 0
+
+
 if __name__ == "__main__":
-    # 获取当前脚本所在目录
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # 使用示例
-    input_file_path = os.path.join(current_dir, '[現代奇幻] 淫乱的护士 .txt')
-    output_file_path = os.path.join(current_dir, 'formatted_淫乱的护士.txt')
-    
-    # 检查输入文件是否存在
-    if os.path.exists(input_file_path):
-        format_novel(input_file_path, output_file_path)
+    parser = argparse.ArgumentParser(description='小说格式化工具')
+    parser.add_argument('input', nargs='?', default=None,
+                        help='要格式化的小说文件或目录（默认格式化整个文学目录）')
+    parser.add_argument('output', nargs='?', default=None,
+                        help='输出文件或目录（文件默认为 xxx_formatted.txt，目录默认为 literature_formatted/）')
+    parser.add_argument('--workers', type=int, default=Config.FORMAT_WORKERS, help='格式化进程数')
+    args = parser.parse_args()
+
+    input_path = args.input or Config.LITERATURE_DIR
+    if os.path.isdir(input_path):
+        output_path = args.output or (Config.FORMATTED_DIR if args.input is None
+                                      else input_path.rstrip('/\\') + '_formatted')
+        sys.exit(0 if format_novel_tree(input_path, output_path, args.workers) else 1)
+    elif os.path.isfile(input_path):
+        output_path = args.output or input_path.replace('.txt', '_formatted.txt')
+        sys.exit(0 if format_novel(input_path, output_path) else 1)
     else:
-        print(f"输入文件不存在: {input_file_path}")
-        # 提示用户输入文件路径
-        custom_input = input("请输入要格式化的小说文件路径 (留空退出): ")
-        if custom_input:
-            custom_output = custom_input.replace('.txt', '_formatted.txt')
-            format_novel(custom_input, custom_output)
\ No newline at end of file
+        print(f"输入文件不存在: {input_path}")
+        sys.exit(1)
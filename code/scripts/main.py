@@ -11,17 +11,41 @@ if project_root not in sys.path:
     sys.path.append(project_root)
 
 import argparse
+import multiprocessing
 import random
+import socket
 import time
 from config.settings import Config
-from utils.logger import logger
+from utils.logger import logger, set_module_levels
 from utils.file_utils import file_utils, optimized_zipper
+from utils.file_inventory import FileInventory
+from utils.archive_sink import StreamingArchiveSink
+from utils.incremental_archive import IncrementalPackager
+from utils.literature_store import LiteratureStore
+from utils.novel_formatter import NovelFormatter
+from utils.image_processor import ImageProcessor
+from utils.archive_verify import find_checksum_manifests, verify_manifests, checksum_manifest_path
+from utils.run_budget import RunBudget
+from utils.byte_budget import ByteBudget
+from utils.metrics import metrics
+from utils.tracing import tracer
+from utils.shutdown import shutdown
 from core.pic_crawler import pic_crawler
 from core.literature_crawler import literature_crawler
+from core.sharded_crawler import run_shard_worker, merge_worker_checkpoints, shard_key, RESUME_PAGE
+from utils.lease_store import LeaseStore
+from utils.checkpoint import CrawlCheckpoint
 
 class CrawlerMain:
     """爬虫主程序类"""
     
+    # 进程启动时间，运行预算从此刻开始计时
+    start_time = time.time()
+    
+    # 写入指标文件和运行报告的模式（爬取和打包）；verify/export 在爬取之后运行，写入会覆盖爬取的指标，
+    # shard_worker 由工作进程各自写入
+    METRICS_MODES = ('manual', 'auto', 'github_actions', 'literature', 'pic', 'sharded', 'compact')
+    
     @staticmethod
     def parse_arguments():
         """解析命令行参数"""
@@ -29,7 +53,8 @@ class CrawlerMain:
         
         # 模式选择
         parser.add_argument('--mode', '-m', type=str, default='github_actions',
-                            choices=['auto', 'manual', 'github_actions', 'literature', 'pic'],
+                            choices=['auto', 'manual', 'github_actions', 'literature', 'pic',
+                                     'sharded', 'shard_worker', 'compact', 'verify', 'export'],
                             help='爬虫运行模式')
         
         # 通用参数
@@ -47,12 +72,66 @@ class CrawlerMain:
         # 打包参数
         parser.add_argument('--zip', action=argparse.BooleanOptionalAction, default=True,
                             help='是否打包下载的内容')
+        parser.add_argument('--format', type=str, default=Config.ARCHIVE_FORMAT, choices=['zip', 'tar.zst'],
+                            help='归档格式: zip，或tar.zst（多线程zstd，需要安装zstandard）')
+        parser.add_argument('--package', type=str, default=Config.PACKAGING_MODE, choices=['full', 'incremental'],
+                            help='打包方式: full打包整个目录，incremental只打包清单中没有的新增或修改文件')
+        parser.add_argument('--compact', action=argparse.BooleanOptionalAction, default=False,
+                            help='增量打包后将归档链合并为一个全量归档并发布')
+        parser.add_argument('--verify_path', type=str, default=Config.ZIP_OUTPUT_DIR,
+                            help='verify模式下校验的目录、归档或校验清单（默认校验所有待发布的归档）')
+        parser.add_argument('--verify_level', type=str, default=Config.VERIFY_LEVEL, choices=['quick', 'full'],
+                            help='校验级别: quick只检查文件大小和ZIP中央目录，full读取全部数据比对CRC32和SHA-256')
+        parser.add_argument('--storage', type=str, default=Config.PIC_STORAGE, choices=['files', 'archive'],
+                            help='图片存储方式: files保存为散文件后打包，archive下载后直接写入ZIP（需启用--zip）')
+        parser.add_argument('--contact_sheet', action='store_true', default=Config.IMAGE_CONTACT_SHEET,
+                            help='为每个帖子生成缩略图索引图（需要Pillow，仅files存储方式）')
+        parser.add_argument('--transcode', type=str, default=Config.IMAGE_TRANSCODE, choices=['webp', 'avif'],
+                            help='校验后把图片转码为WebP或AVIF以缩小归档（需要Pillow，仅files存储方式）')
+        parser.add_argument('--keep_original', action='store_true', default=Config.IMAGE_KEEP_ORIGINAL,
+                            help='转码后保留原图')
+        
+        # 文学存储参数
+        parser.add_argument('--literature_storage', type=str, default=Config.LITERATURE_STORAGE,
+                            choices=['files', 'sqlite'],
+                            help='文学存储方式: files每篇作品一个txt文件，sqlite写入带全文索引的SQLite作品库')
+        parser.add_argument('--export_dir', type=str, default=Config.LITERATURE_DIR,
+                            help='export模式下txt文件的输出目录')
+        parser.add_argument('--query', type=str, default=None,
+                            help='export模式下只导出全文搜索匹配的作品')
+        parser.add_argument('--format_novels', action='store_true',
+                            help='作品保存后在后台进程中格式化，结果保存到 literature_formatted/（仅files存储方式）；export模式下导出格式化后的文本')
         
         # 性能优化参数
         parser.add_argument('--max_posts', type=int, default=5, 
                             help='每页最多处理的帖子数量')
         parser.add_argument('--max_pics', type=int, default=20, 
                             help='每个帖子最多下载的图片数量')
+        parser.add_argument('--deadline', type=float, default=None,
+                            help='运行时间预算（分钟），设置后根据实测吞吐量调整帖子和图片上限，并为打包预留时间')
+        parser.add_argument('--max_file_mb', type=float, default=Config.PIC_MAX_FILE_BYTES / 1024 / 1024,
+                            help='单张图片的大小上限（MB），下载前按Content-Length检查，超过的图片跳过，0表示不限制')
+        parser.add_argument('--post_budget_mb', type=float, default=Config.PIC_POST_BYTE_BUDGET / 1024 / 1024,
+                            help='每个帖子每次运行最多下载的数据量（MB），超出的图片推迟到下次运行，0表示不限制')
+        parser.add_argument('--run_budget_mb', type=float, default=Config.PIC_RUN_BYTE_BUDGET / 1024 / 1024,
+                            help='每次运行最多下载的图片数据量（MB），用完后保存进度并停止，0表示不限制')
+        
+        # 分片模式参数
+        parser.add_argument('--workers', type=int, default=Config.SHARD_WORKERS,
+                            help='分片模式下启动的工作进程数量')
+        parser.add_argument('--lease_db', type=str, default=Config.SHARD_LEASE_DB,
+                            help='分片租约数据库路径，多个进程或容器需共享同一文件')
+        parser.add_argument('--run_id', type=str, default=None,
+                            help='分片运行标识，同一次运行的所有工作进程必须一致（默认使用当天日期）')
+        parser.add_argument('--worker_id', type=str, default=None,
+                            help='shard_worker模式下的工作进程标识（默认使用主机名和进程号）')
+        
+        # 日志与追踪参数
+        parser.add_argument('--trace', action='store_true',
+                            default=os.environ.get('TRACE', str(Config.TRACE_ENABLED)).lower() == 'true',
+                            help='记录列表页、帖子、图片、下载和打包的耗时，运行结束时导出Chrome trace和OTLP/JSON文件')
+        parser.add_argument('--log_levels', type=str, default=os.environ.get('LOG_MODULE_LEVELS'),
+                            help='按模块设置日志级别，如 request_utils=WARNING,file_utils=WARNING')
         
         return parser.parse_args()
     
@@ -65,17 +144,60 @@ class CrawlerMain:
         end_page = max(args.start_page, args.end_page)
         max_posts = getattr(args, 'max_posts', 5)
         max_pics = getattr(args, 'max_pics', 20)
+        budget = getattr(args, 'budget', None)
+        pic_crawler.byte_budget = ByteBudget(
+            file_limit=int(getattr(args, 'max_file_mb', Config.PIC_MAX_FILE_BYTES / 1024 / 1024) * 1024 * 1024),
+            post_limit=int(getattr(args, 'post_budget_mb', Config.PIC_POST_BYTE_BUDGET / 1024 / 1024) * 1024 * 1024),
+            run_limit=int(getattr(args, 'run_budget_mb', Config.PIC_RUN_BYTE_BUDGET / 1024 / 1024) * 1024 * 1024))
         
         logger.info("===== 开始图片爬虫任务 ====")
         logger.info(f"配置参数: 板块={forum_key}, 页面范围={start_page}-{end_page}, 每页最多{max_posts}个帖子, 每个帖子最多{max_pics}张图片")
         
+        # 归档模式下图片边下载边写入ZIP，爬取结束时只需写入中央目录
+        sink = None
+        if args.zip and getattr(args, 'storage', 'files') == 'archive':
+            sink = StreamingArchiveSink(CrawlerMain.get_zip_output_path('pic'))
+            pic_crawler.archive_sink = sink
+            logger.info(f"图片将直接写入归档: {sink.output_path}")
+        elif Config.IMAGE_VERIFY:
+            # 散文件方式下载的图片在进程池中校验，损坏的图片删除后重新下载
+            pic_crawler.image_processor = ImageProcessor(contact_sheet=getattr(args, 'contact_sheet', False),
+                                                         transcode=getattr(args, 'transcode', None),
+                                                         keep_original=getattr(args, 'keep_original', False))
+        
+        if budget:
+            # 启用预算时由预算决定能处理多少帖子，静态图片上限仅作为初始值
+            max_posts = None
+            pic_dir = os.path.join(Config.PIC_DIR, Config.get_forum_name(forum_key))
+            if sink:
+                # 归档模式没有单独的打包阶段，只需保留安全时间
+                budget.packaging_throughput = float('inf')
+            elif os.path.exists(pic_dir):
+                budget.base_bytes = optimized_zipper.get_file_sizes(pic_dir)[0]
+            logger.info(f"运行预算: 剩余 {budget.remaining()/60:.1f} 分钟，已有待打包数据 {budget.base_bytes/1024/1024:.2f}MB")
+        
         # 传递限制参数给爬虫
-        success_count = pic_crawler.crawl(forum_key, start_page, end_page, use_multiprocess=False, 
-                                         max_posts=max_posts, max_pics=max_pics)
+        try:
+            success_count = pic_crawler.crawl(forum_key, start_page, end_page, max_posts=max_posts,
+                                              max_pics=max_pics, budget=budget)
+        finally:
+            if pic_crawler.image_processor:
+                pic_crawler.image_processor.close()
+                pic_crawler.image_processor = None
+            if sink:
+                # 即使收到退出请求也要写入中央目录，保证已下载的图片可用
+                pic_crawler.archive_sink = None
+                volumes = sink.close()
+                args.archived_files = sink.member_count
         logger.info(f"===== 图片爬虫任务完成，成功爬取 {success_count} 个帖子 ====")
         
-        if args.zip:
-            CrawlerMain.zip_crawled_content('pic', forum_key)
+        if sink:
+            if volumes:
+                CrawlerMain.record_created_zips(volumes)
+            else:
+                logger.warning("没有图片写入归档，未生成ZIP文件")
+        elif args.zip:
+            CrawlerMain.zip_crawled_content('pic', forum_key, **CrawlerMain.packaging_options(args))
     
     @staticmethod
     def run_literature_crawler(args):
@@ -89,12 +211,36 @@ class CrawlerMain:
         logger.info("===== 开始文学爬虫任务 ====")
         logger.info(f"配置参数: 板块={forum_key}, 页面范围={start_page}-{end_page}, 每页最多{max_posts}个帖子")
         
+        # 作品库模式下作品按批次写入板块目录下的SQLite作品库
+        store = None
+        if getattr(args, 'literature_storage', 'files') == 'sqlite':
+            store = LiteratureStore(Config.get_literature_db(forum_key))
+            literature_crawler.store = store
+            logger.info(f"文学作品将写入作品库: {store.db_path}")
+        
+        # 保存的txt文件提交到后台进程格式化，未变化的作品跳过
+        formatter = None
+        if getattr(args, 'format_novels', False) and not store:
+            formatter = NovelFormatter()
+            literature_crawler.post_save_hooks.append(formatter.submit)
+        
         # 传递限制参数给爬虫
-        success_count = literature_crawler.crawl(forum_key, start_page, end_page, max_posts=max_posts)
+        try:
+            success_count = literature_crawler.crawl(forum_key, start_page, end_page, max_posts=max_posts,
+                                                     budget=getattr(args, 'budget', None))
+        finally:
+            if store:
+                store.close()
+                literature_crawler.store = None
+            if formatter:
+                literature_crawler.post_save_hooks.remove(formatter.submit)
+                formatter.close()
+                logger.info(f"小说格式化: 格式化 {formatter.formatted} 个，跳过 {formatter.skipped} 个，"
+                            f"失败 {formatter.failed} 个")
         logger.info(f"===== 文学爬虫任务完成，成功爬取 {success_count} 个帖子 ====")
         
         if args.zip:
-            CrawlerMain.zip_crawled_content('literature', forum_key)
+            CrawlerMain.zip_crawled_content('literature', forum_key, **CrawlerMain.packaging_options(args))
     
     @staticmethod
     def run_manual_mode(args):
@@ -165,10 +311,19 @@ class CrawlerMain:
         end_page = int(os.environ.get('END_PAGE', str(args.end_page)))
         random_forum = os.environ.get('RANDOM_FORUM', str(args.random)).lower() == 'true'
         zip_content = os.environ.get('ZIP_CONTENT', str(args.zip)).lower() == 'true'
+        args.storage = os.environ.get('PIC_STORAGE', args.storage)
+        args.literature_storage = os.environ.get('LITERATURE_STORAGE', args.literature_storage)
+        if os.environ.get('ARCHIVE_FORMAT'):
+            optimized_zipper.set_archive_format(os.environ['ARCHIVE_FORMAT'])
         
         # 读取性能优化参数
         max_posts = int(os.environ.get('MAX_POSTS_PER_PAGE', str(args.max_posts)))
         max_pics = int(os.environ.get('MAX_PICS_PER_POST', str(args.max_pics)))
+        args.run_budget_mb = float(os.environ.get('RUN_BUDGET_MB', str(args.run_budget_mb)))
+        deadline = os.environ.get('DEADLINE_MINUTES')
+        if deadline and args.budget is None:
+            args.deadline = float(deadline)
+            args.budget = RunBudget(args.deadline * 60, start_time=CrawlerMain.start_time)
         
         # 如果需要随机选择板块
         if random_forum:
@@ -194,15 +349,27 @@ class CrawlerMain:
         logger.info(f"- 页面范围: {args.start_page}-{args.end_page}")
         logger.info(f"- 每页最多处理: {args.max_posts}个帖子")
         logger.info(f"- 每个帖子最多下载: {args.max_pics}张图片")
+        logger.info(f"- 运行预算: {f'{args.deadline}分钟' if args.budget else '未设置'}")
+        logger.info(f"- 图片数据量上限: {f'{args.run_budget_mb:.0f}MB' if args.run_budget_mb else '无限制'}")
+        logger.info(f"- 图片存储方式: {args.storage}")
+        logger.info(f"- 文学存储方式: {args.literature_storage}")
+        logger.info(f"- 归档格式: {optimized_zipper.archive_format}")
         
         # 执行爬虫
         CrawlerMain.run_pic_crawler(args)
+        if shutdown.requested():
+            return
         
         # 检查是否有内容被爬取
         forum_name = Config.get_forum_name(forum_key)
         pic_dir = os.path.join(Config.PIC_DIR, forum_name)
         
-        if not os.path.exists(pic_dir) or not os.listdir(pic_dir):
+        if hasattr(args, 'archived_files'):
+            has_content = args.archived_files > 0
+        else:
+            has_content = os.path.exists(pic_dir) and os.listdir(pic_dir)
+        
+        if not has_content:
             logger.warning(f"没有爬取到任何内容，尝试爬取文学板块")
             # 尝试爬取文学板块
             literature_forums = ['literature', 'story', 'poem']
@@ -211,20 +378,194 @@ class CrawlerMain:
             CrawlerMain.run_literature_crawler(args)
     
     @staticmethod
-    def zip_crawled_content(content_type, forum_key):
-        """打包已爬取的内容"""
+    def add_run_shards(args, store, run_id):
+        """为本次运行添加页面分片，检查点中有未完成帖子时额外添加一个恢复分片"""
+        start_page = min(args.start_page, args.end_page)
+        end_page = max(args.start_page, args.end_page)
+        shards = [shard_key(run_id, args.forum, page) for page in range(start_page, end_page + 1)]
+        if CrawlCheckpoint(Config.PIC_CHECKPOINT_FILE).posts_for_forum(args.forum):
+            shards.append(shard_key(run_id, args.forum, RESUME_PAGE))
+        added = store.add_shards(shards)
+        logger.info(f"运行 {run_id}: 共 {len(shards)} 个分片，新增 {added} 个")
+    
+    @staticmethod
+    def run_sharded_mode(args):
+        """运行分片模式：在本机启动多个工作进程，通过租约存储分配页面"""
+        run_id = args.run_id or time.strftime('%Y%m%d%H%M%S')
+        workers = max(args.workers, 1)
+        deadline = args.deadline * 60 if args.deadline else None
+        
+        logger.info("===== 分片爬虫模式 ====")
+        if getattr(args, 'storage', 'files') == 'archive':
+            logger.warning("分片模式的多个工作进程不能共享同一个归档，图片将保存为散文件后打包")
+        logger.info(f"配置参数: 板块={args.forum}, 页面范围={args.start_page}-{args.end_page}, 工作进程={workers}, 运行标识={run_id}")
+        
+        store = LeaseStore(args.lease_db)
+        CrawlerMain.add_run_shards(args, store, run_id)
+        
+        processes = []
+        for i in range(workers):
+            p = multiprocessing.Process(
+                target=run_shard_worker,
+                args=(f"worker-{i}", args.lease_db, run_id, args.max_posts, args.max_pics,
+                      deadline, CrawlerMain.start_time)
+            )
+            p.start()
+            processes.append(p)
+        
+        for p in processes:
+            p.join()
+        
+        # 汇总各工作进程的结果
+        merged_urls = store.merge_into_log('pic', Config.PIC_LOG_FILE)
+        merged_posts = merge_worker_checkpoints()
+        logger.info(f"分片爬取完成: 新增 {merged_urls} 个已爬取帖子，{merged_posts} 个帖子未完成，剩余 {store.pending_shards(run_id + ':')} 个分片")
+        
+        if args.zip:
+            CrawlerMain.zip_crawled_content('pic', args.forum, **CrawlerMain.packaging_options(args))
+    
+    @staticmethod
+    def run_shard_worker_mode(args):
+        """运行单个分片工作进程，用于多个容器或独立进程共享同一个租约数据库"""
+        run_id = args.run_id or Config.get_today_date_string()
+        worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        deadline = args.deadline * 60 if args.deadline else None
+        
+        logger.info("===== 分片工作进程模式 ====")
+        store = LeaseStore(args.lease_db)
+        CrawlerMain.add_run_shards(args, store, run_id)
+        try:
+            run_shard_worker(worker_id, args.lease_db, run_id, args.max_posts, args.max_pics,
+                             deadline, CrawlerMain.start_time)
+        finally:
+            # 没有统一汇总的父进程，退出时自行把未完成帖子的进度合并到主检查点，下次运行的恢复分片会处理
+            merged = merge_worker_checkpoints([worker_id], store)
+            if merged:
+                logger.info(f"已将 {merged} 个未完成帖子的下载进度合并到主检查点")
+        store.merge_into_log('pic', Config.PIC_LOG_FILE)
+    
+    @staticmethod
+    def packaging_options(args):
+        """从命令行参数中提取打包选项"""
+        return {
+            'incremental': getattr(args, 'package', 'full') == 'incremental',
+            'compact': getattr(args, 'compact', False),
+        }
+    
+    @staticmethod
+    def get_incremental_packager(content_type, forum_key):
+        """创建指定内容类型和板块的增量打包器"""
+        category = 'pictures' if content_type == 'pic' else 'literature'
+        return IncrementalPackager(optimized_zipper,
+                                   Config.get_archive_manifest_file(category, forum_key),
+                                   Config.get_archive_chain_dir(category, forum_key))
+    
+    @staticmethod
+    def run_compact_mode(args):
+        """运行合并模式：将图片和文学的增量归档链合并为全量归档，不进行爬取"""
+        logger.info("===== 归档链合并模式 ====")
+        created = []
+        for content_type in ('pic', 'literature'):
+            packager = CrawlerMain.get_incremental_packager(content_type, args.forum)
+            success, file_count, total_size, paths = packager.compact(
+                CrawlerMain.get_zip_output_path(content_type))
+            if success:
+                created.extend(paths)
+        if created:
+            CrawlerMain.record_created_zips(created)
+    
+    @staticmethod
+    def run_export_mode(args):
+        """运行导出模式：从板块的文学作品库重新生成每篇作品一个txt文件的目录结构"""
+        logger.info("===== 文学作品导出模式 ====")
+        db_path = Config.get_literature_db(args.forum)
+        if not os.path.exists(db_path):
+            logger.warning(f"文学作品库不存在: {db_path}")
+            return
+        store = LiteratureStore(db_path)
+        try:
+            store.export(args.export_dir, args.forum, args.query, formatted=args.format_novels)
+        finally:
+            store.close()
+    
+    @staticmethod
+    def run_verify_mode(args):
+        """
+        运行校验模式：按打包时写入的校验清单并行校验归档和分卷
+        
+        返回:
+            是否全部通过
+        """
+        logger.info("===== 归档校验模式 ====")
+        # 默认只校验待发布的归档，增量归档链与发布文件是同一份数据
+        exclude_dirs = [Config.ARCHIVE_CHAIN_DIR] if args.verify_path == Config.ZIP_OUTPUT_DIR else []
+        manifests = find_checksum_manifests(args.verify_path, exclude_dirs)
+        if not manifests:
+            logger.warning(f"没有找到校验清单: {args.verify_path}")
+            return True
+        success, _ = verify_manifests(manifests, level=args.verify_level)
+        return success
+    
+    @staticmethod
+    def zip_crawled_content(content_type, forum_key, incremental=False, compact=False):
+        """
+        打包已爬取的内容
+        
+        参数:
+            content_type: 'pic' 或 'literature'
+            forum_key: 板块键名
+            incremental: 是否只打包清单中没有的新增或修改文件
+            compact: 增量打包后是否将归档链合并为全量归档
+        """
+        if shutdown.requested():
+            logger.warning("收到退出请求，跳过打包")
+            return
+        
         if content_type == 'pic':
             source_dir = os.path.join(Config.PIC_DIR, Config.get_forum_name(forum_key))
         else:
             source_dir = os.path.join(Config.LITERATURE_DIR, Config.get_forum_name(forum_key))
         
-        if not os.path.exists(source_dir) or not os.listdir(source_dir):
+        # 扫描一次源目录，判断是否为空、增量比对和打包共用同一份清单
+        inventory = FileInventory.scan(source_dir)
+        if inventory.is_empty:
             logger.warning(f"源目录为空，跳过打包: {source_dir}")
             return
         
         # 执行打包
         logger.info(f"开始打包 {content_type} 内容")
+        output_path = CrawlerMain.get_zip_output_path(content_type)
+        
+        if incremental:
+            packager = CrawlerMain.get_incremental_packager(content_type, forum_key)
+            success, file_count, total_size, paths = packager.package(source_dir, output_path, inventory)
+            if compact:
+                compacted, file_count, total_size, compact_paths = packager.compact(output_path)
+                if compacted:
+                    success, paths = True, compact_paths
+            if success:
+                logger.info(f"增量打包完成，生成归档文件: {', '.join(paths)}")
+                CrawlerMain.record_created_zips(paths)
+            else:
+                # 没有新内容时删除上次发布的文件，避免重复发布旧内容
+                for path in (optimized_zipper.archive_path(output_path), checksum_manifest_path(output_path)):
+                    if os.path.exists(path):
+                        os.remove(path)
+            return
+        
+        # 执行打包
+        success, file_count, total_size, paths = optimized_zipper.zip_file_list(
+            source_dir, inventory.file_sizes, output_path, inventory)
         
+        if success:
+            logger.info(f"打包完成，生成归档文件: {', '.join(paths)}")
+            CrawlerMain.record_created_zips(paths)
+        else:
+            logger.warning("打包失败，没有生成ZIP文件")
+    
+    @staticmethod
+    def get_zip_output_path(content_type):
+        """返回指定内容类型的ZIP输出路径，并创建分类子目录"""
         # 创建输出文件名
         if content_type == 'pic':
             zip_filename = "每日涩涩-雅俗共赏.zip"
@@ -240,27 +581,43 @@ class CrawlerMain:
         file_utils.create_directory(category_dir)
         
         # 构建完整的输出路径
-        output_path = os.path.join(category_dir, zip_filename)
-        
-        # 执行打包
-        success, file_count, total_size = optimized_zipper.zip_directory(source_dir, output_path)
-        
-        if success:
-            logger.info(f"打包完成，生成ZIP文件: {output_path}")
-            # 记录创建的ZIP文件路径
-            with open(os.path.join(script_dir, 'created_zips.txt'), 'w', encoding='utf-8') as f:
+        return os.path.join(category_dir, zip_filename)
+    
+    @staticmethod
+    def record_created_zips(paths):
+        """记录创建的ZIP文件路径，供GitHub Actions发布使用"""
+        with open(os.path.join(script_dir, 'created_zips.txt'), 'w', encoding='utf-8') as f:
+            for path in paths:
                 # 转换为相对路径，便于GitHub Actions使用
-                rel_path = os.path.relpath(output_path)
-                f.write(f"{rel_path}\n")
-        else:
-            logger.warning("打包失败，没有生成ZIP文件")
+                f.write(f"{os.path.relpath(path)}\n")
 
+    @staticmethod
+    def write_metrics(args):
+        """写入本次运行的Prometheus指标文件、JSON运行报告和追踪文件（只在爬取和打包模式下写入）"""
+        if args is None or args.mode not in CrawlerMain.METRICS_MODES:
+            return
+        metrics.write(extra={'mode': args.mode, 'forum': getattr(args, 'forum', None),
+                             'storage': getattr(args, 'storage', None),
+                             'archive_format': optimized_zipper.archive_format})
+        tracer.write()
+    
     @staticmethod
     def main():
         """主函数"""
+        args = None
         try:
+            # 收到SIGINT/SIGTERM时停止调度新任务，而不是直接中断进行中的下载
+            shutdown.install()
+            
             # 解析命令行参数
             args = CrawlerMain.parse_arguments()
+            if args.log_levels:
+                set_module_levels(args.log_levels)
+            tracer.enabled = args.trace
+            args.budget = None
+            optimized_zipper.set_archive_format(args.format)
+            if args.deadline:
+                args.budget = RunBudget(args.deadline * 60, start_time=CrawlerMain.start_time)
             
             # 创建必要的目录
             file_utils.create_directory(Config.PIC_DIR)
@@ -279,6 +636,20 @@ class CrawlerMain:
                 CrawlerMain.run_literature_crawler(args)
             elif args.mode == 'pic':
                 CrawlerMain.run_pic_crawler(args)
+            elif args.mode == 'sharded':
+                CrawlerMain.run_sharded_mode(args)
+            elif args.mode == 'shard_worker':
+                CrawlerMain.run_shard_worker_mode(args)
+            elif args.mode == 'compact':
+                CrawlerMain.run_compact_mode(args)
+            elif args.mode == 'export':
+                CrawlerMain.run_export_mode(args)
+            elif args.mode == 'verify':
+                return 0 if CrawlerMain.run_verify_mode(args) else 3
+            
+            if shutdown.requested():
+                logger.info("爬虫任务已按退出请求停止，未完成的下载进度已保存")
+                return 1
             
             logger.info("爬虫任务已完成")
             return 0
@@ -288,6 +659,8 @@ class CrawlerMain:
         except Exception as e:
             logger.exception("爬虫任务发生错误")
             return 2
+        finally:
+            CrawlerMain.write_metrics(args)
 
 if __name__ == '__main__':
     sys.exit(CrawlerMain.main())
\ No newline at end of file
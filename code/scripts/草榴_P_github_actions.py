@@ -41,6 +41,10 @@ if __name__ == '__main__':
     logger.info(f"- ZIP_CONTENT: {os.environ.get('ZIP_CONTENT', '未设置')}")
     logger.info(f"- MAX_POSTS_PER_PAGE: {os.environ.get('MAX_POSTS_PER_PAGE', '未设置')}")
     logger.info(f"- MAX_PICS_PER_POST: {os.environ.get('MAX_PICS_PER_POST', '未设置')}")
+    logger.info(f"- DEADLINE_MINUTES: {os.environ.get('DEADLINE_MINUTES', '未设置')}")
+    logger.info(f"- PIC_STORAGE: {os.environ.get('PIC_STORAGE', '未设置')}")
+    logger.info(f"- ARCHIVE_FORMAT: {os.environ.get('ARCHIVE_FORMAT', '未设置')}")
+    logger.info(f"- LITERATURE_STORAGE: {os.environ.get('LITERATURE_STORAGE', '未设置')}")
     
     try:
         # 导入主模块
@@ -1,19 +1,57 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import gc
+import io
+import json
+import logging
 import os
+import struct
 import sys
+import tarfile
+import tempfile
+import time
 import unittest
+import weakref
+import zipfile
+import zlib
+import requests
+from argparse import Namespace
 from unittest.mock import patch, MagicMock
 
 # 添加项目根目录到系统路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config.settings import Config
-from utils.logger import logger
-from utils.file_utils import file_utils
+from utils.logger import logger, Logger, RateLimitFilter, default_logger
+
+# 测试期间的日志写到临时目录，不写入 logs/ 下的运行日志
+default_logger.set_log_file(os.path.join(tempfile.mkdtemp(prefix='scraper_test_logs_'), 'scraper.jsonl'))
+from utils.file_utils import file_utils, OptimizedZipper
 from core.pic_crawler import pic_crawler
 from core.literature_crawler import literature_crawler
+from utils.scheduler import CrawlScheduler, CrawlJob
+from utils.run_budget import RunBudget
+from utils.checkpoint import CrawlCheckpoint
+from utils.shutdown import shutdown
+from utils.lease_store import LeaseStore
+from core.sharded_crawler import claim_checkpoint_posts, merge_worker_checkpoints, worker_checkpoint_file
+from utils.compression_policy import choose_method, sniff_type, detect_type
+from utils.archive_sink import StreamingArchiveSink
+from utils.incremental_archive import IncrementalPackager
+from utils.file_inventory import FileInventory
+from utils.archive_verify import verify_manifests, checksum_manifest_path
+from utils.literature_store import LiteratureStore
+from utils.blob_store import BlobStore
+from utils.byte_budget import ByteBudget
+from utils.metrics import MetricsRegistry, metrics
+from utils.tracing import tracer, NOOP_SPAN
+from utils.request_utils import request_utils
+from utils.novel_formatter import NovelFormatter, format_file
+from utils.image_processor import ImageProcessor, pillow_available, transcode_available
+from utils.tar_zst_writer import TarZstWriter, zstd_available, zstandard
+from utils.atomic_file import atomic_open, atomic_write
+from scripts.main import CrawlerMain
 
 class TestCoreModules(unittest.TestCase):
     """测试核心模块的基本功能"""
@@ -26,9 +64,18 @@ class TestCoreModules(unittest.TestCase):
         # 创建临时测试目录
         self.test_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'test_data')
         file_utils.create_directory(self.test_dir)
+        pic_crawler.checkpoint_file = os.path.join(self.test_dir, 'progress.json')
+        pic_crawler.completion_file = os.path.join(self.test_dir, 'completed.jsonl')
+        self.blob_store = pic_crawler.blob_store
+        pic_crawler.blob_store = BlobStore(os.path.join(self.test_dir, 'blobs'))
     
     def tearDown(self):
         """每个测试用例执行后的清理"""
+        pic_crawler.checkpoint_file = Config.PIC_CHECKPOINT_FILE
+        pic_crawler.completion_file = Config.PIC_COMPLETION_FILE
+        pic_crawler.blob_store.close()
+        pic_crawler.blob_store = self.blob_store
+        
         # 清理临时测试目录
         if os.path.exists(self.test_dir):
             import shutil
@@ -70,13 +117,59 @@ class TestCoreModules(unittest.TestCase):
         # 配置模拟返回值
         mock_download_file.return_value = True
         
-        # 调用函数
-        result = pic_crawler.save_pic('https://example.com/test.jpg', 0, 'test_title', self.test_forum_key)
+        # 调用函数（不使用内容寻址存储时直接下载到帖子目录）
+        with patch.object(pic_crawler, 'blob_store', None):
+            result = pic_crawler.save_pic('https://example.com/test.jpg', 0, 'test_title', self.test_forum_key)
         
         # 验证结果
         self.assertTrue(result)
         mock_download_file.assert_called_once()
     
+    def test_blob_store_dedup(self):
+        """测试图片去重：相同URL不再下载，不同URL的相同内容只保存一份，tar.zst中写为硬链接"""
+        contents = {'https://a.com/1.jpg': b'\xff\xd8\xff' + b'1' * 1000, 'https://b.com/x.jpg': b'\xff\xd8\xff' + b'1' * 1000,
+                    'https://a.com/2.jpg': b'\xff\xd8\xff' + b'2' * 1000}
+        
+        def fake_download(url, save_path, digest=None, **kwargs):
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            with open(save_path, 'wb') as f:
+                f.write(contents[url])
+            digest.update(contents[url])
+            return True
+        
+        pic_dir = os.path.join(self.test_dir, 'pic')
+        with patch.object(pic_crawler, 'pic_dir', pic_dir), \
+                patch('utils.request_utils.request_utils.download_file', side_effect=fake_download) as mock_download:
+            for i, url in enumerate(['https://a.com/1.jpg', 'https://a.com/2.jpg']):
+                self.assertTrue(pic_crawler.save_pic(url, i, '帖子A', 'pics'))
+            # 转帖：同一URL直接链接，另一个URL的相同内容下载后去重
+            for i, url in enumerate(['https://a.com/1.jpg', 'https://b.com/x.jpg']):
+                self.assertTrue(pic_crawler.save_pic(url, i, '帖子B', 'pics'))
+        self.assertEqual(mock_download.call_count, 3)
+        
+        store = pic_crawler.blob_store
+        self.assertEqual((store.stored_files, store.url_hits, store.content_hits), (2, 1, 1))
+        forum_dir = os.path.join(pic_dir, Config.get_forum_name('pics'))
+        inodes = {os.stat(os.path.join(forum_dir, post, name)).st_ino
+                  for post, name in [('帖子A', '帖子A1.jpg'), ('帖子B', '帖子B1.jpg'), ('帖子B', '帖子B2.jpg')]}
+        self.assertEqual(len(inodes), 1)
+        # 内容文件只有两份（不计索引和空的临时目录）
+        self.assertEqual(sum(len(files) for root, _, files in os.walk(store.blob_dir) if root != store.blob_dir), 2)
+        
+        if not zstd_available():
+            return
+        inventory = FileInventory.scan(forum_dir)
+        output_path = os.path.join(self.test_dir, 'zips', 'pics.zip')
+        file_utils.create_directory(os.path.dirname(output_path))
+        zipper = OptimizedZipper(archive_format='tar.zst')
+        success, file_count, _, paths = zipper.zip_file_list(forum_dir, inventory.file_sizes, output_path, inventory)
+        self.assertTrue(success)
+        self.assertEqual(file_count, 4)
+        with open(paths[0], 'rb') as f, zstandard.ZstdDecompressor().stream_reader(f) as stream, \
+                tarfile.open(fileobj=stream, mode='r|') as tar:
+            self.assertEqual(sum(member.islnk() for member in tar), 2)
+        self.assertTrue(verify_manifests([checksum_manifest_path(output_path)], workers=1)[0])
+    
     def test_config_settings(self):
         """测试配置设置的有效性"""
         # 验证基本配置项存在
@@ -113,6 +206,1068 @@ class TestCoreModules(unittest.TestCase):
         self.assertNotIn('<', clean_name)
         self.assertNotIn('>', clean_name)
         self.assertNotIn('|', clean_name)
+        
+        # 原子写入：自动创建目录，写入失败时目标文件不变且不留下临时文件
+        atomic_path = os.path.join(self.test_dir, 'atomic', 'state.json')
+        atomic_write(atomic_path, '{"ok": 1}')
+        with self.assertRaises(ValueError):
+            with atomic_open(atomic_path, 'wb') as f:
+                f.write(b'half')
+                raise ValueError('中断')
+        with open(atomic_path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), '{"ok": 1}')
+        self.assertEqual(os.listdir(os.path.dirname(atomic_path)), ['state.json'])
+
+    def test_scheduler_priority(self):
+        """测试调度器优先级：每个帖子的前几张图片先于其他帖子的靠后图片"""
+        scheduler = CrawlScheduler(aging_rate=0, asset_decay=10)
+        fresh = scheduler.submit_post('fresh', self.test_forum_key, rank=0)
+        old = scheduler.submit_post('old', self.test_forum_key, rank=10)
+        self.assertIs(scheduler.next_job(), fresh)
+        self.assertIs(scheduler.next_job(), old)
+        
+        for i in range(5):
+            scheduler.submit_asset(f'fresh_{i}', fresh, i)
+            scheduler.submit_asset(f'old_{i}', old, i)
+        order = [scheduler.next_job().url for _ in range(len(scheduler))]
+        self.assertLess(order.index('old_0'), order.index('fresh_4'))
+        self.assertLess(order.index('fresh_0'), order.index('old_0'))
+        self.assertEqual(scheduler.pending(CrawlJob.ASSET), 0)
+        
+        # 列表页按全局排名提交，跳过的帖子也占用排名，每页帖子数量受限
+        pages = {'1': ['p1', 'p2', 'p3'], '2': ['p4', 'p5']}
+        submitted = scheduler.submit_pages(lambda page, forum_key: pages[page], self.test_forum_key, 1, 2,
+                                           max_posts=2, skip_urls={'p1'})
+        self.assertEqual(submitted, 3)
+        jobs = [scheduler.next_job() for _ in range(3)]
+        self.assertEqual([job.url for job in jobs], ['p2', 'p4', 'p5'])
+        self.assertEqual(jobs[1].priority, CrawlScheduler.post_priority(self.test_forum_key, 2))
+    
+    @patch('utils.scheduler.time.time')
+    def test_scheduler_aging(self, mock_time):
+        """测试调度器老化：等待足够久的低优先级任务不会饿死"""
+        mock_time.return_value = 1000.0
+        scheduler = CrawlScheduler(aging_rate=1.0)
+        low = scheduler.submit_post('low', self.test_forum_key, rank=100)
+        mock_time.return_value = 2000.0
+        scheduler.submit_post('high', self.test_forum_key, rank=0)
+        self.assertIs(scheduler.next_job(), low)
+    
+    @patch('core.pic_crawler.save_crawled_url')
+    @patch('core.pic_crawler.load_crawled_urls', return_value=[])
+    @patch.object(pic_crawler, 'save_pic', return_value=True)
+    @patch.object(pic_crawler, 'get_pic_list')
+    @patch.object(pic_crawler, 'get_urls_from_page', return_value=['a', 'b'])
+    def test_pic_crawl_scheduled(self, mock_urls, mock_pic_list, mock_save_pic, mock_load, mock_save_url):
+        """测试图片爬虫通过调度器交错下载各帖子的图片"""
+        mock_pic_list.side_effect = lambda url, max_pics=None: (url, [f'{url}{i}.jpg' for i in range(3)])
+        
+        success_count = pic_crawler.crawl(self.test_forum_key, 1, 1)
+        
+        self.assertEqual(success_count, 2)
+        downloaded = [c.args[0] for c in mock_save_pic.call_args_list]
+        self.assertLess(downloaded.index('b0.jpg'), downloaded.index('a2.jpg'))
+        self.assertEqual(sorted(c.args[0] for c in mock_save_url.call_args_list), ['a', 'b'])
+
+    @unittest.skipUnless(pillow_available(), "未安装Pillow")
+    @patch('core.pic_crawler.save_crawled_url')
+    @patch('core.pic_crawler.load_crawled_urls', return_value=[])
+    @patch.object(pic_crawler, 'get_urls_from_page', return_value=['post'])
+    @patch.object(pic_crawler, 'get_pic_list', return_value=('校验', ['good.png', 'flaky.png', 'truncated.png']))
+    def test_image_verification(self, mock_pic_list, mock_urls, mock_load, mock_save_url):
+        """测试图片校验：损坏的图片删除后重新下载，重试后仍损坏的计为失败，完成的帖子生成索引图"""
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), 'red').save(buffer, 'PNG')
+        png = buffer.getvalue()
+        attempts = {}
+        
+        def fake_download(url, save_path, digest=None, **kwargs):
+            attempts[url] = attempts.get(url, 0) + 1
+            # flaky第一次返回HTML错误页，truncated始终被截断
+            data = {'good.png': png, 'flaky.png': png if attempts[url] > 1 else b'<html>502</html>',
+                    'truncated.png': png[:len(png) // 2]}[url]
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            with open(save_path, 'wb') as f:
+                f.write(data)
+            digest.update(data)
+            return True
+        
+        pic_dir = os.path.join(self.test_dir, 'pic')
+        processor = ImageProcessor(workers=1, contact_sheet=True)
+        with patch.object(pic_crawler, 'pic_dir', pic_dir), patch.object(pic_crawler, 'image_processor', processor), \
+                patch.object(Config, 'POST_SUCCESS_THRESHOLD', 0.5), \
+                patch('utils.request_utils.request_utils.download_file', side_effect=fake_download):
+            self.assertEqual(pic_crawler.crawl(self.test_forum_key, 1, 1), 1)
+        processor.close()
+        
+        self.assertEqual(attempts, {'good.png': 1, 'flaky.png': 2, 'truncated.png': 1 + Config.IMAGE_VERIFY_RETRIES})
+        self.assertEqual((processor.verified, processor.broken), (2, 2 + Config.IMAGE_VERIFY_RETRIES))
+        post_dir = os.path.join(pic_dir, Config.get_forum_name(self.test_forum_key), '校验')
+        self.assertEqual(sorted(os.listdir(post_dir)), sorted([Config.IMAGE_CONTACT_SHEET_NAME, '校验1.png', '校验2.png']))
+        with Image.open(os.path.join(post_dir, Config.IMAGE_CONTACT_SHEET_NAME)) as sheet:
+            self.assertEqual(sheet.size, (2 * Config.IMAGE_THUMB_SIZE, Config.IMAGE_THUMB_SIZE))
+
+    @unittest.skipUnless(transcode_available('webp'), "Pillow不支持WebP")
+    @patch('core.pic_crawler.save_crawled_url')
+    @patch('core.pic_crawler.load_crawled_urls', return_value=[])
+    @patch.object(pic_crawler, 'get_urls_from_page', return_value=['post'])
+    @patch.object(pic_crawler, 'get_pic_list', return_value=('转码', ['photo.png', 'small.webp']))
+    def test_image_transcode(self, mock_pic_list, mock_urls, mock_load, mock_save_url):
+        """测试图片转码：原图替换为缩小后的WebP，已是WebP的图片保持不变，再次出现的URL直接链接转码结果"""
+        from PIL import Image
+        images = {}
+        for name, size, fmt in (('photo.png', (800, 600), 'PNG'), ('small.webp', (32, 32), 'WEBP')):
+            buffer = io.BytesIO()
+            Image.effect_noise(size, 64).convert('RGB').save(buffer, fmt)
+            images[name] = buffer.getvalue()
+
+        def fake_download(url, save_path, digest=None, **kwargs):
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            with open(save_path, 'wb') as f:
+                f.write(images[url])
+            digest.update(images[url])
+            return True
+
+        pic_dir = os.path.join(self.test_dir, 'pic')
+        processor = ImageProcessor(workers=1, transcode='webp')
+        with patch.object(pic_crawler, 'pic_dir', pic_dir), patch.object(pic_crawler, 'image_processor', processor), \
+                patch.object(Config, 'IMAGE_MAX_DIMENSION', 400), \
+                patch('utils.request_utils.request_utils.download_file', side_effect=fake_download):
+            self.assertEqual(pic_crawler.crawl(self.test_forum_key, 1, 1), 1)
+        processor.close()
+
+        self.assertEqual(processor.transcoded, 1)
+        self.assertLess(processor.bytes_after, processor.bytes_before)
+        post_dir = os.path.join(pic_dir, Config.get_forum_name(self.test_forum_key), '转码')
+        self.assertEqual(sorted(os.listdir(post_dir)), ['转码1.webp', '转码2.webp'])
+        with Image.open(os.path.join(post_dir, '转码1.webp')) as img:
+            self.assertEqual(img.size, (400, 300))
+
+        # 原内容文件已删除，同一URL再次出现时链接转码后的内容
+        repost_path = os.path.join(self.test_dir, 'repost', 'a.png')
+        self.assertEqual(pic_crawler.blob_store.fetch('photo.png', repost_path),
+                         os.path.join(self.test_dir, 'repost', 'a.webp'))
+        blob_count = sum(len(files) for root, _, files in os.walk(pic_crawler.blob_store.blob_dir)
+                         if root != pic_crawler.blob_store.blob_dir)
+        self.assertEqual(blob_count, 2)
+
+    def test_run_budget(self):
+        """测试运行预算：按吞吐量调整图片上限，并为打包预留时间"""
+        budget = RunBudget(600, packaging_throughput=1024 * 1024, safety_margin=60)
+        self.assertEqual(budget.adjust_max_pics(20, 1), 20)
+        self.assertFalse(budget.should_stop())
+        
+        budget.record_asset(1.0, 1024 * 1024)
+        # 待处理的帖子远多于剩余时间能处理的数量时保持默认上限，而不是平分到最低上限
+        self.assertEqual(budget.adjust_max_pics(20, 1000), 20)
+        self.assertGreater(budget.adjust_max_pics(20, 2), 20)
+        
+        # GitHub Actions的典型规模：5小时预算，每张图片0.5秒，20页共约2000个待处理帖子
+        budget = RunBudget(5 * 3600, packaging_throughput=50 * 1024 * 1024)
+        budget.record_post(1.0)
+        budget.record_asset(0.5, 512 * 1024)
+        self.assertEqual(budget.adjust_max_pics(50, 2000), 50)
+        self.assertEqual(budget.adjust_max_pics(50, 10), Config.BUDGET_MAX_PICS)
+        # 剩余时间只够处理一个帖子的一部分图片时降低上限
+        budget.deadline = time.time() + budget.packaging_reserve() + 3.5
+        self.assertEqual(budget.adjust_max_pics(50, 2000), Config.BUDGET_MIN_PICS)
+        
+        # 磁盘上的数据量足够大时，打包预留时间会吞掉全部剩余时间
+        budget.base_bytes = 600 * 1024 * 1024
+        self.assertTrue(budget.should_stop())
+        self.assertFalse(budget.can_start_post(0))
+
+    @patch('utils.request_utils.time.sleep')
+    @patch('core.pic_crawler.save_crawled_url')
+    @patch('core.pic_crawler.load_crawled_urls', return_value=[])
+    @patch.object(pic_crawler, 'get_urls_from_page', return_value=['post'])
+    @patch.object(pic_crawler, 'get_pic_list', return_value=('预算', ['big.jpg', 'a.jpg', 'b.jpg', 'c.jpg']))
+    def test_byte_budget(self, mock_pic_list, mock_urls, mock_load, mock_save_url, mock_sleep):
+        """测试字节预算：超过单张上限的图片只读取响应头就跳过，超出帖子预算的图片中止下载并推迟到下次运行"""
+        bodies = {name: b'\xff\xd8\xff' + fill * (size - 3)
+                  for name, fill, size in [('big.jpg', b'x', 30), ('a.jpg', b'a', 8), ('b.jpg', b'b', 8), ('c.jpg', b'c', 8)]}
+        read_urls = []
+
+        def fake_get(url, **kwargs):
+            response = MagicMock()
+            # big.jpg带有Content-Length，其余图片没有，只能边下载边检查
+            response.headers = {'Content-Length': '30'} if url == 'big.jpg' else {}
+            response.iter_content.side_effect = lambda chunk_size: read_urls.append(url) or iter(
+                [bodies[url][:4], bodies[url][4:]])
+            return response
+
+        pic_dir = os.path.join(self.test_dir, 'pic')
+        byte_budget = ByteBudget(file_limit=20, post_limit=20, run_limit=0)
+        with patch.object(pic_crawler, 'pic_dir', pic_dir), patch.object(pic_crawler, 'byte_budget', byte_budget), \
+                patch('utils.request_utils.requests.get', side_effect=fake_get) as mock_get:
+            self.assertEqual(pic_crawler.crawl(self.test_forum_key, 1, 1), 0)
+        self.assertEqual((byte_budget.oversized, byte_budget.deferred, byte_budget.run_bytes), (1, 1, 16))
+        self.assertEqual(mock_get.call_count, 4)
+        self.assertEqual(read_urls, ['a.jpg', 'b.jpg', 'c.jpg'])
+        post_dir = os.path.join(pic_dir, Config.get_forum_name(self.test_forum_key), '预算')
+        self.assertEqual(sorted(os.listdir(post_dir)), ['预算2.jpg', '预算3.jpg'])
+        # 跳过的图片不计入完成判定，但推迟的图片仍然缺失，帖子保留进度
+        self.assertEqual(CrawlCheckpoint(pic_crawler.checkpoint_file).missing_indices('post'), [0, 3])
+
+    @patch('utils.request_utils.time.sleep')
+    @patch('core.pic_crawler.save_crawled_url')
+    @patch('core.pic_crawler.load_crawled_urls', return_value=[])
+    @patch.object(pic_crawler, 'get_urls_from_page', return_value=['post'])
+    @patch.object(pic_crawler, 'get_pic_list', return_value=('分批', ['0.jpg', '1.jpg', '2.jpg', '3.jpg']))
+    def test_byte_budget_deferred_runs(self, mock_pic_list, mock_urls, mock_load, mock_save_url, mock_sleep):
+        """测试帖子预算每次只够下载一张图片时，推迟的图片不计入尝试次数，多于POST_MAX_ATTEMPTS次运行后仍能下载完整"""
+        def fake_get(url, **kwargs):
+            response = MagicMock()
+            response.headers = {}
+            response.iter_content.side_effect = lambda chunk_size: iter([b'\xff\xd8\xff' + url[0].encode() * 5])
+            return response
+
+        pic_dir = os.path.join(self.test_dir, 'pic')
+        runs = Config.POST_MAX_ATTEMPTS + 1
+        with patch.object(pic_crawler, 'pic_dir', pic_dir), \
+                patch.object(pic_crawler, 'byte_budget', ByteBudget(file_limit=0, post_limit=8, run_limit=0)), \
+                patch('utils.request_utils.requests.get', side_effect=fake_get):
+            for run in range(runs):
+                completed = pic_crawler.crawl(self.test_forum_key, 1, 1)
+                if run < runs - 1:
+                    self.assertEqual(completed, 0)
+                    saved = CrawlCheckpoint(pic_crawler.checkpoint_file).get('post')
+                    self.assertEqual((sorted(saved['done']), saved.get('attempts', 0)), (list(range(run + 1)), 0))
+                    mock_save_url.assert_not_called()
+        self.assertEqual(completed, 1)
+        mock_save_url.assert_called_once()
+        self.assertIsNone(CrawlCheckpoint(pic_crawler.checkpoint_file).get('post'))
+        post_dir = os.path.join(pic_dir, Config.get_forum_name(self.test_forum_key), '分批')
+        self.assertEqual(sorted(os.listdir(post_dir)), [f'分批{i}.jpg' for i in range(1, 5)])
+
+    @patch('core.pic_crawler.save_crawled_url')
+    @patch('core.pic_crawler.load_crawled_urls', return_value=[])
+    @patch.object(pic_crawler, 'get_pic_list', return_value=('a', ['a0.jpg', 'a1.jpg', 'a2.jpg']))
+    @patch.object(pic_crawler, 'get_urls_from_page', return_value=['a'])
+    def test_pic_crawl_shutdown_resume(self, mock_urls, mock_pic_list, mock_load, mock_save_url):
+        """测试收到退出请求后保存逐图进度，下次运行只下载缺失的图片"""
+        
+        def interrupted_save(url, count, title, forum_key, max_bytes=None):
+            shutdown.request()
+            return True
+        
+        try:
+            with patch.object(pic_crawler, 'save_pic', side_effect=interrupted_save):
+                pic_crawler.crawl(self.test_forum_key, 1, 1)
+        finally:
+            shutdown.reset()
+        
+        mock_save_url.assert_not_called()
+        checkpoint = CrawlCheckpoint(pic_crawler.checkpoint_file)
+        self.assertEqual(checkpoint.missing_indices('a'), [1, 2])
+        
+        with patch.object(pic_crawler, 'save_pic', return_value=True) as mock_save_pic:
+            success_count = pic_crawler.crawl(self.test_forum_key, 1, 1)
+        
+        self.assertEqual(success_count, 1)
+        self.assertEqual([c.args[0] for c in mock_save_pic.call_args_list], ['a1.jpg', 'a2.jpg'])
+        mock_save_url.assert_called_once_with('a', pic_crawler.log_file)
+        self.assertEqual(len(CrawlCheckpoint(pic_crawler.checkpoint_file)), 0)
+    
+    @patch('utils.request_utils.time.sleep')
+    def test_request_shutdown(self, mock_sleep):
+        """测试收到退出请求后请求不再重试，宽限期内的请求超时不超过宽限期"""
+        def failing_get(url, timeout=None, **kwargs):
+            shutdown.request()
+            raise requests.exceptions.ConnectionError('reset')
+        try:
+            with patch('utils.request_utils.requests.get', side_effect=failing_get) as mock_get:
+                self.assertIsNone(request_utils.get('https://example.com/page', retry=3, timeout=30))
+            self.assertEqual(mock_get.call_count, 1)
+            self.assertEqual(mock_sleep.call_count, 1)
+            with patch('utils.request_utils.requests.get', return_value=MagicMock()) as mock_get:
+                self.assertIsNotNone(request_utils.get('https://example.com/page', timeout=60))
+            self.assertLessEqual(mock_get.call_args.kwargs['timeout'], shutdown.grace_period)
+            with patch.object(shutdown, 'grace_period', 0), \
+                    patch('utils.request_utils.requests.get') as mock_get:
+                self.assertIsNone(request_utils.get('https://example.com/page'))
+            mock_get.assert_not_called()
+        finally:
+            shutdown.reset()
+
+    @patch('core.pic_crawler.save_crawled_url')
+    @patch('core.pic_crawler.load_crawled_urls', return_value=[])
+    @patch.object(pic_crawler, 'get_pic_list', return_value=('a', ['a0.jpg', 'a1.jpg', 'a2.jpg', 'a3.jpg']))
+    @patch.object(pic_crawler, 'get_urls_from_page', return_value=['a'])
+    def test_pic_crawl_success_threshold(self, mock_urls, mock_pic_list, mock_load, mock_save_url):
+        """测试图片失败的帖子不会被标记为已完成，后续运行只补下缺失的图片"""
+        with patch.object(Config, 'POST_SUCCESS_THRESHOLD', 0.75), patch.object(Config, 'POST_MAX_ATTEMPTS', 2):
+            with patch.object(pic_crawler, 'save_pic', side_effect=lambda url, *args: url == 'a0.jpg') as mock_save_pic:
+                self.assertEqual(pic_crawler.crawl(self.test_forum_key, 1, 1), 0)
+            mock_save_url.assert_not_called()
+            self.assertEqual(mock_save_pic.call_count, 4)
+            
+            # 第二次运行只下载缺失的图片；仍未达到阈值且尝试次数用尽，记录缺失后放弃
+            with patch.object(pic_crawler, 'save_pic', side_effect=lambda url, *args: url == 'a1.jpg') as mock_save_pic:
+                self.assertEqual(pic_crawler.crawl(self.test_forum_key, 1, 1), 0)
+            self.assertEqual([c.args[0] for c in mock_save_pic.call_args_list], ['a1.jpg', 'a2.jpg', 'a3.jpg'])
+            mock_save_url.assert_called_once_with('a', pic_crawler.log_file)
+        
+        with open(pic_crawler.completion_file, encoding='utf-8') as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record['succeeded'], [0, 1])
+        self.assertFalse(record['complete'])
+    
+    @patch('utils.lease_store.time.time')
+    def test_lease_store(self, mock_time):
+        """测试分片租约：独占租用、过期接管以及已爬取状态合并"""
+        mock_time.return_value = 1000.0
+        store = LeaseStore(os.path.join(self.test_dir, 'leases.db'))
+        store.add_shards(['run:pics:0001', 'run:pics:0002'])
+        
+        self.assertEqual(store.acquire('w1', 60, prefix='run:'), 'run:pics:0001')
+        self.assertEqual(store.acquire('w2', 60, prefix='run:'), 'run:pics:0002')
+        self.assertIsNone(store.acquire('w3', 60, prefix='run:'))
+        
+        # w1完成分片，w2的租约过期后由w3接管
+        store.complete('run:pics:0001', 'w1')
+        mock_time.return_value = 1100.0
+        self.assertEqual(store.acquire('w3', 60, prefix='run:'), 'run:pics:0002')
+        self.assertFalse(store.renew('run:pics:0002', 'w2', 60))
+        
+        log_file = os.path.join(self.test_dir, 'crawled.log')
+        with open(log_file, 'w', encoding='utf-8') as f:
+            f.write('a\n')
+        store.mark_crawled('pic', 'a')
+        store.mark_crawled('pic', 'b')
+        self.assertEqual(store.merge_into_log('pic', log_file), 1)
+        with open(log_file, encoding='utf-8') as f:
+            self.assertEqual(f.read().split(), ['a', 'b'])
+
+    def test_worker_checkpoint_merge(self):
+        """测试独立工作进程的下载进度：恢复分片先移走主检查点中的帖子，退出时只合并自己的检查点"""
+        main_file = os.path.join(self.test_dir, 'pic_progress.json')
+        store = LeaseStore(os.path.join(self.test_dir, 'leases.db'))
+        with patch.object(Config, 'PIC_CHECKPOINT_FILE', main_file):
+            main = CrawlCheckpoint(main_file)
+            main.record('a', 'pics', 'A', ['a0', 'a1'], [0], attempts=1)
+            main.record('b', 'other', 'B', ['b0'], [])
+            main.save()
+            self.assertEqual(claim_checkpoint_posts(store, 'w1', 'pics'), 1)
+            self.assertEqual(list(CrawlCheckpoint(main_file).posts), ['b'])
+            self.assertEqual(CrawlCheckpoint(worker_checkpoint_file('w1')).get('a')['attempts'], 1)
+            
+            other = CrawlCheckpoint(worker_checkpoint_file('w2'))
+            other.record('c', 'pics', 'C', ['c0', 'c1'], [1])
+            other.save()
+            # w2 先退出：只合并自己的检查点，w1 仍在处理的帖子不受影响
+            self.assertEqual(merge_worker_checkpoints(['w2'], store), 1)
+            self.assertEqual(sorted(CrawlCheckpoint(main_file).posts), ['b', 'c'])
+            self.assertTrue(os.path.exists(worker_checkpoint_file('w1')))
+            self.assertFalse(os.path.exists(worker_checkpoint_file('w2')))
+            self.assertEqual(merge_worker_checkpoints(['w1'], store), 1)
+            self.assertEqual(CrawlCheckpoint(main_file).missing_indices('a'), [1])
+            self.assertEqual(merge_worker_checkpoints(['w1'], store), 0)
+    
+    def test_parallel_zip(self):
+        """测试并行压缩生成的ZIP可被标准zipfile正确解压"""
+        source_dir = os.path.join(self.test_dir, '技术交流')
+        file_utils.create_directory(os.path.join(source_dir, '帖子'))
+        contents = {
+            os.path.join('帖子', '图1.jpg'): os.urandom(50000),
+            os.path.join('帖子', '图2.jpg'): b'',
+            'note.txt': '文字内容'.encode('utf-8') * 1000,
+        }
+        for name, data in contents.items():
+            with open(os.path.join(source_dir, name), 'wb') as f:
+                f.write(data)
+        
+        output_path = os.path.join(self.test_dir, 'out.zip')
+        success, file_count, total_size = OptimizedZipper(workers=2).zip_directory(source_dir, output_path)
+        
+        self.assertTrue(success)
+        self.assertEqual(file_count, 3)
+        self.assertEqual(total_size, sum(len(d) for d in contents.values()))
+        with zipfile.ZipFile(output_path) as zf:
+            self.assertIsNone(zf.testzip())
+            for name, data in contents.items():
+                self.assertEqual(zf.read(name.replace(os.sep, '/')), data)
+
+    def test_compression_policy(self):
+        """测试按文件头魔数选择压缩方式：已压缩媒体直接存储，文本使用DEFLATE"""
+        self.assertEqual(sniff_type(b'\xff\xd8\xff\xe0' + b'0' * 20), ('jpeg', '.jpg'))
+        self.assertEqual(sniff_type(b'RIFF\x00\x00\x00\x00WEBPVP8 '), ('webp', '.webp'))
+        # BMP要求DIB头大小有效，以 "BM" 开头的文本不是BMP
+        bmp = b'BM' + struct.pack('<IHHII', 70, 0, 0, 54, 40) + b'\x00' * 40
+        self.assertEqual(sniff_type(bmp), ('bmp', '.bmp'))
+        self.assertEqual(sniff_type(b'BMW 3 series review'), ('text', '.txt'))
+        self.assertEqual(choose_method(b'GIF89a' + b'0' * 100)[1], zipfile.ZIP_STORED)
+        self.assertEqual(choose_method('标题：测试\n'.encode('utf-8') * 100)[:2], ('text', zipfile.ZIP_DEFLATED))
+        # 未知类型通过试压决定：随机数据不可压缩，直接存储
+        self.assertEqual(choose_method(b'\x00' + os.urandom(4096))[1], zipfile.ZIP_STORED)
+        self.assertEqual(choose_method(b'\x00\x01' * 4096)[1], zipfile.ZIP_DEFLATED)
+        
+        # 扩展名与内容不符时以内容为准
+        source_dir = os.path.join(self.test_dir, 'policy')
+        file_utils.create_directory(source_dir)
+        with open(os.path.join(source_dir, 'really_png.jpg.txt'), 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n' + b'\x00' * 10000)
+        with open(os.path.join(source_dir, 'novel.txt'), 'wb') as f:
+            f.write('正文'.encode('utf-8') * 10000)
+        zipper = OptimizedZipper(workers=1)
+        success, _, _ = zipper.zip_directory(source_dir, os.path.join(self.test_dir, 'policy.zip'))
+        self.assertTrue(success)
+        with zipfile.ZipFile(os.path.join(self.test_dir, 'policy.zip')) as zf:
+            self.assertEqual(zf.getinfo('really_png.jpg.txt').compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zf.getinfo('novel.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(zipper.compression_stats.stored_files, 1)
+        self.assertGreater(zipper.compression_stats.estimated_cpu_saved(), 0)
+    
+    @patch('utils.request_utils.time.sleep')
+    def test_metrics(self, mock_sleep):
+        """测试运行指标：计数器、仪表和直方图输出为Prometheus文本和JSON报告，请求按主机记录耗时和重试"""
+        registry = MetricsRegistry()
+        requests_total = registry.counter('t_requests_total', '请求次数', ['host'])
+        depth = registry.gauge('t_queue_depth', '队列深度', ['kind'])
+        latency = registry.histogram('t_seconds', '耗时', buckets=(0.1, 1))
+        bytes_total = registry.counter('t_bytes_total', '字节数', ['host'])
+        seconds_total = registry.counter('t_read_seconds_total', '读取耗时', ['host'])
+        registry.ratio('t_bytes_per_second', 't_bytes_total', 't_read_seconds_total')
+        requests_total.inc(host='a.com')
+        requests_total.inc(2, host='b"c')
+        for value in (5, 2):
+            depth.set(value, kind='post')
+        for value in (0.05, 0.5, 0.5, 3):
+            latency.observe(value)
+        bytes_total.inc(1000, host='a.com')
+        seconds_total.inc(0.5, host='a.com')
+        with self.assertRaises(ValueError):
+            requests_total.inc(kind='x')
+        
+        text = registry.render_prometheus()
+        self.assertIn('# TYPE t_seconds histogram', text)
+        self.assertIn('t_requests_total{host="b\\"c"} 2.0', text)
+        self.assertIn('t_seconds_bucket{le="1.0"} 3', text)
+        self.assertIn('t_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn('t_seconds_count 4', text)
+        report = registry.report({'mode': 'test'})
+        self.assertEqual(report['metrics']['t_queue_depth']['series'][0], {'labels': {'kind': 'post'}, 'value': 2, 'max': 5})
+        self.assertEqual(report['metrics']['t_seconds']['series'][0]['p50'], 1)
+        self.assertEqual(report['derived']['t_bytes_per_second'], [{'labels': {'host': 'a.com'}, 'value': 2000.0}])
+        report_path = registry.write(os.path.join(self.test_dir, 'metrics', 'crawler.prom'),
+                                     os.path.join(self.test_dir, 'metrics'), {'mode': 'test'})
+        with open(report_path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['run'], {'mode': 'test'})
+        
+        # 请求工具按主机记录每次尝试的耗时、结果和重试次数
+        counter = metrics.get('crawler_requests_total')
+        before = (counter.value(host='img.example.com', outcome='ok'), counter.value(host='img.example.com', outcome='error'))
+        with patch('utils.request_utils.requests.get',
+                   side_effect=[requests.exceptions.ConnectionError('reset'), MagicMock()]):
+            self.assertIsNotNone(request_utils.get('https://img.example.com/a.jpg', retry=1, delay=0))
+        self.assertEqual((counter.value(host='img.example.com', outcome='ok'), counter.value(host='img.example.com', outcome='error')),
+                         (before[0] + 1, before[1] + 1))
+        self.assertGreaterEqual(metrics.get('crawler_request_retries_total').value(host='img.example.com'), 1)
+        
+        # 校验和导出模式在爬取之后运行，不覆盖爬取写入的指标文件和运行报告
+        with patch.object(metrics, 'write') as mock_write, patch.object(tracer, 'write') as mock_trace_write:
+            for mode in ('verify', 'export', 'shard_worker'):
+                CrawlerMain.write_metrics(Namespace(mode=mode))
+            self.assertFalse(mock_write.called or mock_trace_write.called)
+            CrawlerMain.write_metrics(Namespace(mode='pic'))
+            self.assertEqual(mock_write.call_args.kwargs['extra']['mode'], 'pic')
+            mock_trace_write.assert_called_once()
+    
+    def test_async_logging(self):
+        """测试异步日志：文件为JSON行，按模块设置级别，同一位置的INFO日志限速，警告不受限"""
+        log_file = os.path.join(self.test_dir, 'async.jsonl')
+        if os.path.exists(log_file):
+            os.remove(log_file)
+        log = Logger(log_file, 'test_async_logging', module_levels={'request_utils': 'WARNING'})
+        log.rate_filter = RateLimitFilter(rate=1, burst=3)
+        log.queue_handler.filters[-1] = log.rate_filter
+        for i in range(10):
+            log.logger.info(f"请求 {i}")
+        log.logger.warning("警告")
+        try:
+            raise ValueError("错误")
+        except ValueError:
+            log.logger.exception("异常")
+        log.module_filter.set_levels({'test_core': 'ERROR'})
+        log.logger.warning("被模块级别过滤")
+        # 同名的第二个实例共用第一个实例的处理器和后台线程
+        same = Logger(None, 'test_async_logging')
+        self.assertIs(same.queue_handler, log.queue_handler)
+        self.assertEqual(len(log.logger.handlers), 1)
+        same.stop()
+        self.assertIsNone(log.listener)
+        
+        with open(log_file, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f]
+        messages = [entry['message'] for entry in entries]
+        self.assertEqual(messages[:3], ['请求 0', '请求 1', '请求 2'])
+        self.assertIn('警告', messages)
+        self.assertNotIn('请求 3', messages)
+        self.assertNotIn('被模块级别过滤', messages)
+        self.assertIn('本次运行限速省略了 7 条日志', messages)
+        error = entries[messages.index('异常')]
+        self.assertEqual((error['level'], error['module']), ('ERROR', 'test_core'))
+        self.assertIn('ValueError: 错误', error['exception'])
+        with self.assertRaises(ValueError):
+            log.module_filter.set_levels({'request_utils': 'LOUD'})
+        log.module_filter.set_levels({'request_utils': 'warning', 'file_utils': 10})
+        self.assertEqual(log.module_filter.levels, {'request_utils': logging.WARNING, 'file_utils': logging.DEBUG})
+    
+    @patch('utils.request_utils.time.sleep')
+    @patch('core.pic_crawler.save_crawled_url')
+    @patch('core.pic_crawler.load_crawled_urls', return_value=[])
+    @patch('utils.request_utils.request_utils.get_text')
+    def test_tracing(self, mock_get_text, mock_load, mock_save_url, mock_sleep):
+        """测试追踪：列表页 -> 帖子 -> 图片 -> 下载 的父子关系，失败的下载标记为错误，导出Chrome trace和OTLP文件"""
+        self.assertIs(tracer.start_span('关闭时'), NOOP_SPAN)
+        mock_get_text.side_effect = lambda url: ('<a href="post1html"></a>' if 'thread' in url
+                                                  else "<title>追踪|</title><img ess-data='ok.jpg'><img ess-data='bad.jpg'>")
+
+        def fake_get(url, **kwargs):
+            if url == 'bad.jpg':
+                raise requests.exceptions.ConnectionError('连接失败')
+            response = MagicMock()
+            response.headers = {}
+            response.iter_content.return_value = iter([b'\xff\xd8\xff' + b'x' * 10])
+            return response
+
+        tracer.enabled = True
+        tracer.reset()
+        try:
+            with patch.object(pic_crawler, 'pic_dir', os.path.join(self.test_dir, 'pic')), \
+                    patch('utils.request_utils.requests.get', side_effect=fake_get):
+                pic_crawler.crawl(self.test_forum_key, 1, 1)
+            paths = tracer.write(os.path.join(self.test_dir, 'traces'))
+        finally:
+            tracer.enabled = False
+        
+        spans = {span.span_id: span for span in tracer.spans}
+        by_name = {}
+        for span in spans.values():
+            by_name.setdefault(span.name, []).append(span)
+        page, post = by_name['page'][0], by_name['post'][0]
+        self.assertEqual(by_name['get_urls_from_page'][0].parent_id, page.span_id)
+        self.assertEqual(post.parent_id, page.span_id)
+        self.assertEqual(by_name['get_pic_list'][0].parent_id, post.span_id)
+        self.assertEqual([spans[span.parent_id].name for span in by_name['download_file']], ['save_pic', 'save_pic'])
+        self.assertTrue(all(span.parent_id == post.span_id for span in by_name['save_pic']))
+        self.assertEqual(len({span.trace_id for span in spans.values()}), 1)
+        failed = {span.attributes['url'] for span in by_name['save_pic'] if span.status_message}
+        self.assertEqual(failed, {'bad.jpg'})
+        self.assertEqual((post.attributes['succeeded'], post.attributes['complete']), (1, False))
+        
+        chrome_path, otlp_path = paths
+        with open(chrome_path, encoding='utf-8') as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual(sum(1 for event in events if event['ph'] == 'X'), len(spans))
+        with open(otlp_path, encoding='utf-8') as f:
+            otlp_spans = json.loads(f.readline())['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual({span['name'] for span in otlp_spans}, set(by_name))
+        self.assertTrue(all(len(span['traceId']) == 32 and len(span['spanId']) == 16 for span in otlp_spans))
+        tracer.reset()
+    
+    def test_detect_type(self):
+        """测试下载文件的类型判断：文件头优先，其次Content-Type，最后只看URL路径的扩展名"""
+        png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 100
+        self.assertEqual(detect_type(png, 'image/jpeg', 'https://a.com/x.jpg')[:3], ('png', '.png', zipfile.ZIP_STORED))
+        self.assertEqual(detect_type(b'', 'image/webp; charset=binary', 'https://a.com/x.jpg')[1], '.webp')
+        self.assertEqual(detect_type(b'', None, 'https://a.com/x.PNG?from=.jpg')[1], '.png')
+        self.assertIsNone(detect_type(b'', None, 'https://cdn.a.com/img?id=1.jpg')[1])
+        
+        def fake_download(url, save_path, info=None, **kwargs):
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            with open(save_path, 'wb') as f:
+                f.write(png)
+            kwargs['digest'].update(png)
+            info.update(content_type='image/png', head=png[:16])
+            return True
+        
+        # 无扩展名的CDN地址、查询参数中带 .jpg 的地址都按内容命名；URL再次出现时沿用记录的扩展名
+        pic_dir = os.path.join(self.test_dir, 'pic')
+        with patch.object(pic_crawler, 'pic_dir', pic_dir), \
+                patch('utils.request_utils.request_utils.download_file', side_effect=fake_download):
+            for url in ['https://cdn.a.com/img/123', 'https://a.com/view.php?f=.jpg']:
+                path = pic_crawler.save_pic(url, 0, '类型', 'pics')
+                self.assertTrue(path.endswith('类型1.png'))
+                self.assertEqual(pic_crawler.save_pic(url, 1, '类型', 'pics'), path[:-len('1.png')] + '2.png')
+    
+    @patch('utils.request_utils.RequestUtils.fetch_content')
+    def test_archive_sink(self, mock_fetch):
+        """测试归档模式：图片直接写入ZIP，超过分卷大小时滚动到新分卷"""
+        output_path = os.path.join(self.test_dir, 'archive', 'pics.zip')
+        sink = StreamingArchiveSink(output_path, volume_size=25 * 1024)
+        mock_fetch.side_effect = [b'\xff\xd8\xff\xe0' + os.urandom(10 * 1024) for _ in range(5)]
+        pic_crawler.archive_sink = sink
+        try:
+            for i in range(5):
+                self.assertTrue(pic_crawler.save_pic(f"https://example.com/{i}.jpg", i, "测试标题", "pics"))
+        finally:
+            pic_crawler.archive_sink = None
+        volumes = sink.close()
+        
+        # 没有在磁盘上留下散文件
+        self.assertFalse(os.path.exists(os.path.join(Config.PIC_DIR, Config.get_forum_name('pics'), '测试标题')))
+        self.assertEqual(len(volumes), 3)
+        names = []
+        for volume in volumes:
+            self.assertLessEqual(os.path.getsize(volume), 25 * 1024)
+            with zipfile.ZipFile(volume) as zf:
+                self.assertIsNone(zf.testzip())
+                names.extend(zf.namelist())
+        self.assertEqual(names, [f"测试标题/测试标题{i + 1}.jpg" for i in range(5)])
+        self.assertFalse(sink.add_bytes('late.txt', b'x'))
+        
+        # 不经过校验进程池时同样拒绝HTML错误页，返回False稍后重试，不写入归档
+        error_sink = StreamingArchiveSink(os.path.join(self.test_dir, 'archive', 'errors.zip'))
+        mock_fetch.side_effect = [b'<html><title>404 Not Found</title></html>']
+        pic_crawler.archive_sink = error_sink
+        try:
+            self.assertFalse(pic_crawler.save_pic("https://example.com/missing.jpg", 0, "测试标题", "pics"))
+        finally:
+            pic_crawler.archive_sink = None
+        self.assertEqual(error_sink.close(), [])
+        
+        # 只有一个分卷时使用最终文件名
+        single = StreamingArchiveSink(output_path)
+        single.add_bytes('a.txt', '正文'.encode('utf-8') * 1000)
+        self.assertEqual(single.close(), [output_path])
+        with zipfile.ZipFile(output_path) as zf:
+            self.assertEqual(zf.getinfo('a.txt').compress_type, zipfile.ZIP_DEFLATED)
+    
+    def test_incremental_packaging(self):
+        """测试增量打包：只打包新增或修改的文件，合并归档链后得到全量归档"""
+        source_dir = os.path.join(self.test_dir, 'incremental', 'src')
+        chain_dir = os.path.join(self.test_dir, 'incremental', 'chain')
+        manifest_path = os.path.join(self.test_dir, 'incremental', 'manifest.json')
+        output_path = os.path.join(self.test_dir, 'incremental', 'release.zip')
+        file_utils.create_directory(os.path.join(source_dir, '帖子'))
+        
+        def write(name, data):
+            with open(os.path.join(source_dir, name), 'wb') as f:
+                f.write(data)
+        
+        def names(path):
+            with zipfile.ZipFile(path) as zf:
+                self.assertIsNone(zf.testzip())
+                return sorted(zf.namelist())
+        
+        write('帖子/1.jpg', b'\xff\xd8\xff\xe0' + os.urandom(2048))
+        write('帖子/2.jpg', b'\xff\xd8\xff\xe0' + os.urandom(2048))
+        packager = IncrementalPackager(OptimizedZipper(workers=1), manifest_path, chain_dir)
+        success, count, _, paths = packager.package(source_dir, output_path)
+        self.assertTrue(success)
+        self.assertEqual((count, paths), (2, [output_path]))
+        
+        # 没有变化时不打包；只改修改时间、内容不变也不算修改
+        os.utime(os.path.join(source_dir, '帖子/1.jpg'), (0, 0))
+        packager = IncrementalPackager(OptimizedZipper(workers=1), manifest_path, chain_dir)
+        self.assertFalse(packager.package(source_dir, output_path)[0])
+        
+        write('帖子/3.jpg', b'\xff\xd8\xff\xe0' + os.urandom(2048))
+        write('帖子/2.jpg', b'\xff\xd8\xff\xe0' + os.urandom(4096))
+        success, count, _, _ = packager.package(source_dir, output_path)
+        self.assertTrue(success)
+        self.assertEqual(names(output_path), ['帖子/2.jpg', '帖子/3.jpg'])
+        self.assertEqual([a['kind'] for a in packager.manifest.archives], ['full', 'delta'])
+        
+        # 合并后全量归档中每个文件只保留最新版本，旧归档被删除
+        success, count, _, _ = packager.compact(output_path)
+        self.assertTrue(success)
+        self.assertEqual(names(output_path), ['帖子/1.jpg', '帖子/2.jpg', '帖子/3.jpg'])
+        with zipfile.ZipFile(output_path) as zf:
+            with open(os.path.join(source_dir, '帖子/2.jpg'), 'rb') as f:
+                self.assertEqual(zf.read('帖子/2.jpg'), f.read())
+        self.assertEqual(len(packager.manifest.archives), 1)
+        # 归档链中只剩合并后的全量归档及其校验清单，发布的文件可以通过校验
+        self.assertEqual(sorted(os.listdir(chain_dir)), ['full_0003.zip', 'full_0003_checksums.json'])
+        self.assertTrue(verify_manifests([checksum_manifest_path(output_path)], workers=1)[0])
+    
+    def read_split_zip(self, paths):
+        """按APPNOTE解析分段ZIP（偏移量相对于各自的分段），返回 {文件名: 内容}"""
+        segments = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                segments.append(f.read())
+        starts = [sum(len(x) for x in segments[:i]) for i in range(len(segments))]
+        data = b''.join(segments)
+        _, disk, cd_disk, _, count, _, cd_offset, _ = struct.unpack('<IHHHHIIH', data[-22:])
+        self.assertEqual(disk, len(paths) - 1)
+        pos = starts[cd_disk] + cd_offset
+        contents = {}
+        for _ in range(count):
+            fields = struct.unpack('<IHHHHHHIIIHHHHHII', data[pos:pos + 46])
+            name = data[pos + 46:pos + 46 + fields[10]].decode('utf-8')
+            local = starts[fields[13]] + fields[16]
+            name_length, extra_length = struct.unpack('<HH', data[local + 26:local + 30])
+            raw = data[local + 30 + name_length + extra_length:][:fields[8]]
+            content = zlib.decompress(raw, -15) if fields[4] == zipfile.ZIP_DEFLATED else raw
+            self.assertEqual(zlib.crc32(content), fields[7])
+            contents[name] = content
+            pos += 46 + fields[10] + fields[11] + fields[12]
+        return contents
+    
+    def test_volume_packing(self):
+        """测试分卷打包：FFD分组，每个分卷不超过上限，超大文件使用分段ZIP跨分卷存储"""
+        source_dir = os.path.join(self.test_dir, 'volumes', 'src')
+        file_utils.create_directory(os.path.join(source_dir, '帖子'))
+        contents = {}
+        for i, size_kb in enumerate([30, 20, 20, 15, 10, 10, 5, 150]):
+            name = f"帖子/{i + 1}.jpg"
+            contents[name] = b'\xff\xd8\xff\xe0' + os.urandom(size_kb * 1024 - 4)
+            with open(os.path.join(source_dir, name), 'wb') as f:
+                f.write(contents[name])
+        
+        zipper = OptimizedZipper(workers=1)
+        zipper.VOLUME_SIZE = 64 * 1024
+        _, file_sizes = zipper.get_file_sizes(source_dir)
+        groups = zipper.group_files_for_volume(file_sizes)
+        # 超大文件单独成组，其余110KB装入两个分卷，没有空分组
+        self.assertEqual([len(group) for group in groups], [1, 3, 4])
+        
+        output_path = os.path.join(self.test_dir, 'volumes', 'pics.zip')
+        success, file_count, _ = zipper.zip_directory(source_dir, output_path)
+        self.assertTrue(success)
+        self.assertEqual(file_count, 8)
+        
+        volumes = [os.path.join(self.test_dir, 'volumes', name)
+                   for name in sorted(os.listdir(os.path.join(self.test_dir, 'volumes'))) if '_part' in name]
+        segments = [path for path in volumes if '_part1.' in path]
+        self.assertEqual([os.path.basename(p) for p in segments],
+                         ['pics_part1.z01', 'pics_part1.z02', 'pics_part1.zip'])
+        for path in volumes:
+            self.assertLessEqual(os.path.getsize(path), zipper.VOLUME_SIZE)
+        with open(segments[0], 'rb') as f:
+            self.assertEqual(f.read(4), b'PK\x07\x08')
+        # 分段按 .z01、.z02 ... .zip 的顺序拼接
+        unpacked = self.read_split_zip(segments)
+        for path in volumes:
+            if path.endswith('.zip') and path not in segments:
+                with zipfile.ZipFile(path) as zf:
+                    self.assertIsNone(zf.testzip())
+                    unpacked.update({name: zf.read(name) for name in zf.namelist()})
+        self.assertEqual(unpacked, contents)
+
+    def test_parallel_volumes(self):
+        """测试并行创建分卷：分卷命名、顺序和内容与顺序写入一致，每个分卷不超过上限"""
+        source_dir = os.path.join(self.test_dir, 'parallel_volumes', 'src')
+        file_utils.create_directory(os.path.join(source_dir, '帖子'))
+        contents = {}
+        for i, size_kb in enumerate([40, 30, 30, 20, 10, 150]):
+            name = f"帖子/{i + 1}.jpg"
+            contents[name] = b'\xff\xd8\xff\xe0' + os.urandom(size_kb * 1024 - 4)
+            with open(os.path.join(source_dir, name), 'wb') as f:
+                f.write(contents[name])
+        contents['帖子/info.txt'] = '文本内容'.encode('utf-8') * 3000
+        with open(os.path.join(source_dir, '帖子/info.txt'), 'wb') as f:
+            f.write(contents['帖子/info.txt'])
+        
+        results = {}
+        for volume_workers in (1, 3):
+            output_dir = os.path.join(self.test_dir, 'parallel_volumes', str(volume_workers))
+            zipper = OptimizedZipper(workers=1, volume_workers=volume_workers)
+            zipper.VOLUME_SIZE = 64 * 1024
+            success, file_count, _ = zipper.zip_directory(source_dir, os.path.join(output_dir, 'pics.zip'))
+            self.assertTrue(success)
+            self.assertEqual(file_count, 7)
+            volumes = sorted(name for name in os.listdir(output_dir) if '_part' in name)
+            unpacked = self.read_split_zip([os.path.join(output_dir, name) for name in volumes
+                                            if name.startswith('pics_part1.')])
+            for name in volumes:
+                path = os.path.join(output_dir, name)
+                self.assertLessEqual(os.path.getsize(path), zipper.VOLUME_SIZE)
+                if name.endswith('.zip') and not name.startswith('pics_part1.'):
+                    with zipfile.ZipFile(path) as zf:
+                        unpacked.update({n: zf.read(n) for n in zf.namelist()})
+            self.assertEqual(unpacked, contents)
+            with open(os.path.join(output_dir, 'pics_volume_info.txt'), encoding='utf-8') as f:
+                info = [line.split(': ')[1] for line in f.read().splitlines() if line.startswith('分卷')]
+            self.assertTrue(verify_manifests([os.path.join(output_dir, 'pics_checksums.json')], workers=1)[0])
+            results[volume_workers] = (volumes, info)
+        # 分卷信息按分组顺序列出：超大文件的分段在前，其余分卷依次编号
+        for volumes, info in results.values():
+            self.assertEqual(info[:3], ['pics_part1.z01', 'pics_part1.z02', 'pics_part1.zip'])
+            self.assertEqual(info[3:], [f"pics_part{i}.zip" for i in range(2, len(info) - 1)])
+            self.assertEqual(sorted(info), volumes)
+
+    def test_estimated_volume_packing(self):
+        """测试分卷按估算的压缩后大小分组：可压缩的文本不拆出小分卷，估算偏小的文件写入时换到后续分卷"""
+        source_dir = os.path.join(self.test_dir, 'estimated', 'src')
+        file_utils.create_directory(os.path.join(source_dir, '文章'))
+        for i, size_kb in enumerate([160, 90, 60, 40, 30, 20, 10, 5]):
+            with open(os.path.join(source_dir, f"文章/{i + 1}.txt"), 'wb') as f:
+                f.write(('第%d段帖子内容，' % i).encode('utf-8') * (size_kb * 1024 // 25))
+        for archive_format, volume_workers in (('zip', 1), ('zip', 3), ('tar.zst', 1)):
+            output_dir = os.path.join(self.test_dir, 'estimated', f"{archive_format}_{volume_workers}")
+            zipper = OptimizedZipper(workers=1, volume_workers=volume_workers, archive_format=archive_format)
+            zipper.VOLUME_SIZE = 150000
+            _, file_sizes = zipper.get_file_sizes(source_dir)
+            success, _, _, paths = zipper.zip_file_list(source_dir, file_sizes,
+                                                        os.path.join(output_dir, 'text.zip'))
+            self.assertTrue(success)
+            # 按压缩上限需要3个以上分卷，实际压缩后只需要一个
+            self.assertEqual([os.path.basename(path) for path in paths],
+                             [f"text_part1.{archive_format}"])
+
+        # 文件开头可压缩、后面是随机数据时估算偏小，写入时按实际大小换卷
+        source_dir = os.path.join(self.test_dir, 'estimated', 'mixed')
+        file_utils.create_directory(os.path.join(source_dir, '帖子'))
+        contents = {}
+        for i in range(3):
+            contents[f"帖子/{i + 1}.jpg"] = b'\xff\xd8\xff\xe0' + os.urandom(100 * 1024 - 4)
+            contents[f"帖子/{i + 1}.bin"] = b'a' * 70000 + os.urandom(60000)
+        for name, data in contents.items():
+            with open(os.path.join(source_dir, name), 'wb') as f:
+                f.write(data)
+        for volume_workers in (1, 3):
+            output_dir = os.path.join(self.test_dir, 'estimated', f"mixed_{volume_workers}")
+            zipper = OptimizedZipper(workers=1, volume_workers=volume_workers)
+            zipper.VOLUME_SIZE = 150000
+            success, file_count, _ = zipper.zip_directory(source_dir, os.path.join(output_dir, 'mixed.zip'))
+            self.assertTrue(success)
+            self.assertEqual(file_count, 6)
+            volumes = sorted(name for name in os.listdir(output_dir) if '_part' in name)
+            self.assertEqual(volumes, [f"mixed_part{i}.zip" for i in range(1, len(volumes) + 1)])
+            unpacked = {}
+            for name in volumes:
+                path = os.path.join(output_dir, name)
+                self.assertLessEqual(os.path.getsize(path), zipper.VOLUME_SIZE)
+                with zipfile.ZipFile(path) as zf:
+                    unpacked.update({n: zf.read(n) for n in zf.namelist()})
+            self.assertEqual(unpacked, contents)
+            self.assertTrue(verify_manifests([os.path.join(output_dir, 'mixed_checksums.json')], workers=1)[0])
+
+    def test_archive_verification(self):
+        """测试校验清单：打包时记录成员校验值，分卷和分段ZIP都能通过校验，损坏的分卷能被发现"""
+        source_dir = os.path.join(self.test_dir, 'verify', 'src')
+        file_utils.create_directory(os.path.join(source_dir, '帖子'))
+        for i, size_kb in enumerate([30, 20, 5, 150]):
+            with open(os.path.join(source_dir, '帖子', f"{i + 1}.jpg"), 'wb') as f:
+                f.write(b'\xff\xd8\xff\xe0' + os.urandom(size_kb * 1024 - 4))
+        with open(os.path.join(source_dir, '帖子', 'info.txt'), 'w', encoding='utf-8') as f:
+            f.write('文本内容' * 2000)
+        
+        zipper = OptimizedZipper(workers=2)
+        zipper.VOLUME_SIZE = 64 * 1024
+        output_path = os.path.join(self.test_dir, 'verify', 'pics.zip')
+        success, _, _ = zipper.zip_directory(source_dir, output_path)
+        self.assertTrue(success)
+        manifest_path = checksum_manifest_path(output_path)
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        members = [m for archive in manifest['archives'] for m in archive['members']]
+        self.assertEqual(len(members), 5)
+        self.assertTrue(all(m['sha256'] for m in members))
+        self.assertIn('pics_part1.z01', [v['name'] for a in manifest['archives'] for v in a['volumes']])
+        
+        for level in ('quick', 'full'):
+            self.assertTrue(verify_manifests([manifest_path], workers=2, level=level)[0])
+        
+        # 修改分段ZIP中的一个字节（大小不变），完整校验能发现
+        segment = os.path.join(self.test_dir, 'verify', 'pics_part1.z02')
+        with open(segment, 'r+b') as f:
+            f.seek(100)
+            byte = f.read(1)
+            f.seek(100)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        self.assertTrue(verify_manifests([manifest_path], workers=1, level='quick')[0])
+        success, errors = verify_manifests([manifest_path], workers=1, level='full')
+        self.assertFalse(success)
+        self.assertEqual(len(errors), 1)
+        # 截断的分卷只检查大小就能发现
+        volume = os.path.join(self.test_dir, 'verify', 'pics_part2.zip')
+        os.truncate(volume, os.path.getsize(volume) - 1)
+        self.assertFalse(verify_manifests([manifest_path], workers=1, level='quick')[0])
+
+    def test_literature_store(self):
+        """测试文学作品库：批量提交、重复帖子忽略、全文搜索和导出txt"""
+        store_dir = os.path.join(self.test_dir, 'literature_store')
+        store = LiteratureStore(os.path.join(store_dir, 'literature.db'), batch_size=2)
+        literature_crawler.store = store
+        try:
+            self.assertTrue(literature_crawler.save_literature('春江花月夜', '张若虚', '春江潮水连海平', 'literature',
+                                                               'htm_data/2011/20/1001.'))
+            # 未达到批次大小时还没有提交
+            self.assertEqual(store.count(), 0)
+            literature_crawler.save_literature('静夜思', '李白', '床前明月光，疑是地上霜', 'literature',
+                                               'htm_data/2011/20/1002.')
+            self.assertEqual(store.count(), 2)
+            literature_crawler.save_literature('静夜思', '李白', '重复的帖子', 'literature', 'htm_data/2011/20/1002.')
+            store.close()
+        finally:
+            literature_crawler.store = None
+        
+        store = LiteratureStore(os.path.join(store_dir, 'literature.db'))
+        self.assertEqual(store.count('literature'), 2)
+        # 全文索引在第一次搜索时才建立
+        self.assertFalse(store.fts)
+        self.assertEqual([row[2] for row in store.search('明月光')], ['静夜思'])
+        self.assertTrue(store.fts)
+        self.assertEqual([row[0] for row in store.search('春江')], ['1001'])
+        self.assertEqual(store.search('不存在的内容'), [])
+        
+        export_dir = os.path.join(store_dir, 'export')
+        self.assertEqual(store.export(export_dir, 'literature'), 2)
+        store.close()
+        with open(os.path.join(export_dir, Config.get_forum_name('literature'), '静夜思.txt'), encoding='utf-8') as f:
+            self.assertEqual(f.read(), "标题：静夜思\n作者：李白\n\n床前明月光，疑是地上霜\n")
+        
+        # 爬取时帖子在作品所在的批次提交后才记录为已爬取
+        store = LiteratureStore(os.path.join(store_dir, 'crawl.db'), batch_size=2)
+        logged_at_fetch = []
+        def fake_content(url):
+            logged_at_fetch.append([c.args[0] for c in mock_save_url.call_args_list])
+            return url, '作者', '正文' + url
+        with patch('core.literature_crawler.load_crawled_urls', return_value=[]), \
+                patch('core.literature_crawler.save_crawled_url') as mock_save_url, \
+                patch.object(literature_crawler, 'get_urls_from_page', return_value=['p1', 'p2', 'p3']), \
+                patch.object(literature_crawler, 'get_literature_content', side_effect=fake_content), \
+                patch.object(literature_crawler, 'store', store):
+            self.assertEqual(literature_crawler.crawl('literature', 1, 1), 3)
+        self.assertEqual(logged_at_fetch, [[], [], ['p1', 'p2']])
+        self.assertEqual([c.args[0] for c in mock_save_url.call_args_list], ['p1', 'p2', 'p3'])
+        self.assertEqual(store.count(), 3)
+        store.close()
+
+    def test_novel_formatter(self):
+        """测试小说格式化：流式输出与原格式一致，批量格式化跳过未变化的文件，可作为保存后回调"""
+        source_dir = os.path.join(self.test_dir, 'literature')
+        output_dir = os.path.join(self.test_dir, 'formatted')
+        cache_file = os.path.join(self.test_dir, 'format_cache.json')
+        file_utils.create_directory(os.path.join(source_dir, '文学'))
+        novel = os.path.join(source_dir, '文学', '小说.txt')
+        with open(novel, 'w', encoding='utf-8') as f:
+            f.write('## 第一章\n第一段\n"你好"\n"再见"\n\n第二段\n')
+        format_file(novel, os.path.join(self.test_dir, 'single.txt'))
+        with open(os.path.join(self.test_dir, 'single.txt'), encoding='utf-8') as f:
+            self.assertEqual(f.read(), '\n## 第一章\n    第一段\n"你好""再见"\n\n    第二段')
+        
+        # 保存后回调：作品保存为txt后提交格式化
+        formatter = NovelFormatter(source_dir, output_dir, cache_file, workers=1)
+        with patch.object(literature_crawler, 'literature_dir', source_dir), \
+                patch.object(literature_crawler, 'post_save_hooks', [formatter.submit]):
+            self.assertTrue(literature_crawler.save_literature('短篇', '作者', '正文', 'story'))
+        formatter.close()
+        self.assertEqual(formatter.formatted, 1)
+        self.assertTrue(os.path.exists(os.path.join(output_dir, Config.get_forum_name('story'), '短篇.txt')))
+        
+        # 批量格式化：已格式化的短篇跳过，小说在进程池中格式化
+        formatter = NovelFormatter(source_dir, output_dir, cache_file, workers=2)
+        self.assertEqual(formatter.format_tree(), (1, 1, 0))
+        self.assertEqual(NovelFormatter(source_dir, output_dir, cache_file, workers=2).format_tree(), (0, 2, 0))
+        
+        # 只修改了修改时间时按哈希跳过，内容变化时重新格式化
+        os.utime(novel, ns=(0, 10 ** 9))
+        self.assertEqual(NovelFormatter(source_dir, output_dir, cache_file, workers=1).format_tree(), (0, 2, 0))
+        with open(novel, 'a', encoding='utf-8') as f:
+            f.write('第三段\n')
+        self.assertEqual(NovelFormatter(source_dir, output_dir, cache_file, workers=1).format_tree(), (1, 1, 0))
+    
+    @unittest.skipUnless(zstd_available(), "未安装zstandard")
+    def test_literature_store_compression(self):
+        """测试作品库字典压缩：达到数量后训练字典并压缩已有作品，读取、搜索和导出透明解压"""
+        phrases = ['月光照在窗前', '她轻轻推开门', '远处传来钟声', '雨一直下个不停', '他们沉默了很久']
+        posts = {str(i): '\n\n'.join(phrases[(i + j) % 5] + f"，第{j}次" for j in range(60)) for i in range(300)}
+        db_path = os.path.join(self.test_dir, 'compressed', 'literature.db')
+        store = LiteratureStore(db_path, batch_size=50, compression='zstd', dict_min_posts=100)
+        for thread_id, content in posts.items():
+            store.add(f"标题{thread_id}", '作者', content, 'story', f"htm_data/2/{thread_id}.")
+        store.close()
+        
+        store = LiteratureStore(db_path, compression='zstd')
+        conn = store._connect()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM posts WHERE dict_id IS NULL').fetchone()[0], 0)
+        stored = conn.execute('SELECT SUM(LENGTH(content)) FROM posts').fetchone()[0]
+        self.assertLess(stored, sum(len(c.encode('utf-8')) for c in posts.values()) / 5)
+        self.assertEqual(store.get('story', '123'), ('标题123', '作者', posts['123']))
+        self.assertEqual(len(store.search('雨一直下个不停，第59次')), 60)
+        self.assertEqual([row[0] for row in store.search('标题299')], ['299'])
+        export_dir = os.path.join(self.test_dir, 'compressed', 'export')
+        self.assertEqual(store.export(export_dir, 'story'), 300)
+        store.close()
+        with open(os.path.join(export_dir, Config.get_forum_name('story'), '标题7.txt'), encoding='utf-8') as f:
+            self.assertEqual(f.read(), f"标题：标题7\n作者：作者\n\n{posts['7']}\n")
+    
+    def test_file_inventory(self):
+        """测试目录清单：一次扫描缓存stat结果，并行扫描子目录与顺序扫描结果一致"""
+        source_dir = os.path.join(self.test_dir, 'inventory')
+        for post in range(3):
+            file_utils.create_directory(os.path.join(source_dir, f"帖子{post}", '子目录'))
+            for name in ('1.jpg', '子目录/2.jpg'):
+                with open(os.path.join(source_dir, f"帖子{post}", name), 'wb') as f:
+                    f.write(b'x' * (post + 1) * 100)
+        with open(os.path.join(source_dir, 'info.txt'), 'w') as f:
+            f.write('info')
+        file_utils.create_directory(os.path.join(source_dir, '空目录'))
+        
+        inventory = FileInventory.scan(source_dir, workers=4)
+        sequential = FileInventory.scan(source_dir, workers=1)
+        self.assertEqual(sorted(r[:4] for r in inventory), sorted(r[:4] for r in sequential))
+        self.assertEqual(len(inventory), 7)
+        self.assertEqual(inventory.total_size, 4 + 2 * (100 + 200 + 300))
+        self.assertIn('帖子2/子目录/2.jpg', [record.arcname for record in inventory])
+        path = os.path.join(source_dir, '帖子1', '1.jpg')
+        self.assertEqual(inventory.stat(path).st_size, 200)
+        self.assertTrue(FileInventory.scan(os.path.join(source_dir, '空目录')).is_empty)
+        self.assertTrue(FileInventory.scan(os.path.join(source_dir, '不存在')).is_empty)
+
+    @unittest.skipUnless(zstd_available(), "未安装zstandard")
+    def test_tar_zst_packaging(self):
+        """测试tar.zst格式：分卷可单独解压，超大文件按字节切分为 .001、.002 ..."""
+        source_dir = os.path.join(self.test_dir, 'tar_zst', 'src')
+        file_utils.create_directory(os.path.join(source_dir, '文章'))
+        contents = {}
+        for i, size_kb in enumerate([30, 20, 20, 150]):
+            name = f"文章/{i + 1}.txt"
+            contents[name] = os.urandom(size_kb * 1024)
+            with open(os.path.join(source_dir, name), 'wb') as f:
+                f.write(contents[name])
+        
+        zipper = OptimizedZipper(archive_format='tar.zst')
+        zipper.VOLUME_SIZE = 64 * 1024
+        output_path = os.path.join(self.test_dir, 'tar_zst', 'literature.zip')
+        _, file_sizes = zipper.get_file_sizes(source_dir)
+        success, file_count, _, paths = zipper.zip_file_list(source_dir, file_sizes, output_path)
+        self.assertTrue(success)
+        self.assertEqual(file_count, 4)
+        self.assertTrue(all('.tar.zst' in path for path in paths))
+        
+        # 分段按 .001、.002 ... 的顺序拼接，其余分卷单独解压
+        archives = {}
+        for path in paths:
+            self.assertLessEqual(os.path.getsize(path), zipper.VOLUME_SIZE)
+            stem = path.rsplit('.', 1)[0] if path[-4:-3] == '.' and path[-3:].isdigit() else path
+            with open(path, 'rb') as f:
+                archives[stem] = archives.get(stem, b'') + f.read()
+        self.assertEqual(sum(1 for path in paths if path.endswith('.001')), 1)
+        
+        unpacked = {}
+        for data in archives.values():
+            raw = zstandard.ZstdDecompressor(max_window_size=2 ** Config.ZSTD_WINDOW_LOG).decompressobj().decompress(data)
+            with tarfile.open(fileobj=io.BytesIO(raw)) as tar:
+                for member in tar.getmembers():
+                    unpacked[member.name] = tar.extractfile(member).read()
+        self.assertEqual(unpacked, contents)
+        self.assertTrue(verify_manifests([checksum_manifest_path(output_path)], workers=1)[0])
+
+    @unittest.skipUnless(zstd_available(), "未安装zstandard")
+    def test_tar_zst_writer_releases_members(self):
+        """测试tar.zst写入器不保留成员列表：关闭后不留下循环引用，zstd上下文不依赖垃圾回收释放"""
+        source_file = os.path.join(self.test_dir, 'tar_members.txt')
+        with open(source_file, 'wb') as f:
+            f.write(b'tar member' * 100)
+        gc.disable()
+        try:
+            writer = TarZstWriter(os.path.join(self.test_dir, 'tar_members.tar.zst'))
+            writer.add_file(source_file, 'a.txt')
+            writer.add_file(source_file, 'b.txt')
+            tar = weakref.ref(writer.tar)
+            self.assertEqual(writer.tar.members, [])
+            writer.close()
+            del writer
+            self.assertIsNone(tar())
+        finally:
+            gc.enable()
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+import time
+import zlib
+from config.settings import Config
+from utils.logger import logger
+from utils.zip_writer import RawZipWriter, ZIP_DEFLATED
+from utils.compression_policy import choose_method, SNIFF_SIZE
+from utils.file_utils import OptimizedZipper, FileUtils
+from utils.archive_verify import member_record, write_checksum_manifest
+
+class StreamingArchiveSink:
+    """
+    流式归档：下载的资源直接追加到打开的ZIP中，达到分卷大小时自动滚动到新分卷，
+    运行结束时只需写入中央目录即可完成打包。
+    """
+
+    def __init__(self, output_path, volume_size=OptimizedZipper.VOLUME_SIZE, compress_level=Config.ZIP_COMPRESS_LEVEL):
+        """
+        初始化流式归档
+
+        参数:
+            output_path: 最终ZIP文件路径，产生多个分卷时命名为 xxx_part1.zip、xxx_part2.zip ...
+            volume_size: 单个分卷的大小上限（字节）
+            compress_level: 未知类型使用的DEFLATE级别
+        """
+        self.output_path = output_path
+        self.volume_size = volume_size
+        self.compress_level = compress_level
+        self.volume_paths = []
+        # 已关闭分卷的成员列表，与volume_paths一一对应，用于写入校验清单
+        self._volume_members = []
+        self.member_count = 0
+        self.total_size = 0
+        self._writer = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def _volume_path(self, index):
+        """分卷文件路径"""
+        return f"{os.path.splitext(self.output_path)[0]}_part{index}.zip"
+
+    def _open_volume(self):
+        """关闭当前分卷并打开新分卷"""
+        if self._writer:
+            self._writer.close()
+            self._volume_members.append(self._writer.members)
+            logger.info(f"分卷 {len(self.volume_paths)} 写入完成: {self.volume_paths[-1]}")
+        path = self._volume_path(len(self.volume_paths) + 1)
+        self._writer = RawZipWriter(path)
+        self.volume_paths.append(path)
+
+    def add_bytes(self, arcname, data, mtime=None, method=None, level=None):
+        """
+        将一个资源追加到归档
+
+        参数:
+            arcname: 压缩包内路径
+            data: 资源内容
+            mtime: 修改时间戳，默认当前时间
+            method: 调用方已确定的压缩方法（如 detect_type 的结果），None表示按内容探测
+            level: 与method对应的压缩级别
+
+        返回:
+            True（成功）或False（失败）
+        """
+        if method is None:
+            _, method, level = choose_method(data[:SNIFF_SIZE], self.compress_level)
+        crc = zlib.crc32(data)
+        payload = data
+        if method == ZIP_DEFLATED:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            payload = compressor.compress(data) + compressor.flush()
+
+        return self.add_compressed(arcname, payload, crc, len(data), method, mtime, hashlib.sha256(data).hexdigest())
+
+    def add_compressed(self, arcname, payload, crc, file_size, method, mtime=None, sha256=None):
+        """
+        将已压缩好的成员追加到归档（例如从其他ZIP中直接复制的原始数据）
+
+        参数:
+            arcname: 压缩包内路径
+            payload: 压缩后的数据
+            crc: 原始数据的CRC32
+            file_size: 原始数据大小
+            method: 压缩方法
+            mtime: 修改时间戳，默认当前时间
+            sha256: 原始数据的SHA-256，写入校验清单
+
+        返回:
+            True（成功）或False（失败）
+        """
+        with self._lock:
+            if self._closed:
+                logger.error(f"归档已关闭，无法写入: {arcname}")
+                return False
+            try:
+                # 写入后超过分卷大小时换到新分卷（空分卷总是接受，超大成员单独占一个分卷）
+                if self._writer is None or (self._writer.members and self._writer.projected_size(
+                        self._writer.member_size(arcname, len(payload), file_size)) > self.volume_size):
+                    self._open_volume()
+                self._writer.write_compressed(arcname, payload, crc, file_size, method,
+                                              mtime if mtime is not None else time.time())
+                self._writer.members[-1].sha256 = sha256
+                self.member_count += 1
+                self.total_size += file_size
+                return True
+            except Exception as e:
+                logger.error(f"写入归档失败: {arcname}, 错误: {e}")
+                return False
+
+    def close(self):
+        """
+        完成归档：写入中央目录；只有一个分卷时重命名为最终文件名，否则写入分卷信息文件；
+        最后写入校验清单
+
+        返回:
+            生成的ZIP文件路径列表
+        """
+        with self._lock:
+            if self._closed:
+                return list(self.volume_paths)
+            self._closed = True
+            if self._writer is None:
+                return []
+            self._writer.close()
+            self._volume_members.append(self._writer.members)
+
+            if len(self.volume_paths) == 1:
+                os.replace(self.volume_paths[0], self.output_path)
+                self.volume_paths = [self.output_path]
+            else:
+                FileUtils.write_volume_info(self.output_path, self.volume_paths)
+            try:
+                write_checksum_manifest(self.output_path, 'zip', [
+                    ([path], [member_record(m.arcname, m.file_size, m.crc, m.sha256) for m in members])
+                    for path, members in zip(self.volume_paths, self._volume_members)])
+            except OSError as e:
+                logger.error(f"写入校验清单失败: {self.output_path}, 错误: {e}")
+
+            logger.info(f"流式归档完成: {self.member_count} 个文件，{self.total_size/1024/1024:.2f}MB，"
+                        f"{len(self.volume_paths)} 个分卷")
+            return list(self.volume_paths)
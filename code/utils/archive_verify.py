@@ -0,0 +1,323 @@
+import glob
+import hashlib
+import json
+import os
+import struct
+import tarfile
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from config.settings import Config
+from utils.logger import logger
+from utils.atomic_file import atomic_open
+from utils.zip_writer import ZIP_DEFLATED, ZIP64_LIMIT, SPLIT_SIGNATURE, READ_CHUNK_SIZE
+
+# zstandard为可选依赖，未安装时无法校验tar.zst归档
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 校验清单文件名后缀（与 xxx_volume_info.txt 放在同一目录）
+CHECKSUM_SUFFIX = '_checksums.json'
+
+def checksum_manifest_path(output_path):
+    """归档对应的校验清单路径（xxx.zip -> xxx_checksums.json）"""
+    return f"{os.path.splitext(output_path)[0]}{CHECKSUM_SUFFIX}"
+
+def member_record(arcname, size, crc, sha256):
+    """校验清单中的一个成员"""
+    return {'name': arcname.replace(os.sep, '/'), 'size': size, 'crc32': f"{crc:08x}", 'sha256': sha256}
+
+def write_checksum_manifest(output_path, archive_format, archives):
+    """
+    写入校验清单：每个可单独解压的归档（普通分卷、分段ZIP或切分的tar.zst）的文件大小，
+    以及其中每个成员的大小、CRC32和SHA-256
+
+    参数:
+        output_path: 归档输出路径（决定清单文件名）
+        archive_format: 'zip' 或 'tar.zst'
+        archives: (文件路径列表, 成员列表) 列表，成员为 member_record 的返回值
+
+    返回:
+        清单文件路径
+    """
+    manifest_path = checksum_manifest_path(output_path)
+    data = {
+        'format': archive_format,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'archives': [{
+            'volumes': [{'name': os.path.basename(path), 'size': os.path.getsize(path)} for path in paths],
+            'members': members,
+        } for paths, members in archives],
+    }
+    with atomic_open(manifest_path) as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    return manifest_path
+
+def rename_checksum_manifest(source_output, target_output, name_map):
+    """
+    为发布的归档生成校验清单：复制source_output的校验清单，按name_map替换分卷文件名
+
+    参数:
+        source_output: 原归档输出路径
+        target_output: 发布的归档输出路径
+        name_map: {原文件名: 发布文件名}
+
+    返回:
+        新清单文件路径，原清单不存在时返回None
+    """
+    source = checksum_manifest_path(source_output)
+    if not os.path.exists(source):
+        return None
+    with open(source, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    for archive in data['archives']:
+        for volume in archive['volumes']:
+            volume['name'] = name_map.get(volume['name'], volume['name'])
+    target = checksum_manifest_path(target_output)
+    with atomic_open(target) as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    return target
+
+class _ConcatReader:
+    """把按顺序排列的多个文件当作一个连续的只读流（分段ZIP、切分的tar.zst）"""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.fp = None
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0:
+            if self.fp is None:
+                if not self.paths:
+                    break
+                self.fp = open(self.paths.pop(0), 'rb')
+            chunk = self.fp.read(size)
+            if not chunk:
+                self.fp.close()
+                self.fp = None
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        if self.fp:
+            self.fp.close()
+            self.fp = None
+        self.paths = []
+
+def _hash_stream(read):
+    """读取数据直到结束，返回 (大小, CRC32, SHA-256)"""
+    size = 0
+    crc = 0
+    digest = hashlib.sha256()
+    while True:
+        chunk = read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        crc = zlib.crc32(chunk, crc)
+        digest.update(chunk)
+    return size, crc, digest.hexdigest()
+
+def _iter_zip(paths):
+    """逐个读取ZIP成员，产生 (成员名, 大小, CRC32, SHA-256)"""
+    with zipfile.ZipFile(paths[0]) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            # zipfile在读完成员后自动比对CRC，不一致时抛出BadZipFile
+            with zf.open(info) as f:
+                size, crc, sha256 = _hash_stream(f.read)
+            yield info.filename, size, crc, sha256
+
+def _iter_split_zip(paths):
+    """按顺序解析分段ZIP中的本地文件头，产生 (成员名, 大小, CRC32, SHA-256)"""
+    reader = _ConcatReader(paths)
+    try:
+        signature = reader.read(4)
+        if signature == SPLIT_SIGNATURE:
+            signature = reader.read(4)
+        while signature == b'PK\x03\x04':
+            (_, _, method, _, _, crc, compress_size, file_size,
+             name_length, extra_length) = struct.unpack('<HHHHHIIIHH', reader.read(26))
+            name = reader.read(name_length).decode('utf-8')
+            extra = reader.read(extra_length)
+            if compress_size == ZIP64_LIMIT:
+                pos = 0
+                while pos + 4 <= len(extra):
+                    tag, length = struct.unpack('<HH', extra[pos:pos + 4])
+                    if tag == 0x0001:
+                        file_size, compress_size = struct.unpack('<QQ', extra[pos + 4:pos + 20])
+                        break
+                    pos += 4 + length
+
+            remaining = compress_size
+            decompressor = zlib.decompressobj(-15) if method == ZIP_DEFLATED else None
+
+            def read(size):
+                nonlocal remaining
+                while remaining > 0:
+                    chunk = reader.read(min(size, remaining))
+                    if not chunk:
+                        raise IOError(f"分段ZIP数据不完整: {name}")
+                    remaining -= len(chunk)
+                    if decompressor:
+                        chunk = decompressor.decompress(chunk)
+                    if chunk:
+                        return chunk
+                return decompressor.flush() if decompressor else b''
+
+            size, actual_crc, sha256 = _hash_stream(read)
+            if actual_crc != crc or size != file_size:
+                raise IOError(f"成员CRC或大小与文件头不一致: {name}")
+            yield name, size, crc, sha256
+            signature = reader.read(4)
+    finally:
+        reader.close()
+
+def _iter_tar_zst(paths):
+    """解压tar.zst并逐个读取成员，产生 (成员名, 大小, CRC32, SHA-256)"""
+    if zstandard is None:
+        raise RuntimeError("未安装zstandard，无法校验tar.zst归档")
+    reader = _ConcatReader(paths)
+    try:
+        stream = zstandard.ZstdDecompressor(max_window_size=2 ** Config.ZSTD_WINDOW_LOG).stream_reader(reader)
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            read = {}
+            for member in tar:
+                if member.isfile():
+                    read[member.name] = _hash_stream(tar.extractfile(member).read)
+                    yield (member.name,) + read[member.name]
+                elif member.islnk() and member.linkname in read:
+                    # 硬链接的内容与被链接的成员相同
+                    yield (member.name,) + read[member.linkname]
+    finally:
+        reader.close()
+
+def verify_archive(archive_format, paths, volumes, members, level='full'):
+    """
+    校验一个可单独解压的归档（可在工作进程中执行）
+
+    参数:
+        archive_format: 'zip' 或 'tar.zst'
+        paths: 归档的文件路径列表（按顺序）
+        volumes: 清单中记录的 [{'name', 'size'}]
+        members: 清单中记录的成员列表
+        level: 'quick' 只检查文件大小和ZIP中央目录；'full' 读取全部数据比对CRC32和SHA-256
+
+    返回:
+        (错误信息列表, 读取的原始数据字节数)
+    """
+    errors = []
+    for path, volume in zip(paths, volumes):
+        if not os.path.exists(path):
+            errors.append(f"缺少文件: {volume['name']}")
+        elif os.path.getsize(path) != volume['size']:
+            errors.append(f"文件大小不一致: {volume['name']} ({os.path.getsize(path)} != {volume['size']})")
+    if errors:
+        return errors, 0
+
+    expected = {member['name']: member for member in members}
+    split = archive_format == 'zip' and (len(paths) > 1 or paths[0].endswith('.z01'))
+    if level == 'quick':
+        if archive_format == 'zip' and not split:
+            try:
+                with zipfile.ZipFile(paths[0]) as zf:
+                    actual = {info.filename: (info.file_size, f"{info.CRC:08x}")
+                              for info in zf.infolist() if not info.is_dir()}
+            except (zipfile.BadZipFile, OSError) as e:
+                return [f"无法读取ZIP: {volumes[0]['name']}, 错误: {e}"], 0
+            for name, member in expected.items():
+                if actual.get(name) != (member['size'], member['crc32']):
+                    errors.append(f"成员缺失或不一致: {name}")
+        return errors, 0
+
+    if archive_format == 'tar.zst':
+        iterator = _iter_tar_zst(paths)
+    else:
+        iterator = _iter_split_zip(paths) if split else _iter_zip(paths)
+    seen = set()
+    total = 0
+    try:
+        for name, size, crc, sha256 in iterator:
+            total += size
+            member = expected.get(name)
+            if member is None:
+                errors.append(f"清单中没有该成员: {name}")
+                continue
+            seen.add(name)
+            if (size, f"{crc:08x}") != (member['size'], member['crc32']) or \
+                    (member['sha256'] and sha256 != member['sha256']):
+                errors.append(f"成员校验失败: {name}")
+    except Exception as e:
+        # 读取中断后的成员无法再校验，只报告读取失败
+        errors.append(f"读取归档失败: {volumes[0]['name']}, 错误: {e}")
+        return errors, total
+    for name in expected.keys() - seen:
+        errors.append(f"成员缺失: {name}")
+    return errors, total
+
+def verify_manifests(manifest_paths, workers=Config.VERIFY_WORKERS, level=Config.VERIFY_LEVEL):
+    """
+    按校验清单校验归档，所有清单中的归档在同一个进程池中并行校验
+
+    参数:
+        manifest_paths: 校验清单路径列表
+        workers: 并行校验的进程数
+        level: 'quick' 或 'full'
+
+    返回:
+        (是否全部通过, 错误信息列表)
+    """
+    start_time = time.time()
+    errors = []
+    tasks = []
+    for manifest_path in manifest_paths:
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            errors.append(f"无法读取校验清单: {manifest_path}, 错误: {e}")
+            continue
+        base_dir = os.path.dirname(manifest_path)
+        tasks.extend((data['format'], [os.path.join(base_dir, v['name']) for v in archive['volumes']],
+                      archive['volumes'], archive['members'], level) for archive in data['archives'])
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(verify_archive, *zip(*tasks)))
+    else:
+        results = [verify_archive(*task) for task in tasks]
+
+    errors.extend(error for archive_errors, _ in results for error in archive_errors)
+    total = sum(size for _, size in results)
+    for error in errors:
+        logger.error(f"校验失败: {error}")
+    logger.info(f"校验{'通过' if not errors else '失败'}: {len(manifest_paths)} 个校验清单，{len(tasks)} 个归档，"
+                f"{sum(len(task[3]) for task in tasks)} 个成员，读取 {total/1024/1024:.2f}MB，"
+                f"耗时 {time.time() - start_time:.2f} 秒")
+    return not errors, errors
+
+def find_checksum_manifests(root, exclude_dirs=()):
+    """
+    查找目录下所有校验清单
+
+    参数:
+        root: 根目录，也可以直接传入一个校验清单或归档文件的路径
+        exclude_dirs: 跳过的子目录
+
+    返回:
+        校验清单路径列表
+    """
+    if os.path.isfile(root):
+        return [root if root.endswith(CHECKSUM_SUFFIX) else checksum_manifest_path(root)]
+    excluded = [os.path.join(os.path.abspath(d), '') for d in exclude_dirs]
+    return [path for path in sorted(glob.glob(os.path.join(glob.escape(root), '**', f"*{CHECKSUM_SUFFIX}"),
+                                              recursive=True))
+            if not any(os.path.abspath(path).startswith(d) for d in excluded)]
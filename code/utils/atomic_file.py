@@ -0,0 +1,39 @@
+import os
+from contextlib import contextmanager
+
+# 不依赖项目内其他模块：metrics、tracing、archive_verify 等都被 file_utils 导入，放在这里不会产生循环导入
+
+@contextmanager
+def atomic_open(path, mode='w'):
+    """
+    原子地写入文件：先写入同目录下的临时文件，正常退出后替换目标文件，读取方不会看到写了一半的文件
+
+    参数:
+        path: 目标文件路径（所在目录不存在时自动创建）
+        mode: 'w' 写入文本（UTF-8），'wb' 写入字节
+
+    返回:
+        临时文件对象；上下文中发生异常时删除临时文件，目标文件保持不变
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, mode, encoding=None if 'b' in mode else 'utf-8') as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def atomic_write(path, data):
+    """
+    原子地写入文本或字节
+
+    参数:
+        path: 目标文件路径
+        data: str 按UTF-8写入，bytes 原样写入
+    """
+    with atomic_open(path, 'wb' if isinstance(data, bytes) else 'w') as f:
+        f.write(data)
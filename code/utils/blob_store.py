@@ -0,0 +1,215 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from config.settings import Config
+from utils.logger import logger
+from utils.request_utils import request_utils
+from utils.compression_policy import detect_type
+from utils.incremental_archive import file_sha256
+
+class BlobStore:
+    """
+    内容寻址的图片存储：图片按SHA-256只保存一份，帖子目录中的文件是指向它的硬链接。
+
+    URL索引记录已下载图片的哈希，同一URL在其他帖子中再次出现时不再下载；
+    不同URL的相同内容在下载后按哈希去重。帖子目录中的文件与原来一样可以直接打包，
+    但不能原地修改（会同时修改所有链接到同一内容的文件），需要修改时先写新文件再替换。
+    """
+
+    def __init__(self, blob_dir=Config.PIC_BLOB_DIR, timeout=30):
+        """
+        初始化存储（不创建目录和数据库，第一次使用时再创建）
+
+        参数:
+            blob_dir: 内容文件目录，必须与图片目录在同一文件系统上才能创建硬链接
+            timeout: 等待索引数据库锁的超时时间（秒）
+        """
+        self.blob_dir = blob_dir
+        self.index_path = os.path.join(blob_dir, Config.PIC_BLOB_INDEX_NAME)
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """清空统计"""
+        self.url_hits = 0
+        self.content_hits = 0
+        self.saved_bytes = 0
+        self.stored_files = 0
+        self.stored_bytes = 0
+        self.copied_files = 0
+
+    def _connect(self):
+        """获取当前进程的索引数据库连接（SQLite连接不能跨进程共享）"""
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(self.blob_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.index_path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, sha256 TEXT NOT NULL, '
+                               'extension TEXT)')
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(urls)')]
+            if 'extension' not in columns:
+                # 旧版本的索引没有扩展名列
+                self._conn.execute('ALTER TABLE urls ADD COLUMN extension TEXT')
+            self._pid = os.getpid()
+        return self._conn
+
+    def blob_path(self, sha256):
+        """内容文件路径（按哈希前两位分目录，避免单个目录文件过多）"""
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    def _lookup(self, url):
+        """查找URL对应的内容文件和转码扩展名，未找到时返回 (None, None)"""
+        with self._lock:
+            row = self._connect().execute('SELECT sha256, extension FROM urls WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None, None
+        path = self.blob_path(row[0])
+        return (path, row[1]) if os.path.exists(path) else (None, None)
+
+    def lookup(self, url):
+        """
+        查找URL对应的内容文件
+
+        返回:
+            内容文件路径，URL未下载过或内容文件已被删除时返回None
+        """
+        return self._lookup(url)[0]
+
+    def _record(self, url, sha256, extension=None):
+        """记录URL对应的内容哈希和规范扩展名"""
+        with self._lock:
+            self._connect().execute('INSERT OR REPLACE INTO urls (url, sha256, extension) VALUES (?, ?, ?)',
+                                    (url, sha256, extension))
+
+    def _link(self, blob_path, target_path):
+        """在帖子目录中创建指向内容文件的硬链接，文件系统不支持时复制"""
+        target_dir = os.path.dirname(target_path)
+        if target_dir:
+            os.makedirs(target_dir, exist_ok=True)
+        if os.path.lexists(target_path):
+            os.remove(target_path)
+        try:
+            os.link(blob_path, target_path)
+        except OSError:
+            shutil.copyfile(blob_path, target_path)
+            self.copied_files += 1
+
+    def fetch(self, url, target_path, max_bytes=None):
+        """
+        保存图片到指定路径：已知URL或相同内容直接链接，否则下载后存入内容文件
+
+        保存路径的扩展名替换为按内容判断的规范扩展名（记录在索引中，URL再次出现时不需要读取内容文件）。
+
+        参数:
+            url: 图片URL
+            target_path: 帖子目录中的保存路径，无法判断类型时使用其扩展名
+            max_bytes: 下载允许的最大字节数（超过时抛出ContentTooLarge），None表示不限制
+
+        返回:
+            保存的文件路径，失败时返回False
+        """
+        blob_path, extension = self._lookup(url)
+        if blob_path:
+            if extension:
+                target_path = os.path.splitext(target_path)[0] + extension
+            self._link(blob_path, target_path)
+            self.url_hits += 1
+            self.saved_bytes += os.path.getsize(blob_path)
+            logger.info(f"图片已存在，跳过下载: {url}")
+            return target_path
+
+        temp_dir = os.path.join(self.blob_dir, 'tmp')
+        temp_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        info = {}
+        if not request_utils.download_file(url, temp_path, digest=digest, max_bytes=max_bytes, info=info):
+            return False
+        _, extension, _, _ = detect_type(info.get('head', b''), info.get('content_type'), url)
+        if extension:
+            target_path = os.path.splitext(target_path)[0] + extension
+        sha256 = digest.hexdigest()
+        blob_path = self.blob_path(sha256)
+        size = os.path.getsize(temp_path)
+        if os.path.exists(blob_path):
+            os.remove(temp_path)
+            self.content_hits += 1
+            self.saved_bytes += size
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(temp_path, blob_path)
+            self.stored_files += 1
+            self.stored_bytes += size
+        self._record(url, sha256, extension)
+        self._link(blob_path, target_path)
+        return target_path
+
+    def replace(self, url, new_file, target_path, extension):
+        """
+        用转码后的文件替换URL对应的内容：相同原始内容的所有URL都指向新内容，原内容文件删除
+
+        已链接到原内容文件的其他帖子中的文件不受影响（硬链接仍指向原来的数据）。
+
+        参数:
+            url: 图片URL
+            new_file: 转码后的文件（会被移入存储）
+            target_path: 帖子目录中原图的路径，替换为转码后文件的链接
+            extension: 转码后的扩展名
+
+        返回:
+            转码后文件在帖子目录中的路径
+        """
+        old_path = self.lookup(url)
+        sha256 = file_sha256(new_file)
+        blob_path = self.blob_path(sha256)
+        if os.path.exists(blob_path):
+            os.remove(new_file)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(new_file, blob_path)
+        with self._lock:
+            conn = self._connect()
+            if old_path:
+                conn.execute('UPDATE urls SET sha256 = ?, extension = ? WHERE sha256 = ?',
+                             (sha256, extension, os.path.basename(old_path)))
+            conn.execute('INSERT OR REPLACE INTO urls (url, sha256, extension) VALUES (?, ?, ?)',
+                         (url, sha256, extension))
+        if old_path and old_path != blob_path:
+            os.remove(old_path)
+        new_path = os.path.splitext(target_path)[0] + extension
+        self._link(blob_path, new_path)
+        if new_path != target_path and os.path.lexists(target_path):
+            os.remove(target_path)
+        return new_path
+
+    def discard(self, url):
+        """
+        删除URL对应的内容文件和索引记录（图片校验失败时调用，下次重新下载）
+
+        参数:
+            url: 图片URL
+        """
+        blob_path = self.lookup(url)
+        with self._lock:
+            self._connect().execute('DELETE FROM urls WHERE url = ?', (url,))
+        if blob_path and os.path.exists(blob_path):
+            os.remove(blob_path)
+
+    def close(self):
+        """关闭索引数据库"""
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def summary(self):
+        """返回统计摘要文本"""
+        return (f"图片去重: 新保存 {self.stored_files} 个文件 {self.stored_bytes/1024/1024:.2f}MB，"
+                f"URL命中 {self.url_hits} 次，内容重复 {self.content_hits} 次，"
+                f"节省 {self.saved_bytes/1024/1024:.2f}MB"
+                + (f"，{self.copied_files} 个文件无法创建硬链接已复制" if self.copied_files else ""))
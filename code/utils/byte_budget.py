@@ -0,0 +1,96 @@
+from config.settings import Config
+from utils.logger import logger
+
+class ByteBudget:
+    """
+    图片字节预算：限制单张图片、单个帖子和整次运行下载的字节数。
+
+    每张图片下载前用 allowance 计算允许的最大字节数交给下载函数，
+    超出时下载函数抛出 ContentTooLarge，由 reject 判断是跳过还是推迟到下次运行。
+    """
+
+    def __init__(self, file_limit=Config.PIC_MAX_FILE_BYTES, post_limit=Config.PIC_POST_BYTE_BUDGET,
+                 run_limit=Config.PIC_RUN_BYTE_BUDGET):
+        """
+        初始化字节预算
+
+        参数:
+            file_limit: 单张图片的字节上限，0表示不限制
+            post_limit: 每个帖子的字节预算，0表示不限制
+            run_limit: 整次运行的字节预算，0表示不限制
+        """
+        self.file_limit = file_limit
+        self.post_limit = post_limit
+        self.run_limit = run_limit
+        self.run_bytes = 0
+        self.post_bytes = {}
+        self.oversized = 0
+        self.deferred = 0
+        self._stop_logged = False
+
+    def allowance(self, post_url):
+        """
+        下一张图片允许下载的最大字节数
+
+        参数:
+            post_url: 图片所属帖子的URL
+
+        返回:
+            字节数（预算已用完时可能为0或负数），None表示不限制
+        """
+        limits = []
+        if self.file_limit:
+            limits.append(self.file_limit)
+        if self.post_limit:
+            limits.append(self.post_limit - self.post_bytes.get(post_url, 0))
+        if self.run_limit:
+            limits.append(self.run_limit - self.run_bytes)
+        return min(limits) if limits else None
+
+    def run_exhausted(self):
+        """整次运行的预算是否已用完"""
+        if not self.run_limit or self.run_bytes < self.run_limit:
+            return False
+        if not self._stop_logged:
+            logger.warning(f"已下载 {self.run_bytes/1024/1024:.2f}MB，达到本次运行的字节预算，保存进度并停止")
+            self._stop_logged = True
+        return True
+
+    def record(self, post_url, size):
+        """记录一张图片保存的字节数"""
+        self.run_bytes += size
+        self.post_bytes[post_url] = self.post_bytes.get(post_url, 0) + size
+
+    def defer(self, url):
+        """记录因帖子或运行预算不足未下载的图片（下次运行时重新下载）"""
+        self.deferred += 1
+        logger.info(f"帖子字节预算已用完，推迟到下次运行: {url}")
+
+    def reject(self, error):
+        """
+        处理下载时超出允许字节数的图片
+
+        参数:
+            error: 下载函数抛出的 ContentTooLarge
+
+        返回:
+            True表示超过单张上限，永久跳过；False表示只是超出剩余预算，推迟到下次运行
+        """
+        if self.file_limit and error.size > self.file_limit:
+            self.oversized += 1
+            logger.warning(f"图片超过单张上限 {self.file_limit/1024/1024:.0f}MB，跳过: {error.url}"
+                           f"（{error.size/1024/1024:.2f}MB）")
+            return True
+        self.deferred += 1
+        logger.info(f"图片超出剩余字节预算，推迟到下次运行: {error.url}（{error.size/1024/1024:.2f}MB）")
+        return False
+
+    def finish_post(self, post_url):
+        """帖子结算后释放其计数"""
+        self.post_bytes.pop(post_url, None)
+
+    def summary(self):
+        """返回统计摘要文本"""
+        return (f"图片字节预算: 本次下载 {self.run_bytes/1024/1024:.2f}MB"
+                + (f" / {self.run_limit/1024/1024:.0f}MB" if self.run_limit else "")
+                + f"，超过单张上限跳过 {self.oversized} 张，推迟到下次运行 {self.deferred} 张")
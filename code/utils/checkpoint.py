@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+from utils.logger import logger
+from utils.atomic_file import atomic_write
+
+def save_completion_record(path, post_url, title, total, succeeded, complete=True):
+    """
+    追加帖子完成记录（JSON Lines），列出成功下载的图片序号
+
+    参数:
+        path: 完成记录文件路径
+        post_url: 帖子URL
+        title: 帖子标题
+        total: 图片总数
+        succeeded: 成功下载的图片序号
+        complete: 是否达到完成阈值（False表示重试次数用尽后放弃）
+    """
+    record = {
+        'post': post_url,
+        'title': title,
+        'total': total,
+        'succeeded': sorted(succeeded),
+        'complete': complete,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    try:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return True
+    except Exception as e:
+        logger.error(f"保存帖子完成记录失败: {e}")
+        return False
+
+class CrawlCheckpoint:
+    """帖子级下载进度检查点，记录未完成帖子中每张图片的下载状态"""
+
+    def __init__(self, path):
+        """
+        初始化检查点
+
+        参数:
+            path: 检查点JSON文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.posts = self._load()
+
+    def _load(self):
+        """从文件加载检查点"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"加载下载进度检查点失败: {self.path}, 错误: {e}")
+        return {}
+
+    def save(self):
+        """原子地写入检查点文件"""
+        with self._lock:
+            data = json.dumps(self.posts, ensure_ascii=False, indent=2)
+        try:
+            atomic_write(self.path, data)
+            return True
+        except Exception as e:
+            logger.error(f"保存下载进度检查点失败: {self.path}, 错误: {e}")
+            return False
+
+    def record(self, post_url, forum_key, title, pic_urls, done_indices, attempts=0):
+        """
+        记录帖子的下载进度
+
+        参数:
+            post_url: 帖子URL
+            forum_key: 板块键名
+            title: 帖子标题
+            pic_urls: 帖子中所有待下载的图片URL
+            done_indices: 已成功下载的图片序号
+            attempts: 已完整尝试下载该帖子的次数
+        """
+        with self._lock:
+            self.posts[post_url] = {
+                'forum': forum_key,
+                'title': title,
+                'pic_urls': list(pic_urls),
+                'done': sorted(set(done_indices)),
+                'attempts': attempts,
+            }
+
+    def get(self, post_url):
+        """获取帖子的下载进度，不存在时返回None"""
+        with self._lock:
+            return self.posts.get(post_url)
+
+    def missing_indices(self, post_url):
+        """返回帖子中尚未下载成功的图片序号"""
+        entry = self.get(post_url)
+        if not entry:
+            return []
+        done = set(entry['done'])
+        return [i for i in range(len(entry['pic_urls'])) if i not in done]
+
+    def posts_for_forum(self, forum_key):
+        """返回指定板块中未完成的帖子URL列表"""
+        with self._lock:
+            return [url for url, entry in self.posts.items() if entry.get('forum') == forum_key]
+
+    def remove(self, post_url):
+        """帖子完成后移除其进度记录"""
+        with self._lock:
+            self.posts.pop(post_url, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self.posts)
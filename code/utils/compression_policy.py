@@ -0,0 +1,266 @@
+import codecs
+import hashlib
+import os
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit
+from config.settings import Config
+from utils.zip_writer import ZIP_STORED, ZIP_DEFLATED, READ_CHUNK_SIZE
+
+# 文件头魔数表: (偏移, 魔数, 类型, 规范扩展名)
+MAGIC_TYPES = [
+    (0, b'\xff\xd8\xff', 'jpeg', '.jpg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'png', '.png'),
+    (0, b'GIF87a', 'gif', '.gif'),
+    (0, b'GIF89a', 'gif', '.gif'),
+    (0, b'PK\x03\x04', 'zip', '.zip'),
+    (0, b'\x1f\x8b', 'gzip', '.gz'),
+    (0, b'7z\xbc\xaf\x27\x1c', '7z', '.7z'),
+    (0, b'Rar!\x1a\x07', 'rar', '.rar'),
+    (0, b'\x28\xb5\x2f\xfd', 'zstd', '.zst'),
+    (0, b'\xfd7zXZ\x00', 'xz', '.xz'),
+    (0, b'BZh', 'bzip2', '.bz2'),
+    (0, b'\x1a\x45\xdf\xa3', 'webm', '.webm'),
+    (0, b'OggS', 'ogg', '.ogg'),
+    (0, b'ID3', 'mp3', '.mp3'),
+]
+
+# BMP的DIB头大小（文件头偏移14处），只有 'BM' 两个字节太容易误判
+BMP_HEADER_SIZES = {12, 40, 52, 56, 64, 108, 124}
+
+# ISO BMFF（ftyp盒）品牌与类型的对应关系
+FTYP_BRANDS = {
+    b'avif': ('avif', '.avif'),
+    b'avis': ('avif', '.avif'),
+    b'heic': ('heic', '.heic'),
+    b'heix': ('heic', '.heic'),
+    b'mif1': ('heic', '.heic'),
+}
+
+# 可以作为图片保存的类型
+IMAGE_KINDS = {'jpeg', 'png', 'gif', 'webp', 'bmp', 'avif', 'heic'}
+
+# 已经压缩过的格式，再用DEFLATE几乎没有收益
+COMPRESSED_KINDS = {'jpeg', 'png', 'gif', 'webp', 'avif', 'heic', 'mp4', 'webm', 'ogg', 'mp3',
+                    'zip', 'gzip', '7z', 'rar', 'zstd', 'xz', 'bzip2'}
+
+# 响应的Content-Type与类型的对应关系（文件头无法识别时使用）
+CONTENT_TYPES = {
+    'image/jpeg': ('jpeg', '.jpg'),
+    'image/jpg': ('jpeg', '.jpg'),
+    'image/pjpeg': ('jpeg', '.jpg'),
+    'image/png': ('png', '.png'),
+    'image/gif': ('gif', '.gif'),
+    'image/webp': ('webp', '.webp'),
+    'image/bmp': ('bmp', '.bmp'),
+    'image/avif': ('avif', '.avif'),
+    'image/heic': ('heic', '.heic'),
+    'image/heif': ('heic', '.heic'),
+    'video/mp4': ('mp4', '.mp4'),
+    'video/webm': ('webm', '.webm'),
+}
+
+# URL路径扩展名与类型的对应关系（文件头和Content-Type都无法判断时使用）
+URL_EXTENSIONS = {
+    '.jpg': ('jpeg', '.jpg'),
+    '.jpeg': ('jpeg', '.jpg'),
+    '.png': ('png', '.png'),
+    '.gif': ('gif', '.gif'),
+    '.webp': ('webp', '.webp'),
+    '.bmp': ('bmp', '.bmp'),
+    '.avif': ('avif', '.avif'),
+    '.heic': ('heic', '.heic'),
+    '.mp4': ('mp4', '.mp4'),
+    '.webm': ('webm', '.webm'),
+}
+
+# 探测采样大小
+SNIFF_SIZE = 64 * 1024
+
+def sniff_type(head):
+    """
+    根据文件开头的字节判断文件类型
+
+    参数:
+        head: 文件开头的字节（至少18字节效果最好）
+
+    返回:
+        (类型, 规范扩展名)，无法识别时返回 (None, None)
+    """
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp', '.webp'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in FTYP_BRANDS:
+            return FTYP_BRANDS[brand]
+        return 'mp4', '.mp4'
+    if head[:2] == b'BM' and int.from_bytes(head[14:18], 'little') in BMP_HEADER_SIZES:
+        return 'bmp', '.bmp'
+    for offset, magic, kind, ext in MAGIC_TYPES:
+        if head[offset:offset + len(magic)] == magic:
+            return kind, ext
+    if is_text(head):
+        return 'text', '.txt'
+    return None, None
+
+def is_text(head):
+    """判断采样数据是否为UTF-8文本（允许末尾截断的多字节字符）"""
+    if not head or b'\x00' in head:
+        return False
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+def probe_compressible(sample, threshold=Config.ZIP_PROBE_RATIO):
+    """用最快的压缩级别试压采样数据，压缩率低于阈值时认为值得压缩"""
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * threshold
+
+def _method_for(kind, head, level):
+    """按类型选择压缩方式，类型未知时试压采样数据"""
+    if kind in COMPRESSED_KINDS:
+        return kind, ZIP_STORED, 0
+    if kind == 'text':
+        return kind, ZIP_DEFLATED, Config.ZIP_TEXT_COMPRESS_LEVEL
+    if kind is None and not probe_compressible(head):
+        return 'unknown', ZIP_STORED, 0
+    return kind or 'unknown', ZIP_DEFLATED, level
+
+def choose_method(head, level=Config.ZIP_COMPRESS_LEVEL):
+    """
+    根据文件开头的字节选择压缩方式
+
+    参数:
+        head: 文件开头的字节
+        level: 未知类型使用的DEFLATE级别
+
+    返回:
+        (类型, 压缩方法, 压缩级别)
+    """
+    return _method_for(sniff_type(head)[0], head, level)
+
+def detect_type(head, content_type=None, url=None, level=Config.ZIP_COMPRESS_LEVEL):
+    """
+    判断下载文件的类型：依次按文件头、响应的Content-Type、URL路径的扩展名判断，同时选出压缩方式
+
+    URL只看路径部分，查询参数中的 .jpg 之类不会影响结果。
+
+    参数:
+        head: 文件开头的字节（下载时的第一个数据块，不需要再次读取文件）
+        content_type: 响应的Content-Type，None表示未知
+        url: 文件URL，None表示未知
+        level: 未知类型使用的DEFLATE级别
+
+    返回:
+        (类型, 规范扩展名, 压缩方法, 压缩级别)，都无法判断时扩展名为None
+    """
+    kind, extension = sniff_type(head) if head else (None, None)
+    if kind is None and content_type:
+        kind, extension = CONTENT_TYPES.get(content_type.split(';')[0].strip().lower(), (None, None))
+    if kind is None and url:
+        path_extension = os.path.splitext(urlsplit(url).path)[1].lower()
+        kind, extension = URL_EXTENSIONS.get(path_extension, (None, None))
+    kind, method, method_level = _method_for(kind, head, level)
+    return kind, extension, method, method_level
+
+def estimate_compressed_size(file_path, file_size, level=Config.ZIP_COMPRESS_LEVEL):
+    """
+    估算文件压缩后的大小（用于分卷规划，不是上限）：直接存储的类型按原大小，
+    其余按采样数据用最快级别试压的压缩率推算，只读取文件开头
+
+    参数:
+        file_path: 文件路径
+        file_size: 文件大小
+        level: 未知类型使用的DEFLATE级别
+
+    返回:
+        估算的字节数，文件无法读取时返回原大小
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(SNIFF_SIZE)
+    except OSError:
+        return file_size
+    _, method, _ = choose_method(head, level)
+    if method == ZIP_STORED or not head:
+        return file_size
+    return min(file_size * len(zlib.compress(head, 1)) // len(head) + 1, file_size)
+
+def compress_file(file_path, level=Config.ZIP_COMPRESS_LEVEL):
+    """
+    按内容选择压缩方式并压缩单个文件（可在工作进程中执行），文件只读取一遍
+
+    参数:
+        file_path: 文件路径
+        level: 未知类型使用的DEFLATE级别
+
+    返回:
+        (压缩方法, CRC32, 原始大小, 压缩后数据, 压缩耗费的CPU秒数, SHA-256)
+    """
+    cpu_start = time.process_time()
+    with open(file_path, 'rb') as f:
+        head = f.read(SNIFF_SIZE)
+        _, method, method_level = choose_method(head, level)
+        compressor = zlib.compressobj(method_level, zlib.DEFLATED, -15) if method == ZIP_DEFLATED else None
+        crc = 0
+        digest = hashlib.sha256()
+        size = 0
+        parts = []
+        chunk = head
+        while chunk:
+            crc = zlib.crc32(chunk, crc)
+            digest.update(chunk)
+            size += len(chunk)
+            parts.append(compressor.compress(chunk) if compressor else chunk)
+            chunk = f.read(READ_CHUNK_SIZE)
+    if compressor:
+        parts.append(compressor.flush())
+    return method, crc, size, b''.join(parts), time.process_time() - cpu_start, digest.hexdigest()
+
+class CompressionStats:
+    """压缩策略统计：记录存储和压缩的数据量，估算跳过压缩节省的CPU时间"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """清空统计"""
+        self.stored_files = 0
+        self.stored_bytes = 0
+        self.deflated_files = 0
+        self.deflated_bytes = 0
+        self.deflated_output = 0
+        self.deflate_cpu = 0.0
+
+    def record(self, method, file_size, compress_size, cpu_time):
+        """记录一个成员的压缩结果"""
+        with self._lock:
+            if method == ZIP_STORED:
+                self.stored_files += 1
+                self.stored_bytes += file_size
+            else:
+                self.deflated_files += 1
+                self.deflated_bytes += file_size
+                self.deflated_output += compress_size
+                self.deflate_cpu += cpu_time
+
+    def estimated_cpu_saved(self):
+        """按本次运行实测的DEFLATE吞吐量估算存储方式节省的CPU秒数"""
+        if self.deflated_bytes and self.deflate_cpu > 0:
+            throughput = self.deflated_bytes / self.deflate_cpu
+        else:
+            throughput = Config.ZIP_DEFLATE_THROUGHPUT
+        return self.stored_bytes / throughput
+
+    def summary(self):
+        """返回统计摘要文本"""
+        ratio = self.deflated_output / self.deflated_bytes if self.deflated_bytes else 1.0
+        return (f"压缩策略: 直接存储 {self.stored_files} 个文件 {self.stored_bytes/1024/1024:.2f}MB，"
+                f"DEFLATE压缩 {self.deflated_files} 个文件 {self.deflated_bytes/1024/1024:.2f}MB "
+                f"(压缩率 {ratio:.1%}，CPU {self.deflate_cpu:.2f} 秒)，"
+                f"估计节省CPU {self.estimated_cpu_saved():.2f} 秒")
@@ -0,0 +1,117 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import Config
+from utils.logger import logger
+
+# 清单中的一个文件：路径、相对根目录的路径（使用/分隔）以及扫描时缓存的stat结果
+FileRecord = namedtuple('FileRecord', ['path', 'arcname', 'size', 'mtime', 'stat'])
+
+class FileInventory:
+    """
+    目录文件清单：用os.scandir一次遍历目录树并缓存每个文件的stat结果，
+    打包的各个阶段（判断是否为空、统计大小、分卷分组、增量比对、写入ZIP）共用同一份清单，
+    不再重复遍历目录和获取文件大小。
+    """
+
+    def __init__(self, root, records=None):
+        """
+        初始化清单
+
+        参数:
+            root: 根目录
+            records: FileRecord列表
+        """
+        self.root = root
+        self.records = records or []
+        self._by_path = None
+
+    @classmethod
+    def scan(cls, root, workers=Config.INVENTORY_WORKERS):
+        """
+        扫描目录树生成清单，根目录下的各个子目录在线程池中并行扫描
+
+        参数:
+            root: 根目录
+            workers: 并行扫描的线程数，1表示在当前线程中顺序扫描
+
+        返回:
+            FileInventory实例，根目录不存在时为空清单
+        """
+        records = []
+        subdirs = []
+        cls._scan_dir(root, '', records, subdirs)
+        if workers > 1 and len(subdirs) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(subdirs))) as pool:
+                for subtree in pool.map(cls._scan_tree, subdirs):
+                    records.extend(subtree)
+        else:
+            for subdir in subdirs:
+                records.extend(cls._scan_tree(subdir))
+        return cls(root, records)
+
+    @staticmethod
+    def _scan_dir(path, prefix, records, subdirs):
+        """扫描一个目录：文件加入records，子目录以 (路径, 相对路径前缀) 加入subdirs"""
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append((entry.path, f"{prefix}{entry.name}/"))
+                        elif entry.is_file():
+                            st = entry.stat()
+                            records.append(FileRecord(entry.path, prefix + entry.name, st.st_size, st.st_mtime, st))
+                    except OSError as e:
+                        logger.warning(f"无法获取文件信息: {entry.path}, 错误: {e}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"无法读取目录: {path}, 错误: {e}")
+
+    @classmethod
+    def _scan_tree(cls, subdir):
+        """深度优先扫描一个子目录树，返回FileRecord列表"""
+        records = []
+        stack = [subdir]
+        while stack:
+            path, prefix = stack.pop()
+            subdirs = []
+            cls._scan_dir(path, prefix, records, subdirs)
+            stack.extend(reversed(subdirs))
+        return records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    @property
+    def is_empty(self):
+        """目录树中是否没有任何文件"""
+        return not self.records
+
+    @property
+    def total_size(self):
+        """所有文件的总大小"""
+        return sum(record.size for record in self.records)
+
+    @property
+    def file_sizes(self):
+        """(文件路径, 文件大小) 列表"""
+        return [(record.path, record.size) for record in self.records]
+
+    def stat(self, path):
+        """
+        返回扫描时缓存的stat结果
+
+        参数:
+            path: 文件路径
+
+        返回:
+            os.stat_result，不在清单中时返回None
+        """
+        if self._by_path is None:
+            self._by_path = {record.path: record.stat for record in self.records}
+        return self._by_path.get(path)
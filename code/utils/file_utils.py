@@ -1,10 +1,26 @@
 import os
 import shutil
-import zipfile
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from config.settings import Config
 from utils.logger import logger
+from utils.zip_writer import (RawZipWriter, SpannedZipWriter, compress_bound, zip_member_size,
+                              END_RECORD_SIZE, ZIP64_END_RECORDS_SIZE)
+from utils.tar_zst_writer import (TarZstWriter, zstd_available, tar_member_size, zstd_bound,
+                                  TAR_RECORD_SIZE, ZSTD_FRAME_OVERHEAD)
+from utils.file_inventory import FileInventory
+from utils.archive_verify import member_record, write_checksum_manifest
+from utils.compression_policy import (compress_file, choose_method, estimate_compressed_size, CompressionStats,
+                                      SNIFF_SIZE)
+from utils.metrics import metrics
+from utils.tracing import traced
+
+PACKAGE_FILES = metrics.counter('crawler_package_files_total', '打包的文件数', ['format'])
+PACKAGE_BYTES = metrics.counter('crawler_package_bytes_total', '打包的原始字节数', ['format'])
+PACKAGE_SECONDS = metrics.counter('crawler_package_seconds_total', '打包耗时', ['format'])
+metrics.ratio('crawler_package_bytes_per_second', 'crawler_package_bytes_total', 'crawler_package_seconds_total')
 
 class FileUtils:
     """文件操作工具类"""
@@ -33,6 +49,16 @@ class FileUtils:
             logger.error(f"目录创建失败: {path}, 错误: {e}")
             return False
     
+    @staticmethod
+    def write_volume_info(output_path, volume_paths):
+        """在ZIP文件旁写入分卷信息文件（xxx_volume_info.txt）"""
+        info_file = f"{os.path.splitext(output_path)[0]}_volume_info.txt"
+        with open(info_file, 'w', encoding='utf-8') as f:
+            f.write(f"总卷数: {len(volume_paths)}\n")
+            for i, path in enumerate(volume_paths):
+                f.write(f"分卷 {i+1}: {os.path.basename(path)}\n")
+            f.write(f"创建时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    
     @staticmethod
     def clean_filename(filename):
         """清理文件名中的非法字符"""
@@ -40,154 +66,537 @@ class FileUtils:
         # 移除Windows文件系统中的非法字符
         return re.sub(re.compile(r'[/:*?"<>|]'), '', filename)
 
+class _Progress:
+    """打包进度统计"""
+    
+    def __init__(self):
+        self.files = 0
+        self.size = 0
+    
+    def record(self, size):
+        """记录一个已写入的文件，None表示写入失败"""
+        if size is None:
+            return
+        self.files += 1
+        self.size += size
+        # 打印进度信息
+        if self.files % 100 == 0:
+            logger.info(f"已处理 {self.files} 个文件，总大小: {self.size/1024/1024:.2f} MB")
+
+def build_volume(path, entries, compress_level, segment_size=None, volume_size=None):
+    """
+    创建一个分卷（可在工作进程中执行）：按文件头选择压缩方式后逐个流式写入，内存占用与文件大小无关
+    
+    分组按估算的压缩后大小规划，写入时按实际大小检查分卷上限：按压缩上限放不下的文件先在内存中压缩，
+    仍然放不下的文件不写入，返回给调用方写入后续分卷。
+    
+    参数:
+        path: 分卷路径
+        entries: (文件路径, 压缩包内路径, 文件大小, stat结果或None) 列表
+        compress_level: 未知类型使用的DEFLATE级别
+        segment_size: 设置后写入分段ZIP（xxx.z01 ... xxx.zip），每个分段不超过该字节数
+        volume_size: 分卷字节数上限，None表示不限制
+    
+    返回:
+        (生成的文件路径列表, ZipMember列表, [(压缩方法, 原始大小, 压缩后大小, CPU秒数)], [(失败的文件, 错误)],
+         放不下的条目列表)
+    """
+    writer = SpannedZipWriter(path, segment_size) if segment_size else RawZipWriter(path)
+    stats = []
+    failed = []
+    overflow = []
+    try:
+        for entry in entries:
+            file_path, arcname, file_size, st = entry
+            try:
+                if volume_size and writer.projected_size(
+                        writer.member_size(arcname, compress_bound(file_size), file_size)) > volume_size:
+                    if file_size > Config.ZIP_PARALLEL_INLINE_LIMIT:
+                        overflow.append(entry)
+                        continue
+                    method, crc, file_size, data, cpu_time, sha256 = compress_file(file_path, compress_level)
+                    if writer.projected_size(writer.member_size(arcname, len(data), file_size)) > volume_size:
+                        overflow.append(entry)
+                        continue
+                    st = st or os.stat(file_path)
+                    writer.write_compressed(arcname, data, crc, file_size, method, st.st_mtime, st.st_mode & 0xFFFF)
+                    writer.members[-1].sha256 = sha256
+                    stats.append((method, file_size, len(data), cpu_time))
+                    continue
+                cpu_start = time.process_time()
+                with open(file_path, 'rb') as f:
+                    head = f.read(SNIFF_SIZE)
+                _, method, level = choose_method(head, compress_level)
+                writer.write_file(file_path, arcname, method, level, st)
+                member = writer.members[-1]
+                stats.append((method, member.file_size, member.compress_size, time.process_time() - cpu_start))
+            except OSError as e:
+                failed.append((file_path, str(e)))
+    finally:
+        segments = writer.close()
+    return (segments if segment_size else [path]), writer.members, stats, failed, overflow
+
 class OptimizedZipper:
     """优化的ZIP打包工具类"""
     
     # 分卷大小：2GB (GitHub单个文件上传限制)
     VOLUME_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
     
-    def __init__(self, chunk_size=Config.ZIP_CHUNK_SIZE):
-        """初始化ZIP打包器"""
+    def __init__(self, chunk_size=Config.ZIP_CHUNK_SIZE, workers=Config.ZIP_WORKERS,
+                 compress_level=Config.ZIP_COMPRESS_LEVEL, archive_format=Config.ARCHIVE_FORMAT,
+                 volume_workers=Config.ZIP_VOLUME_WORKERS):
+        """
+        初始化ZIP打包器
+        
+        参数:
+            chunk_size: 分块大小
+            workers: 并行压缩的进程数，1表示在当前进程中逐个压缩
+            compress_level: DEFLATE压缩级别
+            archive_format: 归档格式，'zip' 或 'tar.zst'
+            volume_workers: 分卷打包时同时创建分卷的进程数，1表示按顺序流式写入
+        """
         self.chunk_size = chunk_size
+        self.workers = max(workers or 1, 1)
+        self.volume_workers = max(volume_workers or 1, 1)
+        self.compress_level = compress_level
+        self.set_archive_format(archive_format)
+        # 按内容选择压缩方式的统计，累计整个运行期间的数据
+        self.compression_stats = CompressionStats()
+        # 本次打包生成的归档及其成员校验值，打包完成后写入校验清单
+        self.archives = []
     
-    def add_file_to_zip(self, zipf, file_path, arcname):
-        """将文件添加到zip文件中"""
+    def set_archive_format(self, archive_format):
+        """设置归档格式，tar.zst格式在未安装zstandard时回退为zip"""
+        if archive_format == 'tar.zst' and not zstd_available():
+            logger.warning("未安装zstandard，归档格式回退为zip")
+            archive_format = 'zip'
+        self.archive_format = archive_format
+    
+    def _record_archive(self, paths, members):
+        """记录一个可单独解压的归档（文件路径列表, ZipMember列表）的成员校验值"""
+        self.archives.append((list(paths), [member_record(m.arcname, m.file_size, m.crc, m.sha256)
+                                            for m in members]))
+    
+    def _write_checksums(self, output_path):
+        """将本次打包记录的校验值写入校验清单"""
         try:
-            zipf.write(file_path, arcname)
-            return True
+            manifest_path = write_checksum_manifest(output_path, self.archive_format, self.archives)
+            logger.info(f"校验清单已写入: {manifest_path}")
+        except OSError as e:
+            logger.error(f"写入校验清单失败: {output_path}, 错误: {e}")
+    
+    def archive_path(self, output_path):
+        """返回当前归档格式对应的输出路径（tar.zst格式将.zip扩展名替换为.tar.zst）"""
+        if self.archive_format == 'tar.zst':
+            return os.path.splitext(output_path)[0] + '.tar.zst'
+        return output_path
+    
+    def _iter_compressed(self, entries):
+        """
+        按顺序产生 (条目, 压缩任务)，文件在进程池中并行压缩；压缩任务为None表示在当前进程中流式压缩
+        
+        限制在途任务数量，压缩结果按提交顺序取回，内存占用有上限。
+        """
+        if self.workers <= 1 or len(entries) <= 1:
+            for entry in entries:
+                yield entry, None
+            return
+        
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            window = deque()
+            for entry in entries:
+                file_path, _, file_size, _ = entry
+                # 大文件在当前进程中流式压缩，避免整块压缩数据在进程间传递
+                future = None
+                if file_size <= Config.ZIP_PARALLEL_INLINE_LIMIT:
+                    future = pool.submit(compress_file, file_path, self.compress_level)
+                window.append((entry, future))
+                while len(window) > self.workers * 2:
+                    yield window.popleft()
+            while window:
+                yield window.popleft()
+    
+    def _collect(self, entry, future):
+        """取回工作进程的压缩结果，返回 (是否成功, 压缩结果)，在当前进程中压缩时压缩结果为None"""
+        if future is None:
+            return True, None
+        try:
+            return True, future.result()
+        except Exception as e:
+            logger.error(f"添加文件失败 {entry[0]}: {e}")
+            return False, None
+    
+    def _write_member(self, writer, entry, result):
+        """将一个成员写入ZIP：result为工作进程的压缩结果，None表示在当前进程中流式压缩"""
+        file_path, arcname, _, st = entry
+        try:
+            if result is None:
+                # 根据文件头选择压缩方式后流式写入
+                cpu_start = time.process_time()
+                with open(file_path, 'rb') as f:
+                    head = f.read(SNIFF_SIZE)
+                _, method, level = choose_method(head, self.compress_level)
+                writer.write_file(file_path, arcname, method, level, st)
+                member = writer.members[-1]
+                self.compression_stats.record(method, member.file_size, member.compress_size,
+                                              time.process_time() - cpu_start)
+                return member.file_size
+            method, crc, file_size, data, cpu_time, sha256 = result
+            st = st or os.stat(file_path)
+            writer.write_compressed(arcname, data, crc, file_size, method,
+                                    st.st_mtime, st.st_mode & 0xFFFF)
+            writer.members[-1].sha256 = sha256
+            self.compression_stats.record(method, file_size, len(data), cpu_time)
+            return file_size
         except Exception as e:
             logger.error(f"添加文件失败 {file_path}: {e}")
-            return False
+            return None
+    
+    def write_zip(self, entries, output_path):
+        """
+        将文件写入一个标准ZIP文件，各文件在进程池中独立压缩后按顺序写入
+        
+        每个文件按文件头魔数选择压缩方式：JPEG/PNG/GIF/WebP等已压缩格式直接存储，
+        文本使用较高的DEFLATE级别，未知类型先试压采样数据再决定。
+        
+        参数:
+            entries: (文件路径, 压缩包内路径, 文件大小, stat结果或None) 列表
+            output_path: 输出ZIP文件路径
+        
+        返回:
+            (写入的文件数, 原始总大小)
+        """
+        progress = _Progress()
+        with RawZipWriter(output_path) as writer:
+            for entry, future in self._iter_compressed(entries):
+                ok, result = self._collect(entry, future)
+                if ok:
+                    progress.record(self._write_member(writer, entry, result))
+        self._record_archive([output_path], writer.members)
+        return progress.files, progress.size
+    
+    def write_volumes(self, entries, output_path, start_part=0):
+        """
+        流式写入分卷ZIP：成员按顺序写入，下一个成员放不下时在分卷大小处换到新分卷，
+        每个分卷都是可以单独解压的标准ZIP，且不超过VOLUME_SIZE字节。
+        
+        压缩后大小未知的成员按压缩上限预留空间；按上限放不下时先在当前进程中压缩，按实际大小判断，
+        可压缩的文本不会提前换卷，也不会被当作超大文件单独存储。
+        
+        单个成员本身超过分卷大小时，使用标准分段ZIP格式（xxx_partN.z01 ... xxx_partN.zip）
+        跨多个文件存储，每个分段同样不超过VOLUME_SIZE字节。
+        
+        参数:
+            entries: (文件路径, 压缩包内路径, 文件大小, stat结果或None) 列表，按分组顺序排列
+            output_path: 输出ZIP文件路径，分卷命名为 xxx_part1.zip、xxx_part2.zip ...
+            start_part: 已有的分卷数，新分卷从 xxx_part{start_part+1}.zip 开始编号
+        
+        返回:
+            (分卷文件路径列表, 写入的文件数, 原始总大小)
+        """
+        stem = os.path.splitext(output_path)[0]
+        progress = _Progress()
+        volume_paths = []
+        writer = None
+        part = start_part
+        
+        def close_volume():
+            nonlocal writer
+            if writer:
+                writer.close()
+                self._record_archive([writer.path], writer.members)
+                logger.info(f"分卷 {part} 创建完成，大小: {os.path.getsize(writer.path)/1024/1024:.2f}MB")
+                writer = None
+        
+        try:
+            for entry, future in self._iter_compressed(entries):
+                ok, result = self._collect(entry, future)
+                if not ok:
+                    continue
+                file_path, arcname, file_size, _ = entry
+                if result is None and file_size <= Config.ZIP_PARALLEL_INLINE_LIMIT and \
+                        not self._member_fits(writer, arcname, compress_bound(file_size), file_size):
+                    try:
+                        result = compress_file(file_path, self.compress_level)
+                    except OSError as e:
+                        logger.error(f"添加文件失败 {file_path}: {e}")
+                        continue
+                # 压缩结果未知时（当前进程流式压缩）按DEFLATE压缩上限预留空间
+                compress_size = len(result[3]) if result else compress_bound(file_size)
+                
+                oversized = not self._member_fits(None, arcname, compress_size, file_size)
+                if writer is not None and (oversized or
+                                           not self._member_fits(writer, arcname, compress_size, file_size)):
+                    close_volume()
+                
+                if oversized:
+                    # 超过分卷大小的成员跨分段存储
+                    part += 1
+                    spanned_path = f"{stem}_part{part}.zip"
+                    logger.info(f"文件超过分卷大小，使用分段ZIP存储: {arcname} -> {spanned_path}")
+                    spanned = SpannedZipWriter(spanned_path, self.VOLUME_SIZE)
+                    try:
+                        progress.record(self._write_member(spanned, entry, result))
+                    finally:
+                        segments = spanned.close()
+                    self._record_archive(segments, spanned.members)
+                    volume_paths.extend(segments)
+                    logger.info(f"分段ZIP创建完成: {spanned_path}，共 {len(segments)} 个分段")
+                    continue
+                
+                if writer is None:
+                    part += 1
+                    volume_paths.append(f"{stem}_part{part}.zip")
+                    writer = RawZipWriter(volume_paths[-1])
+                progress.record(self._write_member(writer, entry, result))
+        finally:
+            close_volume()
+        
+        return volume_paths, progress.files, progress.size
+    
+    def _member_fits(self, writer, arcname, compress_size, file_size):
+        """成员能否放进当前分卷而不超过VOLUME_SIZE，writer为None时按空分卷判断"""
+        if writer is None:
+            return zip_member_size(arcname, compress_size, file_size) + \
+                END_RECORD_SIZE + ZIP64_END_RECORDS_SIZE <= self.VOLUME_SIZE
+        return writer.projected_size(writer.member_size(arcname, compress_size, file_size)) <= self.VOLUME_SIZE
     
     def get_file_sizes(self, directory):
-        """获取目录中所有文件的大小"""
-        total_size = 0
-        file_sizes = []
-        
-        for root, _, files in os.walk(directory):
-            for file in files:
-                file_path = os.path.join(root, file)
-                try:
-                    file_size = os.path.getsize(file_path)
-                    total_size += file_size
-                    file_sizes.append((file_path, file_size))
-                except (OSError, PermissionError) as e:
-                    logger.warning(f"无法获取文件大小: {file_path}, 错误: {e}")
-        
-        return total_size, file_sizes
+        """获取目录中所有文件的大小，返回 (总大小, (文件路径, 文件大小) 列表)"""
+        inventory = FileInventory.scan(directory)
+        return inventory.total_size, inventory.file_sizes
+    
+    @staticmethod
+    def build_entries(source_dir, file_sizes, inventory=None):
+        """
+        生成写入ZIP的条目列表，有清单时使用扫描时缓存的stat结果
+        
+        返回:
+            (文件路径, 压缩包内路径, 文件大小, stat结果或None) 列表
+        """
+        return [(file_path, os.path.relpath(file_path, source_dir), file_size,
+                 inventory.stat(file_path) if inventory else None)
+                for file_path, file_size in file_sizes]
+    
+    def planned_member_size(self, file_path, file_size):
+        """估算文件在归档中占用的最大字节数（按压缩上限和完整路径长度计算）"""
+        if self.archive_format == 'tar.zst':
+            return zstd_bound(tar_member_size(file_path, file_size))
+        return zip_member_size(file_path, compress_bound(file_size), file_size)
+    
+    def estimated_member_size(self, file_path, file_size):
+        """按采样压缩率估算文件在归档中占用的字节数，用于分卷分组（写入时再按实际大小检查分卷上限）"""
+        estimate = estimate_compressed_size(file_path, file_size, self.compress_level)
+        if self.archive_format == 'tar.zst':
+            return tar_member_size(file_path, estimate)
+        return zip_member_size(file_path, estimate, file_size)
+    
+    def volume_capacity(self):
+        """单个分卷中可用于成员的字节数"""
+        if self.archive_format == 'tar.zst':
+            return self.VOLUME_SIZE - zstd_bound(TAR_RECORD_SIZE) - ZSTD_FRAME_OVERHEAD
+        return self.VOLUME_SIZE - END_RECORD_SIZE - ZIP64_END_RECORDS_SIZE
     
     def should_use_volume_packaging(self, total_size, file_sizes):
-        """判断是否应该使用分卷打包"""
-        # 如果总大小超过2GB或者有单个文件超过2GB，使用分卷打包
-        if total_size > OptimizedZipper.VOLUME_SIZE:
-            return True
+        """
+        判断是否应该使用分卷打包：所有文件连同ZIP结构的最大大小超过分卷大小
         
-        # 检查是否有单个文件超过2GB
-        for _, file_size in file_sizes:
-            if file_size > OptimizedZipper.VOLUME_SIZE:
+        不分卷时写入单个归档，写入过程不检查大小，因此这里按压缩上限判断。
+        """
+        planned = 0
+        for file_path, file_size in file_sizes:
+            planned += self.planned_member_size(file_path, file_size)
+            if planned > self.volume_capacity():
                 return True
-        
         return False
     
-    def create_volume_zip(self, output_path, file_groups, base_dir):
-        """创建分卷ZIP文件"""
-        volume_paths = []
+    def create_volume_zip(self, output_path, file_groups, base_dir, inventory=None):
+        """
+        创建分卷ZIP文件：多个分组时在进程池中同时创建各个分卷（每组一个分卷），
+        否则按分组顺序流式写入，在分卷大小处换卷
+        """
+        start_time = time.time()
         
-        for i, file_group in enumerate(file_groups):
-            # 创建分卷文件名，如：xxx_part1.zip
-            volume_name = f"{os.path.splitext(output_path)[0]}_part{i+1}.zip"
-            volume_paths.append(volume_name)
-            
-            logger.info(f"开始创建分卷 {i+1}/{len(file_groups)}: {volume_name}")
-            start_time = time.time()
-            
-            try:
-                with zipfile.ZipFile(volume_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    current_size = 0
-                    
-                    for file_path, file_size in file_group:
-                        # 计算相对路径
-                        rel_path = os.path.relpath(file_path, base_dir)
-                        
-                        # 添加文件到ZIP
-                        if self.add_file_to_zip(zipf, file_path, rel_path):
-                            current_size += file_size
-                            
-                            # 记录进度
-                            if current_size % 50000000 < file_size:  # 每50MB记录一次
-                                logger.info(f"  已添加: {rel_path} ({file_size/1024/1024:.2f}MB)")
-            except Exception as e:
-                logger.error(f"创建分卷 {volume_name} 失败: {e}")
-                return False, [], 0
-            
-            elapsed_time = time.time() - start_time
-            volume_size = os.path.getsize(volume_name) if os.path.exists(volume_name) else 0
-            logger.info(f"分卷 {i+1} 创建完成，耗时: {elapsed_time:.2f}秒, 大小: {volume_size/1024/1024:.2f}MB")
+        try:
+            if self.volume_workers > 1 and len(file_groups) > 1:
+                volume_paths = self.write_volumes_parallel(file_groups, base_dir, output_path, inventory)
+            else:
+                entries = self.build_entries(base_dir, [item for file_group in file_groups for item in file_group],
+                                             inventory)
+                volume_paths, _, _ = self.write_volumes(entries, output_path)
+        except Exception as e:
+            logger.error(f"创建分卷失败: {output_path}, 错误: {e}")
+            return False, [], 0
+        
+        logger.info(f"分卷打包完成，共 {len(volume_paths)} 个文件，耗时: {time.time() - start_time:.2f}秒")
         
         # 创建分卷信息文件
-        info_file = f"{os.path.splitext(output_path)[0]}_volume_info.txt"
-        with open(info_file, 'w', encoding='utf-8') as f:
-            f.write(f"总卷数: {len(volume_paths)}\n")
-            for i, path in enumerate(volume_paths):
-                f.write(f"分卷 {i+1}: {os.path.basename(path)}\n")
-            f.write(f"创建时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        FileUtils.write_volume_info(output_path, volume_paths)
         
         return True, volume_paths, len(volume_paths)
     
+    def write_volumes_parallel(self, file_groups, base_dir, output_path, inventory=None):
+        """
+        在进程池中同时创建各个分卷，每个FFD分组对应一个分卷；分组按估算大小规划，
+        工作进程写入时按实际大小检查分卷上限，放不下的文件最后按顺序写入后续分卷
+        
+        每个工作进程逐个流式压缩文件，内存占用只与进程数有关；分卷按分组顺序命名，
+        结果也按分组顺序取回，分卷信息和校验清单的顺序与顺序写入时一致。
+        
+        参数:
+            file_groups: group_files_for_volume 返回的分组列表
+            base_dir: 压缩包内路径相对于该目录计算
+            output_path: 输出ZIP文件路径，分卷命名为 xxx_part1.zip、xxx_part2.zip ...
+            inventory: 源目录的FileInventory
+        
+        返回:
+            分卷文件路径列表（超大文件的分段ZIP按 .z01 ... .zip 的顺序排列）
+        """
+        stem = os.path.splitext(output_path)[0]
+        tasks = []
+        for i, file_group in enumerate(file_groups):
+            oversized = self.is_oversized_group(file_group)
+            tasks.append((f"{stem}_part{i+1}.zip", self.build_entries(base_dir, file_group, inventory),
+                          self.compress_level, self.VOLUME_SIZE if oversized else None,
+                          None if oversized else self.VOLUME_SIZE))
+        
+        workers = min(self.volume_workers, len(tasks))
+        logger.info(f"并行创建 {len(tasks)} 个分卷，进程数: {workers}")
+        progress = _Progress()
+        volume_paths = []
+        overflow = []
+        part = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(build_volume, *task) for task in tasks]
+            for index, future in enumerate(futures, 1):
+                paths, members, stats, failed, rest = future.result()
+                for file_path, error in failed:
+                    logger.error(f"添加文件失败 {file_path}: {error}")
+                for method, file_size, compress_size, cpu_time in stats:
+                    self.compression_stats.record(method, file_size, compress_size, cpu_time)
+                    progress.record(file_size)
+                overflow.extend(rest)
+                if not members:
+                    # 分组中的文件都放不下或都写入失败，删除空分卷，后面的分卷依次前移编号
+                    for path in paths:
+                        os.remove(path)
+                    continue
+                part += 1
+                if part != index:
+                    paths = [self._renumber_volume(path, stem, index, part) for path in paths]
+                self._record_archive(paths, members)
+                volume_paths.extend(paths)
+                volume_size = sum(os.path.getsize(path) for path in paths)
+                logger.info(f"分卷 {part} 创建完成: {os.path.basename(paths[-1])}，{len(paths)} 个文件，"
+                            f"大小: {volume_size/1024/1024:.2f}MB")
+        if overflow:
+            # 估算的压缩后大小偏小时，放不下的文件按顺序写入后续分卷
+            logger.info(f"{len(overflow)} 个文件超出所在分卷的大小，写入后续分卷")
+            paths, _, _ = self.write_volumes(overflow, output_path, start_part=part)
+            volume_paths.extend(paths)
+        return volume_paths
+    
+    @staticmethod
+    def _renumber_volume(path, stem, old_part, new_part):
+        """将分卷文件 xxx_part{old_part}.zip（或分段 .z01 ...）改名为 xxx_part{new_part}.zip，返回新路径"""
+        new_path = f"{stem}_part{new_part}{path[len(f'{stem}_part{old_part}'):]}"
+        os.replace(path, new_path)
+        return new_path
+    
+    def is_oversized_group(self, file_group):
+        """分组是否为单独存储的超大文件（估算的压缩后大小超过分卷容量，写入时跨分段存储）"""
+        return len(file_group) == 1 and self.estimated_member_size(*file_group[0]) > self.volume_capacity()
+    
     def group_files_for_volume(self, file_sizes):
-        """将文件分组以适应分卷大小"""
+        """
+        使用首次适应递减（FFD）算法将文件分组，每组估算的大小不超过分卷容量
+        
+        分组按估算的压缩后大小（estimated_member_size）规划，可压缩的文本不会按压缩上限占满分卷；
+        估算不是上限，写入时再按实际大小检查，放不下的文件换到后续分卷。
+        文件按估算大小降序依次放入第一个放得下的分组，超过分卷大小的文件单独成组（写入时跨分段存储）。
+        
+        参数:
+            file_sizes: (文件路径, 文件大小) 列表
+        
+        返回:
+            分组列表，每组为 (文件路径, 文件大小) 列表
+        """
+        capacity = self.volume_capacity()
         file_groups = []
-        current_group = []
-        current_size = 0
-        
-        # 对文件按大小降序排序，优先处理大文件
-        sorted_files = sorted(file_sizes, key=lambda x: x[1], reverse=True)
-        
-        for file_path, file_size in sorted_files:
-            # 如果单个文件超过分卷大小，单独创建一个分卷
-            if file_size > OptimizedZipper.VOLUME_SIZE:
-                if current_group:
-                    file_groups.append(current_group)
-                    current_group = []
-                    current_size = 0
+        free_space = []
+        
+        estimated = [(self.estimated_member_size(file_path, file_size), file_path, file_size)
+                     for file_path, file_size in file_sizes]
+        for size, file_path, file_size in sorted(estimated, key=lambda x: x[0], reverse=True):
+            if size > capacity:
                 file_groups.append([(file_path, file_size)])
+                free_space.append(0)
+                continue
+            for i, free in enumerate(free_space):
+                if size <= free:
+                    file_groups[i].append((file_path, file_size))
+                    free_space[i] -= size
+                    break
             else:
-                # 检查添加当前文件是否超过分卷大小
-                if current_size + file_size > OptimizedZipper.VOLUME_SIZE * 0.9:  # 预留10%空间
-                    file_groups.append(current_group)
-                    current_group = []
-                    current_size = 0
-                current_group.append((file_path, file_size))
-                current_size += file_size
-        
-        # 添加最后一个组（如果有）
-        if current_group:
-            file_groups.append(current_group)
+                file_groups.append([(file_path, file_size)])
+                free_space.append(capacity - size)
         
         return file_groups
     
-    def zip_directory(self, source_dir, output_path, exclude_empty_dirs=True):
-        """优化的目录打包函数，支持分卷打包"""
+    @traced('zip_directory', ('source_dir', 'output_path'))
+    def zip_directory(self, source_dir, output_path, exclude_empty_dirs=True, inventory=None):
+        """优化的目录打包函数，支持分卷打包；inventory为已扫描的目录清单，None时重新扫描"""
+        if inventory is None:
+            inventory = FileInventory.scan(source_dir)
+        logger.info(f"检测到 {len(inventory)} 个文件，总大小: {inventory.total_size/1024/1024:.2f}MB")
+        
+        success, total_files, total_size, _ = self.zip_file_list(source_dir, inventory.file_sizes, output_path, inventory)
+        return success, total_files, total_size
+    
+    def zip_file_list(self, source_dir, file_sizes, output_path, inventory=None):
+        """
+        打包目录中的指定文件，超过分卷大小时使用分卷打包
+        
+        参数:
+            source_dir: 源目录，压缩包内路径相对于该目录计算
+            file_sizes: (文件路径, 文件大小) 列表
+            output_path: 输出ZIP文件路径
+            inventory: 源目录的FileInventory，提供缓存的stat结果，避免重复获取文件信息
+        
+        返回:
+            (是否成功, 文件数, 原始总大小, 生成的ZIP文件路径列表)
+        """
+        start_time = time.perf_counter()
+        result = self._zip_file_list(source_dir, file_sizes, output_path, inventory)
+        success, total_files, total_size, _ = result
+        if success:
+            PACKAGE_FILES.inc(total_files, format=self.archive_format)
+            PACKAGE_BYTES.inc(total_size, format=self.archive_format)
+            PACKAGE_SECONDS.inc(time.perf_counter() - start_time, format=self.archive_format)
+        return result
+    
+    def _zip_file_list(self, source_dir, file_sizes, output_path, inventory=None):
+        """zip_file_list 的实现，参数和返回值相同"""
         start_time = time.time()
         total_files = 0
-        total_size = 0
+        total_size = sum(file_size for _, file_size in file_sizes)
         
         # 创建父目录（如果不存在）
         output_dir = os.path.dirname(output_path)
         if output_dir and not os.path.exists(output_dir):
             FileUtils.create_directory(output_dir)
         
-        # 获取目录中所有文件的大小
-        total_size, file_sizes = self.get_file_sizes(source_dir)
-        logger.info(f"检测到 {len(file_sizes)} 个文件，总大小: {total_size/1024/1024:.2f}MB")
-        
         if not file_sizes:
             logger.warning("源目录中没有文件，跳过打包")
-            return False, 0, 0
+            return False, 0, 0, []
+        
+        self.archives = []
+        if self.archive_format == 'tar.zst':
+            return self.write_tar_zst(source_dir, file_sizes, output_path)
         
         # 判断是否需要分卷打包
         if self.should_use_volume_packaging(total_size, file_sizes):
-            logger.info("文件大小超过2GB，将使用分卷打包策略")
+            logger.info(f"文件大小超过分卷大小 {self.VOLUME_SIZE/1024/1024:.0f}MB，将使用分卷打包策略")
             
             # 对文件进行分组
             file_groups = self.group_files_for_volume(file_sizes)
@@ -195,46 +604,105 @@ class OptimizedZipper:
             
             # 创建分卷ZIP
             success, volume_paths, volume_count = self.create_volume_zip(
-                output_path, file_groups, os.path.dirname(source_dir)
+                output_path, file_groups, source_dir, inventory
             )
             
             if success:
-                return True, len(file_sizes), total_size
+                logger.info(self.compression_stats.summary())
+                self._write_checksums(output_path)
+                return True, len(file_sizes), total_size, volume_paths
             else:
-                return False, 0, 0
+                return False, 0, 0, []
         else:
-            # 使用普通打包方式
+            # 使用普通打包方式，文件在进程池中并行压缩
+            logger.info(f"压缩进程数: {self.workers}")
+            entries = self.build_entries(source_dir, file_sizes, inventory)
             try:
-                with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    # 遍历源目录
-                    for root, dirs, files in os.walk(source_dir):
-                        # 检查当前目录是否为空且需要排除
-                        if exclude_empty_dirs and not files and not dirs:
-                            continue
-                        
-                        # 添加文件
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.relpath(file_path, source_dir)
-                            
-                            if self.add_file_to_zip(zipf, file_path, arcname):
-                                total_files += 1
-                                total_size += os.path.getsize(file_path)
-                                
-                                # 打印进度信息
-                                if total_files % 100 == 0:
-                                    logger.info(f"已处理 {total_files} 个文件，总大小: {total_size/1024/1024:.2f} MB")
+                total_files, total_size = self.write_zip(entries, output_path)
             except Exception as e:
                 logger.error(f"打包过程出错: {e}")
-                return False, 0, 0
+                return False, 0, 0, []
             
             end_time = time.time()
             logger.info(f"打包完成: {output_path}")
             logger.info(f"总文件数: {total_files}")
             logger.info(f"总大小: {total_size/1024/1024:.2f} MB")
             logger.info(f"耗时: {end_time - start_time:.2f} 秒")
+            logger.info(self.compression_stats.summary())
+            self._write_checksums(output_path)
             
-            return True, total_files, total_size
+            return True, total_files, total_size, [output_path]
+    
+    def write_tar_zst(self, source_dir, file_sizes, output_path):
+        """
+        打包为tar.zst格式（多线程zstd），超过分卷大小时按FFD分组顺序写入多个可单独解压的分卷，
+        下一个文件放不下时换到新分卷（按已输出的字节数判断），每个分卷不超过VOLUME_SIZE字节；
+        单个文件超过分卷大小时按分卷大小切分为 xxx_partN.tar.zst.001、.002 ...
+        
+        参数:
+            source_dir: 源目录，归档内路径相对于该目录计算
+            file_sizes: (文件路径, 文件大小) 列表
+            output_path: 输出路径，扩展名替换为.tar.zst
+        
+        返回:
+            (是否成功, 文件数, 原始总大小, 生成的文件路径列表)
+        """
+        start_time = time.time()
+        stem = os.path.splitext(output_path)[0]
+        total_size = sum(file_size for _, file_size in file_sizes)
+        volume_mode = self.should_use_volume_packaging(total_size, file_sizes)
+        if volume_mode:
+            file_groups = self.group_files_for_volume(file_sizes)
+            file_sizes = [item for file_group in file_groups for item in file_group]
+        logger.info(f"tar.zst打包: 级别 {Config.ZSTD_LEVEL}，线程 {Config.ZSTD_THREADS}，"
+                    f"长距离匹配 {'开启' if Config.ZSTD_LONG_DISTANCE else '关闭'}，"
+                    f"{'分卷' if volume_mode else '不分卷'}")
+        
+        paths = []
+        progress = _Progress()
+        writer = None
+        part = 0
+        
+        def close_volume():
+            nonlocal writer
+            if writer:
+                volume_paths = writer.close()
+                self.archives.append((volume_paths, [member_record(*checksum) for checksum in writer.checksums]))
+                paths.extend(volume_paths)
+                volume_size = sum(os.path.getsize(path) for path in volume_paths)
+                logger.info(f"分卷创建完成: {writer.path}，大小: {volume_size/1024/1024:.2f}MB")
+                writer = None
+        
+        try:
+            try:
+                for file_path, file_size in file_sizes:
+                    arcname = os.path.relpath(file_path, source_dir)
+                    # 超大文件写完后单独成卷，其余文件放不下时换卷
+                    if writer is not None and volume_mode and \
+                            (writer.spanned or not writer.fits(arcname, file_size, self.VOLUME_SIZE)):
+                        close_volume()
+                    if writer is None:
+                        part += 1
+                        # 分卷都按分卷大小切分，没有超过时只有一个分段，仍命名为 xxx_partN.tar.zst
+                        writer = TarZstWriter(f"{stem}_part{part}.tar.zst", part_size=self.VOLUME_SIZE) \
+                            if volume_mode else TarZstWriter(f"{stem}.tar.zst")
+                    try:
+                        progress.record(writer.add_file(file_path, arcname))
+                    except OSError as e:
+                        logger.error(f"添加文件失败 {file_path}: {e}")
+            finally:
+                close_volume()
+        except Exception as e:
+            logger.error(f"打包过程出错: {e}")
+            return False, 0, 0, []
+        
+        if len(paths) > 1:
+            FileUtils.write_volume_info(output_path, paths)
+        self._write_checksums(output_path)
+        output_size = sum(os.path.getsize(path) for path in paths)
+        logger.info(f"tar.zst打包完成: {progress.files} 个文件，{progress.size/1024/1024:.2f}MB -> "
+                    f"{output_size/1024/1024:.2f}MB，耗时: {time.time() - start_time:.2f} 秒")
+        return True, progress.files, progress.size, paths
     
     def create_optimized_zips(self, target_dirs, output_base_dir):
         """为多个目录创建优化的zip文件"""
@@ -246,8 +714,9 @@ class OptimizedZipper:
                 results.append((source_dir, False, 0, 0))
                 continue
             
-            # 检查目录是否为空
-            if FileUtils.is_directory_empty(source_dir):
+            # 扫描一次目录，判断是否为空以及后续打包都使用同一份清单
+            inventory = FileInventory.scan(source_dir)
+            if inventory.is_empty:
                 logger.warning(f"源目录为空: {source_dir}")
                 results.append((source_dir, False, 0, 0))
                 continue
@@ -280,7 +749,7 @@ class OptimizedZipper:
             output_path = os.path.join(category_dir, zip_filename)
             
             # 创建zip文件
-            success, file_count, total_size = self.zip_directory(source_dir, output_path)
+            success, file_count, total_size = self.zip_directory(source_dir, output_path, inventory=inventory)
             results.append((source_dir, success, file_count, total_size))
         
         return results
@@ -0,0 +1,288 @@
+import io
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from config.settings import Config
+from utils.logger import logger
+from utils.compression_policy import sniff_type, IMAGE_KINDS
+from utils.metrics import metrics
+
+# Pillow为可选依赖，未安装时只按文件头检查是否为图片
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError, features
+except ImportError:
+    Image = None
+    UnidentifiedImageError = None
+
+# Pillow可能缺少解码插件的类型，无法识别时不视为损坏
+OPTIONAL_DECODER_KINDS = {'avif', 'heic'}
+# 检查文件头读取的字节数
+HEAD_SIZE = 64
+QUEUE_DEPTH = metrics.gauge('crawler_queue_depth', '调度队列中待处理的任务数量', ['kind'])
+IMAGES_VERIFIED = metrics.counter('crawler_images_verified_total', '图片校验结果', ['result'])
+
+# 转码格式 -> (Pillow格式名, 扩展名)
+TRANSCODE_FORMATS = {'webp': ('WEBP', '.webp'), 'avif': ('AVIF', '.avif')}
+
+def pillow_available():
+    """是否已安装Pillow"""
+    return Image is not None
+
+def transcode_available(target):
+    """当前Pillow是否支持编码为该格式"""
+    if Image is None or target not in TRANSCODE_FORMATS:
+        return False
+    try:
+        return features.check(target)
+    except ValueError:
+        return False
+
+def _transcode(img, file_path, target, quality, max_dimension):
+    """
+    把已解码的图片转码为目标格式，写入 原文件名去掉扩展名 + 目标扩展名 + .part
+
+    返回:
+        (临时文件路径, 最终扩展名, 原大小, 转码后大小, CPU秒数)，动图或不需要转码时返回None
+    """
+    if getattr(img, 'n_frames', 1) > 1:
+        return None
+    cpu_start = time.process_time()
+    image = ImageOps.exif_transpose(img)
+    if max_dimension and max(image.size) > max_dimension:
+        image = image.copy() if image is img else image
+        image.thumbnail((max_dimension, max_dimension))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+    pil_format, extension = TRANSCODE_FORMATS[target]
+    part_path = f"{os.path.splitext(file_path)[0]}{extension}.part"
+    image.save(part_path, pil_format, quality=quality)
+    return (part_path, extension, os.path.getsize(file_path), os.path.getsize(part_path),
+            time.process_time() - cpu_start)
+
+def verify_image(file_path, thumb_size=None, transcode=None):
+    """
+    校验图片能否完整解码，可同时生成缩略图和转码（在工作进程中执行，图片只解码一次）
+
+    参数:
+        file_path: 图片路径
+        thumb_size: 缩略图最长边的像素数，None表示不生成
+        transcode: (目标格式, 质量, 最大边长)，None表示不转码；已是目标格式的图片和动图不转码
+
+    返回:
+        (是否有效, 失败原因, 缩略图JPEG数据或None, 转码结果或None)
+        转码结果为 (临时文件路径, 扩展名, 原大小, 转码后大小, CPU秒数)
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(HEAD_SIZE)
+    except OSError as e:
+        return False, f"无法读取: {e}", None, None
+    kind, _ = sniff_type(head)
+    if kind not in IMAGE_KINDS:
+        # 常见情况是服务器返回的HTML错误页
+        return False, f"不是图片（{kind or '未知类型'}）", None, None
+    if Image is None:
+        return True, None, None, None
+    try:
+        # verify只检查文件结构，截断的数据要在load时才能发现
+        with Image.open(file_path) as img:
+            img.verify()
+        with Image.open(file_path) as img:
+            img.load()
+            transcoded = None
+            if transcode and kind != transcode[0]:
+                transcoded = _transcode(img, file_path, *transcode)
+            thumb = None
+            if thumb_size:
+                img.thumbnail((thumb_size, thumb_size))
+                buffer = io.BytesIO()
+                img.convert('RGB').save(buffer, 'JPEG', quality=Config.IMAGE_THUMB_QUALITY)
+                thumb = buffer.getvalue()
+            return True, None, thumb, transcoded
+    except UnidentifiedImageError as e:
+        if kind in OPTIONAL_DECODER_KINDS:
+            return True, None, None, None
+        return False, f"图片无法解码: {e}", None, None
+    except Exception as e:
+        return False, f"图片无法解码: {e}", None, None
+
+def make_contact_sheet(thumbnails, output_path, columns=Config.IMAGE_SHEET_COLUMNS,
+                       thumb_size=Config.IMAGE_THUMB_SIZE):
+    """
+    把帖子的缩略图拼成一张索引图（在工作进程中执行）
+
+    参数:
+        thumbnails: 缩略图JPEG数据列表（按图片序号排列）
+        output_path: 索引图保存路径
+        columns: 每行的缩略图数量
+        thumb_size: 每个格子的边长
+
+    返回:
+        索引图路径
+    """
+    columns = min(columns, len(thumbnails))
+    rows = math.ceil(len(thumbnails) / columns)
+    sheet = Image.new('RGB', (columns * thumb_size, rows * thumb_size), 'white')
+    for i, data in enumerate(thumbnails):
+        with Image.open(io.BytesIO(data)) as thumb:
+            x = i % columns * thumb_size + (thumb_size - thumb.width) // 2
+            y = i // columns * thumb_size + (thumb_size - thumb.height) // 2
+            sheet.paste(thumb, (x, y))
+    sheet.save(output_path, 'JPEG', quality=Config.IMAGE_THUMB_QUALITY)
+    return output_path
+
+class ImageProcessor:
+    """
+    下载后处理：在进程池中校验图片、生成缩略图并按需转码，与主线程的下载同时进行。
+
+    提交的任务带有调用方的标记，用 collect 取回已完成的结果；
+    帖子完成后可以用缩略图在进程池中生成索引图。
+    """
+
+    def __init__(self, workers=Config.IMAGE_VERIFY_WORKERS, contact_sheet=Config.IMAGE_CONTACT_SHEET,
+                 transcode=Config.IMAGE_TRANSCODE, keep_original=Config.IMAGE_KEEP_ORIGINAL):
+        """
+        初始化处理器（第一次提交任务时才启动进程池）
+
+        参数:
+            workers: 处理进程数
+            contact_sheet: 是否为每个帖子生成缩略图索引图（需要Pillow）
+            transcode: 转码目标格式 'webp' 或 'avif'，None表示不转码（需要Pillow）
+            keep_original: 转码后是否保留原图
+        """
+        self.workers = max(workers, 1)
+        self.contact_sheet = contact_sheet and Image is not None
+        if contact_sheet and Image is None:
+            logger.warning("未安装Pillow，不生成缩略图索引图")
+        if Image is None:
+            logger.warning("未安装Pillow，图片只按文件头校验")
+        if transcode and not transcode_available(transcode):
+            logger.warning(f"当前Pillow不支持编码为 {transcode}，不转码")
+            transcode = None
+        self.transcode = transcode
+        self.keep_original = keep_original
+        self._pool = None
+        self._futures = {}
+        self._sheets = []
+        self.verified = 0
+        self.broken = 0
+        self.sheets = 0
+        self.transcoded = 0
+        self.transcode_skipped = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.transcode_cpu = 0.0
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def submit(self, file_path, tag):
+        """
+        提交一张图片校验
+
+        参数:
+            file_path: 图片路径
+            tag: 调用方的标记，随结果返回
+        """
+        thumb_size = Config.IMAGE_THUMB_SIZE if self.contact_sheet else None
+        transcode = (self.transcode, Config.IMAGE_TRANSCODE_QUALITY, Config.IMAGE_MAX_DIMENSION) \
+            if self.transcode else None
+        future = self._get_pool().submit(verify_image, file_path, thumb_size, transcode)
+        self._futures[future] = (tag, file_path)
+        QUEUE_DEPTH.set(len(self._futures), kind='verify')
+
+    def submit_contact_sheet(self, thumbnails, output_path):
+        """提交一个帖子的索引图生成任务，没有缩略图时忽略"""
+        if self.contact_sheet and thumbnails:
+            self._sheets.append(self._get_pool().submit(make_contact_sheet, thumbnails, output_path))
+
+    def pending(self):
+        """未取回结果的校验任务数量"""
+        return len(self._futures)
+
+    def collect(self, timeout=0):
+        """
+        取回已完成的校验结果
+
+        参数:
+            timeout: 等待至少一个任务完成的秒数，0表示不等待，None表示一直等待
+
+        返回:
+            [(标记, 图片路径, 是否有效, 失败原因, 缩略图数据, 转码结果)]
+            转码结果为 (临时文件路径, 扩展名)，没有转码或转码后没有变小时为None
+        """
+        if not self._futures:
+            return []
+        done, _ = wait(list(self._futures), timeout=timeout, return_when=FIRST_COMPLETED)
+        results = []
+        for future in done:
+            tag, file_path = self._futures.pop(future)
+            try:
+                ok, reason, thumb, transcoded = future.result()
+            except Exception as e:
+                # 工作进程异常时不删除图片
+                logger.error(f"图片校验任务失败: {file_path}, 错误: {e}")
+                ok, reason, thumb, transcoded = True, None, None, None
+            if ok:
+                self.verified += 1
+            else:
+                self.broken += 1
+            IMAGES_VERIFIED.inc(result='ok' if ok else 'broken')
+            results.append((tag, file_path, ok, reason, thumb, self._record_transcode(file_path, transcoded)))
+        QUEUE_DEPTH.set(len(self._futures), kind='verify')
+        return results
+
+    def _record_transcode(self, file_path, transcoded):
+        """记录转码统计，转码后没有变小时删除转码结果"""
+        if transcoded is None:
+            return None
+        part_path, extension, original_size, new_size, cpu = transcoded
+        self.transcode_cpu += cpu
+        if new_size >= original_size:
+            os.remove(part_path)
+            self.transcode_skipped += 1
+            logger.info(f"转码后没有变小，保留原图: {file_path} ({original_size/1024:.0f}KB -> {new_size/1024:.0f}KB)")
+            return None
+        self.transcoded += 1
+        self.bytes_before += original_size
+        self.bytes_after += new_size
+        logger.info(f"图片已转码为{self.transcode}: {file_path} ({original_size/1024:.0f}KB -> {new_size/1024:.0f}KB，"
+                    f"CPU {cpu*1000:.0f}ms)")
+        return part_path, extension
+
+    def collect_all(self):
+        """等待并取回所有校验结果"""
+        results = []
+        while self._futures:
+            results.extend(self.collect(timeout=None))
+        return results
+
+    def close(self):
+        """等待索引图任务完成并关闭进程池"""
+        for future in self._sheets:
+            try:
+                future.result()
+                self.sheets += 1
+            except Exception as e:
+                logger.error(f"生成索引图失败: {e}")
+        self._sheets = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def summary(self):
+        """返回统计摘要文本"""
+        text = (f"图片校验: 有效 {self.verified} 张，损坏 {self.broken} 张"
+                + (f"，生成索引图 {self.sheets} 张" if self.contact_sheet else ""))
+        if self.transcode:
+            attempts = self.transcoded + self.transcode_skipped
+            saved = self.bytes_before - self.bytes_after
+            text += (f"；转码为{self.transcode}: {self.transcoded} 张 {self.bytes_before/1024/1024:.2f}MB -> "
+                     f"{self.bytes_after/1024/1024:.2f}MB，节省 {saved/1024/1024:.2f}MB"
+                     f"（{saved / self.bytes_before if self.bytes_before else 0:.1%}），"
+                     f"{self.transcode_skipped} 张转码后没有变小，"
+                     f"平均CPU {self.transcode_cpu / attempts * 1000 if attempts else 0:.0f}ms/张")
+        return text
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import threading
+import zipfile
+from utils.logger import logger
+from utils.atomic_file import atomic_write
+from utils.file_utils import FileUtils
+from utils.file_inventory import FileInventory
+from utils.zip_writer import read_raw_member
+from utils.archive_sink import StreamingArchiveSink
+from utils.archive_verify import rename_checksum_manifest, checksum_manifest_path
+
+# 计算哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_sha256(file_path):
+    """计算文件的SHA-256（十六进制）"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def publish_archive(volume_paths, chain_path, output_path):
+    """
+    将归档链中的文件发布到固定的发布文件名（优先使用硬链接，失败时复制）
+
+    参数:
+        volume_paths: 归档链中生成的文件路径列表
+        chain_path: 生成这些文件时使用的输出路径（xxx.zip）
+        output_path: 发布用的输出路径，分卷、分段和扩展名后缀与归档链中保持一致
+
+    返回:
+        发布后的文件路径列表
+    """
+    chain_stem = os.path.basename(os.path.splitext(chain_path)[0])
+    output_stem = os.path.splitext(output_path)[0]
+    targets = [output_stem + os.path.basename(path)[len(chain_stem):] for path in volume_paths]
+    for source, target in zip(volume_paths, targets):
+        # 先删除旧文件，避免覆盖写入时修改了链接到归档链的同一个文件
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+    if len(targets) > 1:
+        FileUtils.write_volume_info(output_path, targets)
+    rename_checksum_manifest(chain_path, output_path,
+                             {os.path.basename(s): os.path.basename(t) for s, t in zip(volume_paths, targets)})
+    return targets
+
+class ArchiveManifest:
+    """
+    已归档文件清单：记录每个文件的路径、大小、修改时间、哈希以及所在的归档，
+    以及由一个全量归档和若干增量归档组成的归档链。
+    """
+
+    def __init__(self, path):
+        """
+        初始化清单
+
+        参数:
+            path: 清单JSON文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        data = self._load()
+        self.files = data.get('files', {})
+        self.archives = data.get('archives', [])
+        self.next_seq = data.get('next_seq', 1)
+
+    def _load(self):
+        """从文件加载清单"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"加载归档清单失败: {self.path}, 错误: {e}")
+        return {}
+
+    def save(self):
+        """原子地写入清单文件"""
+        with self._lock:
+            data = json.dumps({'files': self.files, 'archives': self.archives, 'next_seq': self.next_seq},
+                              ensure_ascii=False, indent=2)
+        try:
+            atomic_write(self.path, data)
+            return True
+        except Exception as e:
+            logger.error(f"保存归档清单失败: {self.path}, 错误: {e}")
+            return False
+
+    def check(self, arcname, file_path, size, mtime):
+        """
+        判断文件相对清单是否新增或修改
+
+        大小和修改时间都未变时直接认为未修改；修改时间变化但内容相同时只更新修改时间。
+
+        参数:
+            arcname: 压缩包内路径
+            file_path: 文件路径
+            size: 文件大小
+            mtime: 修改时间戳
+
+        返回:
+            新增或修改时返回文件的SHA-256，未修改时返回None
+        """
+        entry = self.files.get(arcname)
+        if entry and entry['size'] == size and entry['mtime'] == mtime:
+            return None
+        digest = file_sha256(file_path)
+        if entry and entry['size'] == size and entry['sha256'] == digest:
+            with self._lock:
+                entry['mtime'] = mtime
+            return None
+        return digest
+
+    def add_archive(self, kind, volume_paths, members):
+        """
+        记录一个新归档及其包含的文件
+
+        参数:
+            kind: 'full' 或 'delta'
+            volume_paths: 归档的ZIP文件路径列表
+            members: (压缩包内路径, 大小, 修改时间, SHA-256) 列表
+
+        返回:
+            归档序号
+        """
+        with self._lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            if kind == 'full':
+                self.archives = []
+            self.archives.append({
+                'seq': seq,
+                'kind': kind,
+                'volumes': list(volume_paths),
+                'files': len(members),
+                'bytes': sum(size for _, size, _, _ in members),
+                'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            })
+            for arcname, size, mtime, digest in members:
+                self.files[arcname] = {'size': size, 'mtime': mtime, 'sha256': digest, 'archive': seq}
+            return seq
+
+class IncrementalPackager:
+    """增量打包：只打包清单中没有的新增或修改文件，并可将增量归档链合并为一个全量归档"""
+
+    def __init__(self, zipper, manifest_path, chain_dir):
+        """
+        初始化增量打包器
+
+        参数:
+            zipper: OptimizedZipper实例
+            manifest_path: 清单文件路径
+            chain_dir: 归档链（全量和增量ZIP）的保存目录
+        """
+        self.zipper = zipper
+        self.manifest = ArchiveManifest(manifest_path)
+        self.chain_dir = chain_dir
+
+    def package(self, source_dir, output_path, inventory=None):
+        """
+        生成增量归档并发布到output_path
+
+        参数:
+            source_dir: 源目录
+            output_path: 发布用的ZIP文件路径
+            inventory: 源目录的FileInventory，None时重新扫描
+
+        返回:
+            (是否成功, 文件数, 原始总大小, 发布的ZIP文件路径列表)
+        """
+        if inventory is None:
+            inventory = FileInventory.scan(source_dir)
+        changed = []
+        members = []
+        for record in inventory:
+            # 大小和修改时间使用扫描时缓存的stat结果
+            try:
+                digest = self.manifest.check(record.arcname, record.path, record.size, record.mtime)
+            except OSError as e:
+                logger.warning(f"无法读取文件: {record.path}, 错误: {e}")
+                continue
+            if digest:
+                changed.append((record.path, record.size))
+                members.append((record.arcname, record.size, record.mtime, digest))
+
+        changed_size = sum(size for _, size in changed)
+        logger.info(f"增量打包: 共 {len(inventory)} 个文件 {inventory.total_size/1024/1024:.2f}MB，"
+                    f"新增或修改 {len(changed)} 个文件 {changed_size/1024/1024:.2f}MB")
+        if not changed:
+            # 只更新了修改时间的文件也需要保存
+            self.manifest.save()
+            logger.info("没有新增或修改的文件，跳过打包")
+            return False, 0, 0, []
+
+        kind = 'delta' if self.manifest.archives else 'full'
+        chain_path = os.path.join(self.chain_dir, f"{kind}_{self.manifest.next_seq:04d}.zip")
+        success, file_count, size, volume_paths = self.zipper.zip_file_list(source_dir, changed, chain_path, inventory)
+        if not success:
+            return False, 0, 0, []
+
+        seq = self.manifest.add_archive(kind, volume_paths, members)
+        self.manifest.save()
+        logger.info(f"归档 {seq} ({kind}) 已加入归档链，当前链长度 {len(self.manifest.archives)}")
+        return True, file_count, size, publish_archive(volume_paths, chain_path, output_path)
+
+    def compact(self, output_path=None, remove_old=True):
+        """
+        将全量归档和之后的增量归档合并为一个新的全量归档，成员的压缩数据直接复制，不重新压缩
+
+        参数:
+            output_path: 发布用的ZIP文件路径，None表示不发布
+            remove_old: 合并后是否删除旧的归档文件
+
+        返回:
+            (是否成功, 文件数, 原始总大小, 发布的ZIP文件路径列表)
+        """
+        chain = list(self.manifest.archives)
+        if len(chain) <= 1:
+            logger.info("归档链中只有一个归档，无需合并")
+            return False, 0, 0, []
+
+        if any(not volume.endswith('.zip') for archive in chain for volume in archive['volumes']):
+            logger.warning("归档链中包含非ZIP格式或分段的归档，无法合并")
+            return False, 0, 0, []
+
+        seq = self.manifest.next_seq
+        full_path = os.path.join(self.chain_dir, f"full_{seq:04d}.zip")
+        sink = StreamingArchiveSink(full_path)
+        members = []
+        try:
+            for archive in chain:
+                for volume in archive['volumes']:
+                    with zipfile.ZipFile(volume) as zf, open(volume, 'rb') as fp:
+                        for info in zf.infolist():
+                            entry = self.manifest.files.get(info.filename)
+                            # 只保留每个文件最新的版本
+                            if not entry or entry['archive'] != archive['seq']:
+                                continue
+                            mtime = time.mktime(info.date_time + (0, 0, -1))
+                            if not sink.add_compressed(info.filename, read_raw_member(fp, info), info.CRC,
+                                                       info.file_size, info.compress_type, mtime,
+                                                       entry['sha256']):
+                                raise IOError(f"写入合并归档失败: {info.filename}")
+                            members.append((info.filename, entry['size'], entry['mtime'], entry['sha256']))
+        except Exception as e:
+            logger.error(f"合并归档链失败: {e}")
+            for path in sink.close():
+                os.remove(path)
+            return False, 0, 0, []
+
+        volume_paths = sink.close()
+        self.manifest.add_archive('full', volume_paths, members)
+        self.manifest.save()
+        logger.info(f"已将 {len(chain)} 个归档合并为全量归档 {seq}: {len(members)} 个文件，{sink.total_size/1024/1024:.2f}MB")
+
+        if remove_old:
+            for archive in chain:
+                chain_path = os.path.join(self.chain_dir, f"{archive['kind']}_{archive['seq']:04d}.zip")
+                for path in archive['volumes'] + [checksum_manifest_path(chain_path)]:
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        published = publish_archive(volume_paths, full_path, output_path) if output_path else []
+        return True, len(members), sink.total_size, published
@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from utils.logger import logger, load_crawled_urls
+
+class LeaseStore:
+    """基于SQLite的本地租约存储，协调多个爬虫进程分片爬取并汇总已爬取状态"""
+
+    def __init__(self, db_path, timeout=30):
+        """
+        初始化租约存储
+
+        参数:
+            db_path: SQLite数据库路径，所有工作进程共享同一个文件
+            timeout: 等待数据库锁的超时时间（秒）
+        """
+        self.db_path = db_path
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+        self._init_schema()
+
+    def _connect(self):
+        """获取当前进程的数据库连接（SQLite连接不能跨进程共享）"""
+        if self._conn is None or self._pid != os.getpid():
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._pid = os.getpid()
+        return self._conn
+
+    def _init_schema(self):
+        """创建数据表"""
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS leases (
+            shard TEXT PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS crawled (
+            kind TEXT NOT NULL,
+            url TEXT NOT NULL,
+            PRIMARY KEY (kind, url)
+        )''')
+
+    def add_shards(self, shards):
+        """
+        添加分片，已存在的分片保持原状态
+
+        参数:
+            shards: 分片键列表
+
+        返回:
+            新增的分片数量
+        """
+        conn = self._connect()
+        before = conn.total_changes
+        conn.executemany('INSERT OR IGNORE INTO leases (shard) VALUES (?)', [(s,) for s in shards])
+        return conn.total_changes - before
+
+    def acquire(self, owner, ttl, prefix=''):
+        """
+        租用一个未完成且未被租用（或租约已过期）的分片
+
+        参数:
+            owner: 租用者标识
+            ttl: 租约有效期（秒）
+            prefix: 只租用以此前缀开头的分片
+
+        返回:
+            分片键，没有可租用的分片时返回None
+        """
+        conn = self._connect()
+        now = time.time()
+        # BEGIN IMMEDIATE 获取写锁，保证查询和更新之间不会被其他进程抢占
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT shard, owner FROM leases WHERE done = 0 AND expires_at < ? AND shard LIKE ? '
+                'ORDER BY shard LIMIT 1', (now, prefix + '%')).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            shard, previous_owner = row
+            conn.execute('UPDATE leases SET owner = ?, expires_at = ? WHERE shard = ?',
+                         (owner, now + ttl, shard))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if previous_owner and previous_owner != owner:
+            logger.warning(f"分片 {shard} 的租约已过期（原租用者 {previous_owner}），由 {owner} 接管")
+        return shard
+
+    def renew(self, shard, owner, ttl):
+        """续租分片，租约已被他人接管时返回False"""
+        cursor = self._connect().execute(
+            'UPDATE leases SET expires_at = ? WHERE shard = ? AND owner = ? AND done = 0',
+            (time.time() + ttl, shard, owner))
+        return cursor.rowcount == 1
+
+    def complete(self, shard, owner):
+        """标记分片已完成"""
+        self._connect().execute('UPDATE leases SET done = 1 WHERE shard = ? AND owner = ?', (shard, owner))
+
+    def release(self, shard, owner):
+        """释放未完成的分片，使其可被立即重新租用"""
+        self._connect().execute(
+            'UPDATE leases SET owner = NULL, expires_at = 0 WHERE shard = ? AND owner = ? AND done = 0',
+            (shard, owner))
+
+    def pending_shards(self, prefix=''):
+        """返回未完成的分片数量"""
+        row = self._connect().execute(
+            'SELECT COUNT(*) FROM leases WHERE done = 0 AND shard LIKE ?', (prefix + '%',)).fetchone()
+        return row[0]
+
+    @contextmanager
+    def locked(self):
+        """在数据库写锁内执行（BEGIN IMMEDIATE），借此串行化多个进程对共享文件的读改写"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def mark_crawled(self, kind, url):
+        """记录已爬取的URL"""
+        self._connect().execute('INSERT OR IGNORE INTO crawled (kind, url) VALUES (?, ?)', (kind, url))
+
+    def crawled_urls(self, kind):
+        """返回已爬取的URL集合"""
+        rows = self._connect().execute('SELECT url FROM crawled WHERE kind = ?', (kind,))
+        return set(row[0] for row in rows)
+
+    def merge_into_log(self, kind, log_file):
+        """
+        将共享存储中的已爬取URL合并到已爬取日志文件
+
+        参数:
+            kind: URL类型，例如 'pic'
+            log_file: 已爬取日志文件路径
+
+        返回:
+            新写入日志的URL数量
+        """
+        # 借用数据库写锁串行化多个进程的合并操作
+        with self.locked():
+            existing = load_crawled_urls(log_file)
+            known = set(existing)
+            new_urls = sorted(self.crawled_urls(kind) - known)
+            if new_urls:
+                with open(log_file, 'a', encoding='utf-8') as f:
+                    for url in new_urls:
+                        f.write(url + '\n')
+        return len(new_urls)
@@ -0,0 +1,388 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from config.settings import Config
+from utils.logger import logger
+from utils.file_utils import FileUtils
+from utils.novel_formatter import format_lines
+
+# zstandard为可选依赖，未安装时正文不压缩
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def thread_id_from_url(post_url):
+    """从帖子URL（如 htm_data/2011/20/4203744.）中提取帖子ID，无法识别时返回URL本身"""
+    match = re.search(r'(\d+)\.?(?:html?)?$', post_url or '')
+    return match.group(1) if match else (post_url or '')
+
+def format_literature(title, author, content):
+    """生成文学作品的txt文本（与按文件保存时的格式一致）"""
+    return f"标题：{title}\n作者：{author}\n\n{content}\n"
+
+class LiteratureStore:
+    """
+    基于SQLite的文学作品库：只追加写入，按批次提交，按需用FTS5建立全文索引。
+
+    代替每个帖子一个小txt文件，打包时只有一个数据库文件；需要txt时用 export 重新生成。
+    正文可以用在本库作品上训练的zstd字典逐篇压缩（dict_id 为空表示未压缩），
+    读取时由 decode（SQL中为 literature_text 函数）透明解压。
+    """
+
+    def __init__(self, db_path, batch_size=Config.LITERATURE_STORE_BATCH, timeout=30,
+                 index_on_write=Config.LITERATURE_INDEX_ON_WRITE, compression=Config.LITERATURE_COMPRESSION,
+                 dict_min_posts=Config.LITERATURE_DICT_MIN_POSTS):
+        """
+        初始化文学作品库
+
+        参数:
+            db_path: SQLite数据库路径
+            batch_size: 每批提交的帖子数量
+            timeout: 等待数据库锁的超时时间（秒）
+            index_on_write: 是否在写入时同步建立全文索引（否则在第一次搜索时建立）
+            compression: 'zstd' 训练字典后按字典压缩正文（需要zstandard）；'none' 不压缩
+            dict_min_posts: 未压缩的作品达到该数量时训练字典
+        """
+        self.db_path = db_path
+        self.batch_size = max(batch_size, 1)
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+        self._pending = []
+        self._lock = threading.Lock()
+        self.index_on_write = index_on_write
+        self.compression = compression
+        self.dict_min_posts = dict_min_posts
+        if compression == 'zstd' and zstandard is None:
+            logger.warning("未安装zstandard，文学作品库正文不压缩")
+            self.compression = 'none'
+        self.fts = False
+        # 字典ID -> 解压器；当前用于压缩的字典
+        self._decompressors = {}
+        self._dict_id = None
+        self._compressor = None
+        self._init_schema()
+
+    def _connect(self):
+        """获取当前进程的数据库连接（SQLite连接不能跨进程共享）"""
+        if self._conn is None or self._pid != os.getpid():
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False)
+            # 使用默认的回滚日志，提交后不留下 -wal 文件，数据库可以直接打包
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.create_function('literature_text', 2, self.decode, deterministic=True)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _init_schema(self):
+        """创建数据表并加载压缩字典；配置为写入时建立索引时同时创建全文索引"""
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY,
+            forum TEXT NOT NULL,
+            thread_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            content TEXT NOT NULL,
+            url TEXT,
+            created REAL NOT NULL,
+            dict_id INTEGER,
+            UNIQUE (forum, thread_id)
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS dictionaries (
+            id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL,
+            created REAL NOT NULL
+        )''')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(posts)')]
+        if 'dict_id' not in columns:
+            conn.execute('ALTER TABLE posts ADD COLUMN dict_id INTEGER')
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'posts_fts'").fetchone()
+        if row and "content='posts'" in row[0]:
+            # 旧版索引直接读取posts.content，正文压缩后无法使用，删除后在下次搜索时重建
+            conn.execute('DROP TRIGGER IF EXISTS posts_fts_insert')
+            conn.execute('DROP TABLE posts_fts')
+            row = None
+        self._load_dictionaries()
+        if row or self.index_on_write:
+            self.build_index()
+
+    def _load_dictionaries(self):
+        """加载所有压缩字典，最新的字典用于压缩新作品"""
+        for dict_id, data in self._connect().execute('SELECT id, data FROM dictionaries ORDER BY id'):
+            if zstandard is None:
+                break
+            dictionary = zstandard.ZstdCompressionDict(data)
+            self._decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+            if self.compression == 'zstd':
+                self._dict_id = dict_id
+                self._compressor = zstandard.ZstdCompressor(level=Config.LITERATURE_ZSTD_LEVEL, dict_data=dictionary)
+
+    def decode(self, content, dict_id):
+        """
+        读取正文（未压缩时原样返回，压缩时用对应的字典解压）
+
+        参数:
+            content: posts.content 列的值
+            dict_id: posts.dict_id 列的值
+
+        返回:
+            正文文本
+        """
+        if dict_id is None:
+            return content
+        decompressor = self._decompressors.get(dict_id)
+        if decompressor is None:
+            raise RuntimeError(f"无法解压作品正文（字典 {dict_id}），需要安装zstandard")
+        return decompressor.decompress(content).decode('utf-8')
+
+    def train_dictionary(self):
+        """
+        用本库未压缩的作品训练zstd字典，并用新字典压缩这些作品
+
+        返回:
+            True（成功）或False（作品太少等原因无法训练）
+        """
+        conn = self._connect()
+        samples = [row[0].encode('utf-8') for row in conn.execute(
+            'SELECT content FROM posts WHERE dict_id IS NULL ORDER BY RANDOM() LIMIT ?',
+            (Config.LITERATURE_DICT_SAMPLES,))]
+        try:
+            start_time = time.time()
+            dictionary = zstandard.train_dictionary(Config.LITERATURE_DICT_SIZE, samples)
+        except zstandard.ZstdError as e:
+            logger.warning(f"训练文学作品压缩字典失败（{len(samples)} 篇样本）: {e}")
+            return False
+        compressor = zstandard.ZstdCompressor(level=Config.LITERATURE_ZSTD_LEVEL, dict_data=dictionary)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            dict_id = conn.execute('INSERT INTO dictionaries (data, created) VALUES (?, ?)',
+                                   (dictionary.as_bytes(), time.time())).lastrowid
+            rows = conn.execute('SELECT id, content FROM posts WHERE dict_id IS NULL').fetchall()
+            raw_size = 0
+            compressed = []
+            for post_id, content in rows:
+                data = content.encode('utf-8')
+                raw_size += len(data)
+                compressed.append((compressor.compress(data), dict_id, post_id))
+            conn.executemany('UPDATE posts SET content = ?, dict_id = ? WHERE id = ?', compressed)
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.error(f"压缩文学作品失败: {self.db_path}, 错误: {e}")
+            return False
+        self._decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+        self._dict_id = dict_id
+        self._compressor = compressor
+        compressed_size = sum(len(data) for data, _, _ in compressed)
+        logger.info(f"文学作品库: 用 {len(samples)} 篇作品训练压缩字典 {len(dictionary.as_bytes())/1024:.0f}KB，"
+                    f"压缩 {len(rows)} 篇作品 {raw_size/1024/1024:.2f}MB -> {compressed_size/1024/1024:.2f}MB，"
+                    f"耗时 {time.time() - start_time:.2f} 秒")
+        return True
+
+    def build_index(self):
+        """
+        创建全文索引并为已有作品建立索引（已存在时直接返回），之后的写入由触发器同步更新索引
+
+        trigram索引的体积约为正文的2倍，写入耗时增加约100倍，所以默认在第一次搜索时才建立。
+
+        返回:
+            True（可以使用全文索引）或False（当前SQLite不支持FTS5）
+        """
+        if self.fts:
+            return True
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'posts_fts'").fetchone():
+            self.fts = True
+            return True
+        # 中文没有分词，使用trigram分词器支持任意子串搜索；旧版SQLite不支持时退回unicode61
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                start_time = time.time()
+                conn.execute('BEGIN IMMEDIATE')
+                # 无内容表（只保存索引），正文可能是压缩的，写入索引前先解压
+                conn.execute(f'''CREATE VIRTUAL TABLE posts_fts USING fts5(
+                    title, author, content, content='', tokenize='{tokenizer}')''')
+                conn.execute('''CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+                    INSERT INTO posts_fts (rowid, title, author, content)
+                    VALUES (new.id, new.title, new.author, literature_text(new.content, new.dict_id));
+                END''')
+                conn.execute('''INSERT INTO posts_fts (rowid, title, author, content)
+                    SELECT id, title, author, literature_text(content, dict_id) FROM posts''')
+                conn.execute('COMMIT')
+                self.fts = True
+                logger.info(f"文学作品库: 已建立全文索引（分词器 {tokenizer}），耗时 {time.time() - start_time:.2f} 秒")
+                return True
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                logger.warning(f"创建全文索引失败（分词器 {tokenizer}）: {e}")
+        logger.warning("当前SQLite不支持FTS5，搜索将使用LIKE逐条匹配")
+        return False
+
+    def add(self, title, author, content, forum_key, post_url=None):
+        """
+        添加一篇作品，达到批次大小时提交
+
+        参数:
+            title: 标题
+            author: 作者
+            content: 内容
+            forum_key: 板块键名
+            post_url: 帖子URL，用于提取帖子ID
+
+        返回:
+            True（成功）或False（失败）
+        """
+        thread_id = thread_id_from_url(post_url) if post_url else title
+        with self._lock:
+            self._pending.append((forum_key, thread_id, title, author, content, post_url, time.time()))
+            if len(self._pending) < self.batch_size:
+                return True
+        return self.flush()
+
+    def flush(self):
+        """
+        提交缓冲中的作品（一个事务批量插入，已存在的帖子忽略）
+
+        返回:
+            True（成功）或False（失败）
+        """
+        with self._lock:
+            if not self._pending:
+                return True
+            rows, self._pending = self._pending, []
+            conn = self._connect()
+            if self._compressor:
+                values = [row[:4] + (self._compressor.compress(row[4].encode('utf-8')),) + row[5:] + (self._dict_id,)
+                          for row in rows]
+            else:
+                values = [row + (None,) for row in rows]
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany('''INSERT OR IGNORE INTO posts
+                    (forum, thread_id, title, author, content, url, created, dict_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', values)
+                conn.execute('COMMIT')
+                logger.info(f"文学作品库: 提交 {len(rows)} 篇作品到 {self.db_path}")
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                # 放回缓冲，下次提交时重试
+                self._pending = rows + self._pending
+                logger.error(f"写入文学作品库失败: {self.db_path}, 错误: {e}")
+                return False
+            if self.compression == 'zstd' and self._compressor is None and \
+                    conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0] >= self.dict_min_posts:
+                self.train_dictionary()
+            return True
+
+    def pending(self):
+        """缓冲中尚未提交的作品数量"""
+        with self._lock:
+            return len(self._pending)
+
+    def close(self):
+        """提交剩余作品并关闭数据库"""
+        self.flush()
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def count(self, forum_key=None):
+        """作品数量"""
+        conn = self._connect()
+        if forum_key:
+            return conn.execute('SELECT COUNT(*) FROM posts WHERE forum = ?', (forum_key,)).fetchone()[0]
+        return conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+
+    def search(self, query, forum_key=None, limit=None):
+        """
+        全文搜索标题、作者和内容
+
+        参数:
+            query: 搜索词（任意子串，至少3个字符时使用全文索引）
+            forum_key: 只搜索该板块，None表示全部
+            limit: 最多返回的数量，None表示不限制
+
+        返回:
+            (帖子ID, 板块, 标题, 作者, 内容) 列表
+        """
+        conn = self._connect()
+        params = []
+        if len(query) >= 3 and self.build_index():
+            sql = ('SELECT p.thread_id, p.forum, p.title, p.author, literature_text(p.content, p.dict_id) '
+                   'FROM posts_fts f JOIN posts p ON p.id = f.rowid WHERE posts_fts MATCH ?')
+            # 作为短语搜索，避免搜索词中的符号被当作FTS5语法
+            params.append('"' + query.replace('"', '""') + '"')
+        else:
+            sql = ('SELECT thread_id, forum, title, author, literature_text(content, dict_id) FROM posts p '
+                   'WHERE (title LIKE ? OR author LIKE ? OR literature_text(content, dict_id) LIKE ?)')
+            params.extend([f"%{query}%"] * 3)
+        if forum_key:
+            sql += ' AND p.forum = ?'
+            params.append(forum_key)
+        sql += ' ORDER BY p.id'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return conn.execute(sql, params).fetchall()
+
+    def get(self, forum_key, thread_id):
+        """
+        按帖子ID读取一篇作品（只解压这一篇）
+
+        返回:
+            (标题, 作者, 内容)，不存在时返回None
+        """
+        return self._connect().execute(
+            'SELECT title, author, literature_text(content, dict_id) FROM posts WHERE forum = ? AND thread_id = ?',
+            (forum_key, thread_id)).fetchone()
+
+    def iter_posts(self, forum_key=None, query=None):
+        """按写入顺序遍历作品，产生 (帖子ID, 板块, 标题, 作者, 内容)"""
+        if query:
+            yield from self.search(query, forum_key)
+            return
+        conn = self._connect()
+        sql = 'SELECT thread_id, forum, title, author, literature_text(content, dict_id) FROM posts'
+        params = ()
+        if forum_key:
+            sql += ' WHERE forum = ?'
+            params = (forum_key,)
+        yield from conn.execute(sql + ' ORDER BY id', params)
+
+    def export(self, output_dir, forum_key=None, query=None, formatted=False):
+        """
+        导出为每篇作品一个txt文件的目录结构（与按文件保存时相同）
+
+        参数:
+            output_dir: 输出目录，文件保存在 output_dir/板块名称/标题.txt
+            forum_key: 只导出该板块，None表示全部
+            query: 只导出搜索结果
+            formatted: 是否按小说格式化规则（章节标题、对话、段落缩进）输出
+
+        返回:
+            导出的文件数量
+        """
+        count = 0
+        for _, forum, title, author, content in self.iter_posts(forum_key, query):
+            forum_dir = os.path.join(output_dir, Config.get_forum_name(forum))
+            os.makedirs(forum_dir, exist_ok=True)
+            file_name = os.path.join(forum_dir, f"{FileUtils.clean_filename(title)}.txt")
+            text = format_literature(title, author, content)
+            with open(file_name, 'w', encoding='utf-8') as f:
+                if formatted:
+                    f.writelines(format_lines(text.splitlines()))
+                else:
+                    f.write(text)
+            count += 1
+        logger.info(f"已从 {self.db_path} 导出 {count} 篇作品到 {output_dir}")
+        return count
@@ -1,47 +1,259 @@
+import atexit
+import copy
+import json
 import os
 import logging
+import queue
+import sys
+import threading
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from config.settings import Config
 
+class TextFormatter(logging.Formatter):
+    """控制台文本格式，限速省略过日志时在消息后注明省略的条数"""
+    
+    def __init__(self, worker_id=None):
+        name = f'%(name)s[{worker_id}]' if worker_id else '%(name)s'
+        super().__init__(f'%(asctime)s - {name} - %(levelname)s - %(message)s')
+    
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f"{text}（此前省略同一位置的 {suppressed} 条日志）" if suppressed else text
+
+class ConsoleHandler(logging.StreamHandler):
+    """写到当前的 sys.stderr（sys.stderr 被替换后仍然写到新的对象，退出时不会写到已关闭的流）"""
+    
+    @property
+    def stream(self):
+        return sys.stderr
+    
+    @stream.setter
+    def stream(self, value):
+        pass
+
+class JsonFormatter(logging.Formatter):
+    """日志文件格式：每条日志一行JSON，包含时间、级别、模块、行号、线程和消息，异常时附带堆栈"""
+    
+    def __init__(self, worker_id=None):
+        super().__init__()
+        self.worker_id = worker_id
+    
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'process': record.process,
+            'message': record.getMessage(),
+        }
+        if self.worker_id:
+            entry['worker'] = self.worker_id
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False)
+
+def parse_level(level):
+    """
+    把级别名（如 'warning'）或数值转换为日志级别数值
+    
+    异常:
+        ValueError: 级别名无效
+    """
+    if isinstance(level, int):
+        return level
+    # 已注册的级别名返回数值，未知的名称返回 "Level xxx" 字符串
+    value = logging.getLevelName(str(level).strip().upper())
+    if not isinstance(value, int):
+        raise ValueError(f"无效的日志级别: {level}")
+    return value
+
+class ModuleLevelFilter(logging.Filter):
+    """按来源模块（文件名，如 request_utils）设置最低级别，未设置的模块使用日志记录器的级别"""
+    
+    def __init__(self, levels=None):
+        super().__init__()
+        self.set_levels(levels or {})
+    
+    def set_levels(self, levels):
+        """
+        设置各模块的最低级别
+        
+        参数:
+            levels: {模块名: 级别名或数值}
+        
+        异常:
+            ValueError: 级别名无效
+        """
+        self.levels = {module: parse_level(level) for module, level in levels.items()}
+    
+    def filter(self, record):
+        level = self.levels.get(record.module)
+        return level is None or record.levelno >= level
+
+class RateLimitFilter(logging.Filter):
+    """
+    按调用位置（文件和行号）对INFO及以下的日志限速（令牌桶），警告和错误不受影响。
+    
+    每个请求、每张图片一条的日志在高并发时会刷屏，限速后只保留一部分，
+    被省略的条数记录在同一位置下一条放行的日志中。
+    """
+    
+    def __init__(self, rate=Config.LOG_RATE_LIMIT, burst=Config.LOG_RATE_BURST):
+        """
+        参数:
+            rate: 每个调用位置每秒补充的条数，0表示不限速
+            burst: 每个调用位置最多可以连续输出的条数
+        """
+        super().__init__()
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.suppressed = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def filter(self, record):
+        if not self.rate or record.levelno > logging.INFO:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            tokens, last, dropped = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, dropped + 1)
+                self.suppressed += 1
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+class _QueueHandler(QueueHandler):
+    """放入队列前只合并消息参数和格式化异常堆栈，其余格式化由写日志的线程完成"""
+    
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
 class Logger:
-    """日志记录工具类"""
+    """
+    日志记录工具类
+    
+    调用线程只把日志放入队列（不等待I/O），后台线程写到控制台（文本）和日志文件（JSON行）。
+    进程fork后在子进程中重新启动后台线程。
+    """
     
-    def __init__(self, log_file=None, log_name='caoliu_scraper'):
+    def __init__(self, log_file=None, log_name='caoliu_scraper', level=Config.LOG_LEVEL,
+                 module_levels=Config.LOG_MODULE_LEVELS):
         """
         初始化日志记录器
         
         参数:
             log_file: 日志文件路径，如果为None则只输出到控制台
             log_name: 日志记录器名称
+            level: 日志级别
+            module_levels: 按模块设置的级别，如 {'request_utils': 'WARNING'}
         """
         # 创建日志记录器
         self.logger = logging.getLogger(log_name)
-        self.logger.setLevel(logging.INFO)
+        existing = next((h for h in self.logger.handlers if isinstance(h, _QueueHandler)), None)
+        if existing is not None:
+            # 同名日志记录器已由其他实例配置：共用它的队列、过滤器和后台线程（参数以第一次创建时为准）
+            self.__dict__ = existing.owner.__dict__
+            return
+        self.logger.setLevel(level)
+        self.log_file = log_file
+        self.worker_id = None
+        self.module_filter = ModuleLevelFilter(module_levels)
+        self.rate_filter = RateLimitFilter()
+        self.listener = None
+        self._lock = threading.Lock()
         
-        # 避免重复添加处理器
-        if not self.logger.handlers:
-            # 创建格式化器
-            formatter = logging.Formatter(
-                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-            )
-            
-            # 创建控制台处理器
-            console_handler = logging.StreamHandler()
-            console_handler.setLevel(logging.INFO)
-            console_handler.setFormatter(formatter)
-            self.logger.addHandler(console_handler)
-            
-            # 如果指定了日志文件，创建文件处理器
-            if log_file:
-                # 确保日志目录存在
-                log_dir = os.path.dirname(log_file)
-                if log_dir and not os.path.exists(log_dir):
-                    os.makedirs(log_dir, exist_ok=True)
-                
-                file_handler = logging.FileHandler(log_file, encoding='utf-8')
-                file_handler.setLevel(logging.INFO)
-                file_handler.setFormatter(formatter)
-                self.logger.addHandler(file_handler)
+        self.queue_handler = _QueueHandler(queue.SimpleQueue())
+        self.queue_handler.owner = self
+        self.queue_handler.addFilter(self.module_filter)
+        self.queue_handler.addFilter(self.rate_filter)
+        self.logger.addHandler(self.queue_handler)
+        self.start()
+        atexit.register(self.stop)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._restart_in_child)
+    
+    def _build_handlers(self):
+        """创建后台线程使用的控制台和文件处理器"""
+        console_handler = ConsoleHandler()
+        console_handler.setFormatter(TextFormatter(self.worker_id))
+        handlers = [console_handler]
+        if self.log_file:
+            # 确保日志目录存在
+            log_dir = os.path.dirname(self.log_file)
+            if log_dir and not os.path.exists(log_dir):
+                os.makedirs(log_dir, exist_ok=True)
+            # 第一次写日志时才创建文件，只导入模块（如运行测试）不会产生空日志文件
+            file_handler = logging.FileHandler(self.log_file, encoding='utf-8', delay=True)
+            file_handler.setFormatter(JsonFormatter(self.worker_id))
+            handlers.append(file_handler)
+        return handlers
+    
+    def start(self):
+        """启动写日志的后台线程"""
+        with self._lock:
+            if self.listener is None:
+                self.listener = QueueListener(self.queue_handler.queue, *self._build_handlers())
+                self.listener.start()
+    
+    def stop(self):
+        """写出队列中剩余的日志，停止后台线程并关闭文件"""
+        with self._lock:
+            listener, self.listener = self.listener, None
+        if listener is None:
+            return
+        if self.rate_filter.suppressed:
+            self.logger.info(f"本次运行限速省略了 {self.rate_filter.suppressed} 条日志")
+            self.rate_filter.suppressed = 0
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    
+    def _restart_in_child(self):
+        """fork出的子进程中没有后台线程：换一个新队列（不重复写父进程未写出的日志）并重新启动"""
+        if self.listener is None:
+            return
+        self._lock = threading.Lock()
+        self.rate_filter._lock = threading.Lock()
+        self.rate_filter.suppressed = 0
+        self.listener = None
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.start()
+    
+    def set_log_file(self, log_file, worker_id=None):
+        """
+        切换日志文件，队列中已有的日志先写到原文件
+        
+        参数:
+            log_file: 新的日志文件路径
+            worker_id: 工作进程标识，写入每条日志
+        """
+        self.stop()
+        self.log_file = log_file
+        self.worker_id = worker_id
+        self.start()
     
     def info(self, message):
         """记录信息日志"""
@@ -66,8 +278,43 @@ def get_logger(log_file=None, log_name='caoliu_scraper'):
 
 # 创建默认日志记录器
 # 使用配置中的日志目录和当前日期作为日志文件名
-default_log_file = os.path.join(Config.LOG_DIR, f"scraper_{datetime.now().strftime('%Y%m%d')}.log")
-logger = get_logger(log_file=default_log_file)
+default_log_file = os.path.join(Config.LOG_DIR, f"scraper_{datetime.now().strftime('%Y%m%d')}.jsonl")
+default_logger = Logger(default_log_file)
+logger = default_logger.logger
+
+def set_module_levels(spec):
+    """
+    按模块设置默认日志记录器的级别
+    
+    参数:
+        spec: 字典，或 "模块=级别" 以逗号分隔的字符串，如 "request_utils=WARNING,file_utils=WARNING"
+    
+    异常:
+        ValueError: 格式或级别名无效
+    """
+    if isinstance(spec, str):
+        levels = {}
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            module, sep, level = item.partition('=')
+            if not sep or not module.strip():
+                raise ValueError(f"无效的模块日志级别: {item}")
+            levels[module.strip()] = level.strip()
+        spec = levels
+    default_logger.module_filter.set_levels(spec)
+
+def use_worker_log_file(worker_id):
+    """
+    将默认日志记录器的文件输出切换到工作进程专属的日志文件，避免多个进程写同一个文件
+    
+    参数:
+        worker_id: 工作进程标识
+    
+    返回:
+        新的日志文件路径
+    """
+    log_file = os.path.join(Config.LOG_DIR, f"scraper_{datetime.now().strftime('%Y%m%d')}.{worker_id}.jsonl")
+    default_logger.set_log_file(log_file, worker_id)
+    return log_file
 
 # 已爬取URL记录相关函数
 def load_crawled_urls(log_file):
@@ -0,0 +1,313 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from config.settings import Config
+from utils.logger import logger
+from utils.atomic_file import atomic_write
+
+# 耗时直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class _Metric:
+    """指标基类：按标签值保存各个时间序列"""
+
+    type = None
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = registry._lock
+        self._values = {}
+
+    def _key(self, labels):
+        """标签字典转换为按 labelnames 排列的元组"""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """返回 [(标签元组, 值)] 的快照"""
+        with self._lock:
+            return sorted(self._values.items())
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Gauge(_Metric):
+    """可增可减的当前值（如队列深度），同时记录运行期间的最大值"""
+
+    type = 'gauge'
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        super().__init__(registry, name, help_text, labelnames)
+        self._max = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+            if key not in self._max or value > self._max[key]:
+                self._max[key] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def max_value(self, **labels):
+        with self._lock:
+            return self._max.get(self._key(labels), 0)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._max.clear()
+
+class Histogram(_Metric):
+    """分桶直方图（如请求耗时），保存各桶计数、总数和总和"""
+
+    type = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'count': 0, 'sum': 0.0}
+            entry['counts'][index] += 1
+            entry['count'] += 1
+            entry['sum'] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """记录代码块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            return sorted((key, {'counts': list(entry['counts']), 'count': entry['count'], 'sum': entry['sum']})
+                          for key, entry in self._values.items())
+
+    def quantile(self, entry, q):
+        """按分桶估算分位数（取所在桶的上界，落在最后一个桶时返回最大分桶边界）"""
+        if not entry['count']:
+            return 0.0
+        target = q * entry['count']
+        cumulative = 0
+        for bound, count in zip(self.buckets, entry['counts']):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    """
+    指标注册表：各模块在导入时注册计数器、仪表和直方图，运行结束时统一输出。
+
+    输出为 Prometheus 文本格式（供 node_exporter 的 textfile 收集器读取）和 JSON 运行报告
+    （每次运行一个文件，便于比较多次定时运行的性能）。多个进程各自有独立的注册表。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._ratios = {}
+        self.start_time = time.time()
+
+    def _register(self, cls, name, help_text, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(self, name, help_text, labelnames, **kwargs)
+        if not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+            raise ValueError(f"指标 {name} 已按不同的类型或标签注册")
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        """注册（或获取已注册的）计数器"""
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        """注册（或获取已注册的）仪表"""
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        """注册（或获取已注册的）直方图"""
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def ratio(self, name, numerator, denominator):
+        """
+        注册派生比值（如下载字节数除以下载耗时得到吞吐量），按相同标签计算后写入JSON报告
+
+        参数:
+            name: 比值名称
+            numerator: 分子计数器名称
+            denominator: 分母计数器名称
+        """
+        with self._lock:
+            self._ratios[name] = (numerator, denominator)
+
+    def get(self, name):
+        """按名称获取已注册的指标，不存在时返回None"""
+        with self._lock:
+            return self._metrics.get(name)
+
+    def reset(self):
+        """清空所有指标的值（注册信息保留），重新开始计时"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+        self.start_time = time.time()
+
+    def _sorted_metrics(self):
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def render_prometheus(self):
+        """返回 Prometheus 文本格式的全部指标"""
+        lines = []
+        for metric in self._sorted_metrics():
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for key, value in samples:
+                labels = list(zip(metric.labelnames, key))
+                if metric.type == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float('inf'),), value['counts']):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(float(bound))
+                        lines.append(f"{metric.name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_format_labels(labels)} {value['sum']!r}")
+                    lines.append(f"{metric.name}_count{_format_labels(labels)} {value['count']}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(labels)} {float(value)!r}")
+        return '\n'.join(lines) + '\n'
+
+    def report(self, extra=None):
+        """
+        生成JSON运行报告
+
+        参数:
+            extra: 附加到报告中的运行信息（如模式、板块）
+
+        返回:
+            报告字典：每个指标按标签列出，直方图附带平均值和估算的p50/p95
+        """
+        end_time = time.time()
+        report = {
+            'start_time': datetime.fromtimestamp(self.start_time).isoformat(timespec='seconds'),
+            'end_time': datetime.fromtimestamp(end_time).isoformat(timespec='seconds'),
+            'duration_seconds': round(end_time - self.start_time, 3),
+            'pid': os.getpid(),
+            'run': extra or {},
+            'metrics': {},
+        }
+        for metric in self._sorted_metrics():
+            series = []
+            for key, value in metric.samples():
+                entry = {'labels': dict(zip(metric.labelnames, key))}
+                if metric.type == 'histogram':
+                    entry.update(count=value['count'], sum=round(value['sum'], 6),
+                                 mean=round(value['sum'] / value['count'], 6) if value['count'] else 0.0,
+                                 p50=metric.quantile(value, 0.5), p95=metric.quantile(value, 0.95))
+                elif metric.type == 'gauge':
+                    entry.update(value=value, max=metric.max_value(**entry['labels']))
+                else:
+                    entry['value'] = value
+                series.append(entry)
+            if series:
+                report['metrics'][metric.name] = {'type': metric.type, 'help': metric.help, 'series': series}
+        report['derived'] = self._derived()
+        return report
+
+    def _derived(self):
+        """计算已注册的派生比值：{名称: [{'labels': 标签, 'value': 比值}]}"""
+        with self._lock:
+            ratios = sorted(self._ratios.items())
+        derived = {}
+        for name, (numerator, denominator) in ratios:
+            num_metric, den_metric = self.get(numerator), self.get(denominator)
+            if num_metric is None or den_metric is None:
+                continue
+            den_values = dict(den_metric.samples())
+            series = [{'labels': dict(zip(num_metric.labelnames, key)), 'value': round(value / den_values[key], 3)}
+                      for key, value in num_metric.samples() if den_values.get(key)]
+            if series:
+                derived[name] = series
+        return derived
+
+    def write(self, textfile=Config.METRICS_TEXTFILE, report_dir=Config.METRICS_REPORT_DIR, extra=None,
+              suffix=''):
+        """
+        原子地写入 Prometheus 文本文件和本次运行的JSON报告
+
+        参数:
+            textfile: Prometheus文本文件路径（每次运行覆盖），None表示不写
+            report_dir: JSON报告目录（每次运行一个文件），None表示不写
+            extra: 附加到JSON报告中的运行信息
+            suffix: 文件名后缀（如分片工作进程的标识），避免多个进程互相覆盖
+
+        返回:
+            JSON报告路径，未写入时返回None
+        """
+        report_path = None
+        try:
+            if textfile:
+                if suffix:
+                    root, ext = os.path.splitext(textfile)
+                    textfile = f"{root}_{suffix}{ext}"
+                atomic_write(textfile, self.render_prometheus())
+            if report_dir:
+                name = f"run_{datetime.fromtimestamp(self.start_time).strftime('%Y%m%d_%H%M%S')}"
+                report_path = os.path.join(report_dir, f"{name}_{suffix}.json" if suffix else f"{name}.json")
+                atomic_write(report_path, json.dumps(self.report(extra), ensure_ascii=False, indent=1))
+                logger.info(f"运行指标已写入: {report_path}")
+        except Exception as e:
+            logger.error(f"写入运行指标失败: {e}")
+            return None
+        return report_path
+
+def _escape_label(value):
+    """转义Prometheus标签值中的反斜杠、双引号和换行"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    """Prometheus标签格式: {a="1",b="2"}，没有标签时为空"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in labels) + '}'
+
+# 创建全局指标注册表
+metrics = MetricsRegistry()
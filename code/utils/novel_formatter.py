@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from config.settings import Config
+from utils.logger import logger
+from utils.atomic_file import atomic_open, atomic_write
+from utils.file_inventory import FileInventory
+from utils.incremental_archive import file_sha256
+
+def format_lines(lines):
+    """
+    逐行格式化小说文本，处理章节标题、对话和段落（生成器，内存占用与文件大小无关）
+
+    参数:
+        lines: 文本行的可迭代对象
+
+    返回:
+        格式化后文本片段的生成器
+    """
+    in_dialogue = False
+    for line in lines:
+        stripped_line = line.strip()
+
+        if stripped_line.startswith('##'):
+            # 章节标题
+            yield '\n' + stripped_line + '\n'
+            in_dialogue = False
+        elif stripped_line.startswith('"') and stripped_line.endswith('"'):
+            # 对话行
+            if not in_dialogue:
+                yield '\n'
+            yield stripped_line
+            in_dialogue = True
+        elif stripped_line:
+            # 普通段落
+            if in_dialogue:
+                yield '\n'
+            yield '    ' + stripped_line
+            in_dialogue = False
+        else:
+            # 空行
+            yield '\n'
+
+class _HashingLines:
+    """按行读取二进制文件并解码，同时计算原始字节的SHA-256"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.digest = hashlib.sha256()
+
+    def __iter__(self):
+        for raw in self.fp:
+            self.digest.update(raw)
+            yield raw.decode('utf-8')
+
+def format_file(input_file_path, output_file_path):
+    """
+    流式格式化一个小说文件（可在工作进程中执行），先写入临时文件再替换
+
+    参数:
+        input_file_path: 输入文件路径
+        output_file_path: 输出文件路径
+
+    返回:
+        输入文件的SHA-256
+    """
+    with open(input_file_path, 'rb') as src, atomic_open(output_file_path) as dst:
+        lines = _HashingLines(src)
+        dst.writelines(format_lines(lines))
+    return lines.digest.hexdigest()
+
+class NovelFormatter:
+    """
+    批量小说格式化：在进程池中格式化整个文学目录，输出到镜像的目录结构。
+
+    缓存记录每个源文件的大小、修改时间和SHA-256，未变化的文件在下次运行时跳过；
+    也可以作为 LiteratureCrawler 的保存后回调，作品保存后立即提交到进程池。
+    """
+
+    def __init__(self, source_root=Config.LITERATURE_DIR, output_root=Config.FORMATTED_DIR,
+                 cache_file=Config.FORMAT_CACHE_FILE, workers=Config.FORMAT_WORKERS):
+        """
+        初始化格式化器
+
+        参数:
+            source_root: 源目录，输出路径按相对该目录的路径计算
+            output_root: 输出目录
+            cache_file: 跳过缓存文件路径
+            workers: 格式化进程数，1表示在当前进程中执行
+        """
+        self.source_root = source_root
+        self.output_root = output_root
+        self.cache_file = cache_file
+        self.workers = max(workers, 1)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = {}
+        self.cache = self._load_cache()
+        self.formatted = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def _load_cache(self):
+        """加载跳过缓存"""
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"加载格式化缓存失败: {self.cache_file}, 错误: {e}")
+        return {}
+
+    def save_cache(self):
+        """原子地写入跳过缓存"""
+        with self._lock:
+            data = json.dumps(self.cache, ensure_ascii=False, indent=1)
+        try:
+            atomic_write(self.cache_file, data)
+            return True
+        except Exception as e:
+            logger.error(f"保存格式化缓存失败: {self.cache_file}, 错误: {e}")
+            return False
+
+    def output_path(self, file_path):
+        """源文件对应的输出路径"""
+        return os.path.join(self.output_root, os.path.relpath(file_path, self.source_root))
+
+    def needs_format(self, file_path, st=None):
+        """
+        判断文件是否需要格式化
+
+        大小和修改时间都未变时直接跳过；修改时间变化但内容相同时只更新缓存中的修改时间。
+
+        参数:
+            file_path: 源文件路径
+            st: 已有的stat结果，None时重新获取
+
+        返回:
+            是否需要格式化
+        """
+        st = st or os.stat(file_path)
+        key = os.path.relpath(file_path, self.source_root)
+        entry = self.cache.get(key)
+        if not entry or entry['size'] != st.st_size or not os.path.exists(self.output_path(file_path)):
+            return True
+        if entry['mtime'] == st.st_mtime_ns:
+            return False
+        if entry['sha256'] != file_sha256(file_path):
+            return True
+        with self._lock:
+            entry['mtime'] = st.st_mtime_ns
+        return False
+
+    def _record(self, file_path, st, sha256):
+        """记录格式化完成的文件"""
+        with self._lock:
+            self.cache[os.path.relpath(file_path, self.source_root)] = {
+                'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': sha256}
+            self.formatted += 1
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def submit(self, file_path, st=None):
+        """
+        提交一个文件（作为保存后回调使用），未变化的文件直接跳过
+
+        参数:
+            file_path: 源文件路径
+            st: 已有的stat结果，None时重新获取
+
+        返回:
+            是否提交了格式化任务
+        """
+        try:
+            st = st or os.stat(file_path)
+            if not self.needs_format(file_path, st):
+                self.skipped += 1
+                return False
+            if self.workers == 1:
+                self._record(file_path, st, format_file(file_path, self.output_path(file_path)))
+                return True
+            future = self._get_pool().submit(format_file, file_path, self.output_path(file_path))
+            with self._lock:
+                self._pending[future] = (file_path, st)
+            future.add_done_callback(self._on_done)
+            return True
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"小说格式化失败: {file_path}, 错误: {e}")
+            return False
+
+    def _on_done(self, future):
+        """进程池任务完成后记录结果"""
+        with self._lock:
+            file_path, st = self._pending.pop(future)
+        try:
+            self._record(file_path, st, future.result())
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"小说格式化失败: {file_path}, 错误: {e}")
+
+    def format_tree(self, root=None):
+        """
+        格式化目录下所有txt文件
+
+        参数:
+            root: 要格式化的目录，None表示整个源目录
+
+        返回:
+            (格式化数量, 跳过数量, 失败数量)
+        """
+        start_time = time.time()
+        inventory = FileInventory.scan(root or self.source_root)
+        for record in inventory:
+            if record.path.endswith('.txt'):
+                self.submit(record.path, record.stat)
+        self.close()
+        logger.info(f"小说格式化完成: 格式化 {self.formatted} 个，跳过 {self.skipped} 个，失败 {self.failed} 个，"
+                    f"耗时 {time.time() - start_time:.2f} 秒")
+        return self.formatted, self.skipped, self.failed
+
+    def close(self):
+        """等待进行中的任务完成并保存缓存"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        self.save_cache()
@@ -2,9 +2,35 @@ import os
 import requests
 from fake_useragent import UserAgent
 from config.settings import Config
+from urllib.parse import urlsplit
 from utils.logger import logger
+from utils.shutdown import shutdown
+from utils.metrics import metrics
+from utils.tracing import traced
 import time
 
+REQUEST_SECONDS = metrics.histogram('crawler_request_seconds', '请求耗时（到收到响应头为止，每次尝试记录一次）', ['host'])
+REQUESTS_TOTAL = metrics.counter('crawler_requests_total', '请求次数（每次尝试记录一次）', ['host', 'outcome'])
+REQUEST_RETRIES = metrics.counter('crawler_request_retries_total', '请求重试次数', ['host'])
+DOWNLOAD_BYTES = metrics.counter('crawler_download_bytes_total', '下载的正文字节数', ['host'])
+DOWNLOAD_SECONDS = metrics.counter('crawler_download_seconds_total', '读取响应正文的耗时', ['host'])
+metrics.ratio('crawler_download_bytes_per_second', 'crawler_download_bytes_total', 'crawler_download_seconds_total')
+
+class ContentTooLarge(Exception):
+    """下载的文件超过允许的字节数（Content-Length超出时不读取正文，缺少时读取到超出为止）"""
+    
+    def __init__(self, url, size, limit):
+        """
+        参数:
+            url: 文件URL
+            size: Content-Length，或中止下载前已读取的字节数
+            limit: 允许的字节数
+        """
+        super().__init__(f"文件超过 {limit/1024/1024:.2f}MB: {url}（{size/1024/1024:.2f}MB）")
+        self.url = url
+        self.size = size
+        self.limit = limit
+
 class RequestUtils:
     """网络请求工具类"""
     
@@ -16,6 +42,8 @@ class RequestUtils:
         self.headers = Config.HEADERS.copy()
         # 添加随机User-Agent
         self.headers['User-Agent'] = self.ua.random
+        # 累计下载的字节数
+        self.downloaded_bytes = 0
     
     def get(self, url, headers=None, timeout=30, retry=Config.MAX_RETRY, delay=Config.DOWNLOAD_DELAY, **kwargs):
         """
@@ -30,7 +58,7 @@ class RequestUtils:
             **kwargs: 传递给requests.get的其他参数
         
         返回:
-            response对象或None（如果请求失败）
+            response对象或None（如果请求失败，或收到退出请求后放弃）
         """
         # 合并请求头
         request_headers = self.headers.copy()
@@ -41,15 +69,32 @@ class RequestUtils:
         time.sleep(delay)
         
         # 发送请求，支持重试
+        host = urlsplit(url).hostname or ''
         for attempt in range(retry + 1):
+            # 收到退出请求后不再重试，宽限期用完后不再发出请求
+            if shutdown.grace_expired() or (attempt and shutdown.requested()):
+                logger.warning(f"收到退出请求，放弃请求: {url}")
+                return None
+            if attempt:
+                REQUEST_RETRIES.inc(host=host)
+            # 宽限期内发出的请求最多等待到宽限期结束
+            attempt_timeout = min(timeout, shutdown.grace_remaining()) if shutdown.requested() else timeout
+            request_start = time.perf_counter()
             try:
                 logger.info(f"请求URL: {url} (尝试 {attempt + 1}/{retry + 1})")
-                response = requests.get(url, headers=request_headers, timeout=timeout, **kwargs)
+                response = requests.get(url, headers=request_headers, timeout=attempt_timeout, **kwargs)
                 response.raise_for_status()  # 抛出HTTP错误
+                REQUEST_SECONDS.observe(time.perf_counter() - request_start, host=host)
+                REQUESTS_TOTAL.inc(host=host, outcome='ok')
                 logger.info(f"请求成功: {url}")
                 return response
             except requests.exceptions.RequestException as e:
+                REQUEST_SECONDS.observe(time.perf_counter() - request_start, host=host)
+                REQUESTS_TOTAL.inc(host=host, outcome='error')
                 error_msg = f"请求失败: {url}, 错误: {str(e)}"
+                if shutdown.requested():
+                    logger.warning(f"{error_msg}, 收到退出请求，不再重试")
+                    return None
                 if attempt < retry:
                     logger.warning(f"{error_msg}, {delay}秒后重试...")
                     time.sleep(delay)
@@ -88,20 +133,103 @@ class RequestUtils:
                 logger.error(f"解析文本失败: {url}, 错误: {e}")
         return None
     
-    def download_file(self, url, save_path, **kwargs):
+    @staticmethod
+    def _check_length(response, url, max_bytes):
+        """
+        读取正文前按Content-Length检查文件大小（流式请求此时只收到了响应头，不需要额外的HEAD请求）
+        
+        异常:
+            ContentTooLarge: Content-Length超过max_bytes
+        """
+        if not max_bytes:
+            return
+        try:
+            length = int(response.headers.get('Content-Length', ''))
+        except ValueError:
+            return
+        if length > max_bytes:
+            response.close()
+            raise ContentTooLarge(url, length, max_bytes)
+    
+    def _iter_chunks(self, response, url, max_bytes):
+        """逐块读取响应正文，累计下载字节数，超过max_bytes时中止（服务器未返回或谎报Content-Length）"""
+        received = 0
+        read_start = time.perf_counter()
+        try:
+            for chunk in response.iter_content(chunk_size=8192):
+                if shutdown.grace_expired():
+                    raise RuntimeError("退出宽限期已过，中止下载")
+                if chunk:
+                    received += len(chunk)
+                    self.downloaded_bytes += len(chunk)
+                    if max_bytes and received > max_bytes:
+                        response.close()
+                        raise ContentTooLarge(url, received, max_bytes)
+                    yield chunk
+        finally:
+            # 每个文件只更新一次指标，不在逐块循环中加锁
+            host = urlsplit(url).hostname or ''
+            DOWNLOAD_BYTES.inc(received, host=host)
+            DOWNLOAD_SECONDS.inc(time.perf_counter() - read_start, host=host)
+    
+    @traced('fetch_content', ('url',), falsy_is_error=True)
+    def fetch_content(self, url, max_bytes=None, info=None, **kwargs):
+        """
+        下载文件内容到内存（用于直接写入归档）
+        
+        参数:
+            url: 文件URL
+            max_bytes: 允许的最大字节数，None表示不限制
+            info: 字典，设置后写入响应的Content-Type（'content_type'）
+            **kwargs: 传递给get方法的其他参数
+        
+        返回:
+            文件内容（bytes）或None（如果下载失败）
+        
+        异常:
+            ContentTooLarge: 文件超过max_bytes
+        """
+        response = self.get(url, stream=True, **kwargs)
+        if response:
+            self._check_length(response, url, max_bytes)
+            if info is not None:
+                info['content_type'] = response.headers.get('Content-Type')
+            try:
+                chunks = list(self._iter_chunks(response, url, max_bytes))
+                logger.info(f"文件下载成功: {url}")
+                return b''.join(chunks)
+            except ContentTooLarge:
+                raise
+            except Exception as e:
+                logger.error(f"文件下载失败: {url}, 错误: {e}")
+        return None
+    
+    @traced('download_file', ('url',), falsy_is_error=True)
+    def download_file(self, url, save_path, digest=None, max_bytes=None, info=None, **kwargs):
         """
         下载文件并保存到指定路径
         
         参数:
             url: 文件URL
             save_path: 保存路径
+            digest: hashlib哈希对象，设置后在下载时同时计算文件哈希
+            max_bytes: 允许的最大字节数，None表示不限制
+            info: 字典，设置后写入响应的Content-Type（'content_type'）和第一个数据块（'head'），
+                  用于判断文件类型而不需要再次读取文件
             **kwargs: 传递给get方法的其他参数
         
         返回:
             True（成功）或False（失败）
+        
+        异常:
+            ContentTooLarge: 文件超过max_bytes（已写入的部分会被删除）
         """
         response = self.get(url, stream=True, **kwargs)
         if response:
+            self._check_length(response, url, max_bytes)
+            if info is not None:
+                info['content_type'] = response.headers.get('Content-Type')
+                info['head'] = b''
             try:
                 # 确保保存目录存在
                 save_dir = os.path.dirname(save_path)
@@ -110,17 +238,22 @@ class RequestUtils:
                 
                 # 下载文件
                 with open(save_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
+                    for chunk in self._iter_chunks(response, url, max_bytes):
+                        f.write(chunk)
+                        if info is not None and not info['head']:
+                            info['head'] = chunk
+                        if digest is not None:
+                            digest.update(chunk)
                 
                 logger.info(f"文件下载成功: {save_path}")
                 return True
             except Exception as e:
-                logger.error(f"文件下载失败: {save_path}, 错误: {e}")
                 # 清理失败的文件
                 if os.path.exists(save_path):
                     os.remove(save_path)
+                if isinstance(e, ContentTooLarge):
+                    raise
+                logger.error(f"文件下载失败: {save_path}, 错误: {e}")
         return False
 
 # 创建全局请求工具实例
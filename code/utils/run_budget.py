@@ -0,0 +1,118 @@
+import time
+from config.settings import Config
+from utils.logger import logger
+
+class RunBudget:
+    """运行时间预算：根据实时吞吐量调整爬取规模，并为打包预留时间"""
+
+    def __init__(self, deadline_seconds, base_bytes=0,
+                 packaging_throughput=Config.PACKAGING_THROUGHPUT,
+                 safety_margin=Config.BUDGET_SAFETY_MARGIN, start_time=None):
+        """
+        初始化运行预算
+
+        参数:
+            deadline_seconds: 从start_time起的可用总时间（秒）
+            base_bytes: 运行开始时待打包目录中已有的字节数
+            packaging_throughput: 预估打包吞吐量（字节/秒）
+            safety_margin: 额外预留的安全时间（秒）
+            start_time: 计时起点，默认为当前时间
+        """
+        self.start_time = start_time if start_time is not None else time.time()
+        self.deadline = self.start_time + deadline_seconds
+        self.base_bytes = base_bytes
+        self.packaging_throughput = packaging_throughput
+        self.safety_margin = safety_margin
+
+        self.downloaded_bytes = 0
+        self.asset_count = 0
+        self.asset_time = 0.0
+        self.post_count = 0
+        self.post_time = 0.0
+        self._stop_logged = False
+
+    def remaining(self):
+        """距离截止时间的剩余秒数"""
+        return self.deadline - time.time()
+
+    def packaging_reserve(self):
+        """根据磁盘上待打包的字节数估算打包所需时间（秒）"""
+        bytes_on_disk = self.base_bytes + self.downloaded_bytes
+        return self.safety_margin + bytes_on_disk / max(self.packaging_throughput, 1)
+
+    def crawl_time_left(self):
+        """扣除打包预留后可用于爬取的剩余秒数"""
+        return self.remaining() - self.packaging_reserve()
+
+    def should_stop(self):
+        """是否已到达打包预留时间，应停止开始新任务"""
+        if self.crawl_time_left() > 0:
+            return False
+        if not self._stop_logged:
+            logger.warning(f"已到达打包预留时间（剩余 {self.remaining():.0f} 秒，预留 {self.packaging_reserve():.0f} 秒），停止开始新任务")
+            self._stop_logged = True
+        return True
+
+    def record_post(self, elapsed):
+        """记录一次帖子解析耗时"""
+        self.post_count += 1
+        self.post_time += elapsed
+
+    def record_asset(self, elapsed, size):
+        """记录一次图片下载的耗时和字节数"""
+        self.asset_count += 1
+        self.asset_time += elapsed
+        self.downloaded_bytes += size
+
+    def avg_asset_time(self):
+        """平均单张图片下载耗时，尚无数据时返回None"""
+        if not self.asset_count:
+            return None
+        return self.asset_time / self.asset_count
+
+    def avg_post_time(self):
+        """平均帖子解析耗时，尚无数据时返回0"""
+        if not self.post_count:
+            return 0.0
+        return self.post_time / self.post_count
+
+    def can_start_post(self, pending_assets):
+        """
+        判断是否还有时间开始处理一个新帖子
+
+        参数:
+            pending_assets: 队列中尚未下载的图片数量
+        """
+        avg_asset = self.avg_asset_time()
+        if avg_asset is None:
+            return not self.should_stop()
+        # 先保证已排队的图片能够完成
+        needed = pending_assets * avg_asset + self.avg_post_time() + avg_asset
+        return self.crawl_time_left() > needed
+
+    def adjust_max_pics(self, default, pending_posts):
+        """
+        根据剩余时间和实测吞吐量计算当前帖子的图片数量上限
+
+        剩余时间只分给按默认上限计算能够处理到的帖子：启用预算时不限制每页帖子数量，
+        队列中的帖子通常远多于剩余时间能处理的数量，按全部待处理帖子平分会把每个帖子都压到最低上限。
+        待处理的帖子较少时上限相应提高。
+
+        参数:
+            default: 尚无吞吐量数据时使用的默认上限，None表示不限制（按 BUDGET_MAX_PICS 计算）
+            pending_posts: 包括当前帖子在内尚未解析的帖子数量
+
+        返回:
+            图片数量上限
+        """
+        avg_asset = self.avg_asset_time()
+        if avg_asset is None:
+            return default
+        time_left = self.crawl_time_left()
+        default_cost = self.avg_post_time() + (default or Config.BUDGET_MAX_PICS) * avg_asset
+        reachable_posts = max(min(pending_posts, int(time_left / default_cost)), 1)
+        affordable = (time_left / reachable_posts - self.avg_post_time()) / avg_asset
+        limit = int(min(max(affordable, Config.BUDGET_MIN_PICS), Config.BUDGET_MAX_PICS))
+        logger.info(f"预算调整: 剩余可爬取 {time_left:.0f} 秒，平均每张图片 {avg_asset:.2f} 秒，"
+                    f"预计还能处理 {reachable_posts}/{pending_posts} 个帖子，本帖最多 {limit} 张图片")
+        return limit
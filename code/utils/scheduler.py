@@ -0,0 +1,189 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from config.settings import Config
+from utils.logger import logger
+from utils.metrics import metrics
+from utils.tracing import tracer
+
+QUEUE_DEPTH = metrics.gauge('crawler_queue_depth', '调度队列中待处理的任务数量', ['kind'])
+QUEUE_WAIT_SECONDS = metrics.histogram('crawler_queue_wait_seconds', '任务从入队到被取出的等待时间', ['kind'])
+
+class CrawlJob:
+    """调度任务（帖子或图片资源）"""
+
+    POST = 'post'
+    ASSET = 'asset'
+
+    def __init__(self, kind, url, forum_key, priority, post_url=None, index=0, payload=None):
+        """
+        初始化调度任务
+
+        参数:
+            kind: 任务类型，CrawlJob.POST 或 CrawlJob.ASSET
+            url: 任务URL（帖子URL或图片URL）
+            forum_key: 板块键名
+            priority: 基础优先级，数值越大越优先
+            post_url: 所属帖子URL（图片任务使用）
+            index: 图片在帖子中的序号（图片任务使用）
+            payload: 附加数据，例如帖子标题
+        """
+        self.kind = kind
+        self.url = url
+        self.forum_key = forum_key
+        self.priority = priority
+        self.post_url = post_url if post_url is not None else url
+        self.index = index
+        self.payload = payload or {}
+        self.enqueued_at = time.time()
+
+    def __repr__(self):
+        return f"CrawlJob({self.kind}, {self.url}, priority={self.priority:.2f})"
+
+class CrawlScheduler:
+    """爬取任务优先级调度器，所有帖子和图片任务都经由此调度"""
+
+    def __init__(self, aging_rate=Config.SCHEDULER_AGING_RATE, asset_decay=Config.SCHEDULER_ASSET_DECAY):
+        """
+        初始化调度器
+
+        参数:
+            aging_rate: 老化速率，任务每等待1秒提升的优先级
+            asset_decay: 图片序号每增加1降低的优先级
+        """
+        self.aging_rate = aging_rate
+        self.asset_decay = asset_decay
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._start_time = time.time()
+        self._pending = {CrawlJob.POST: 0, CrawlJob.ASSET: 0}
+
+    @staticmethod
+    def post_priority(forum_key, rank, reply_count=0):
+        """
+        计算帖子优先级
+
+        参数:
+            forum_key: 板块键名，决定板块权重
+            rank: 帖子在列表中的全局排名（0表示最新）
+            reply_count: 回复数量
+
+        返回:
+            优先级数值，越新、回复越多、板块权重越高则越大
+        """
+        freshness = 100.0 / (1 + 0.05 * max(rank, 0))
+        popularity = 10.0 * math.log1p(max(reply_count, 0))
+        return Config.get_forum_weight(forum_key) * (freshness + popularity)
+
+    def _push(self, job):
+        """将任务放入优先队列"""
+        # 老化后的有效优先级为 priority + aging_rate * (now - enqueued_at)，
+        # 其中now对所有任务相同，因此按 priority - aging_rate * enqueued_at 排序即可，
+        # 堆中的键无需随时间重算
+        waited = job.enqueued_at - self._start_time
+        key = -(job.priority - self.aging_rate * waited)
+        with self._lock:
+            heapq.heappush(self._heap, (key, next(self._counter), job))
+            self._pending[job.kind] += 1
+            depth = self._pending[job.kind]
+        QUEUE_DEPTH.set(depth, kind=job.kind)
+        return job
+
+    def submit_post(self, post_url, forum_key, rank, reply_count=0, payload=None):
+        """
+        提交帖子任务
+
+        参数:
+            post_url: 帖子URL
+            forum_key: 板块键名
+            rank: 帖子在列表中的全局排名
+            reply_count: 回复数量
+            payload: 附加数据
+
+        返回:
+            创建的任务
+        """
+        priority = self.post_priority(forum_key, rank, reply_count)
+        return self._push(CrawlJob(CrawlJob.POST, post_url, forum_key, priority, payload=payload))
+
+    def submit_pages(self, get_urls_from_page, forum_key, start_page, end_page, max_posts=None, skip_urls=()):
+        """
+        抓取列表页并提交未爬取的帖子（图片爬虫和文学爬虫共用，两者的排名规则保持一致）
+
+        参数:
+            get_urls_from_page: 获取列表页帖子URL的函数，参数为 (页码字符串, 板块键名)
+            forum_key: 板块键名
+            start_page: 起始页面
+            end_page: 结束页面
+            max_posts: 每页最多处理的帖子数量，None表示无限制
+            skip_urls: 需要跳过的URL集合（已爬取或已从检查点恢复）
+
+        返回:
+            提交的帖子数量
+        """
+        rank = 0
+        submitted = 0
+        for page in range(start_page, end_page + 1):
+            # 列表页的Span作为其中帖子的父节点，随帖子任务传递
+            with tracer.span('page', track=True, page=page, forum=forum_key) as page_span:
+                post_urls = get_urls_from_page(str(page), forum_key)
+
+                # 应用每页最大帖子数量限制
+                if max_posts and max_posts > 0 and len(post_urls) > max_posts:
+                    logger.info(f"页面 {page} 有 {len(post_urls)} 个帖子，限制为 {max_posts} 个")
+                    post_urls = post_urls[:max_posts]
+
+                for post_url in post_urls:
+                    # 列表中越靠前的帖子越新，排名同时参与优先级计算（跳过的帖子也占用排名）
+                    rank += 1
+                    if post_url in skip_urls:
+                        logger.info(f"已爬取或已恢复，跳过: {post_url}")
+                        continue
+                    self.submit_post(post_url, forum_key, rank - 1, payload={'trace_parent': page_span})
+                    submitted += 1
+
+        logger.info(f"已提交 {submitted} 个帖子任务到调度器")
+        return submitted
+
+    def submit_asset(self, url, post_job, index, payload=None):
+        """
+        提交图片资源任务，帖子的前几张图片排在其他帖子的靠后图片之前
+
+        参数:
+            url: 图片URL
+            post_job: 所属帖子任务
+            index: 图片在帖子中的序号
+            payload: 附加数据
+
+        返回:
+            创建的任务
+        """
+        priority = post_job.priority - self.asset_decay * index
+        job = CrawlJob(CrawlJob.ASSET, url, post_job.forum_key, priority,
+                       post_url=post_job.url, index=index, payload=payload)
+        return self._push(job)
+
+    def next_job(self):
+        """取出当前优先级最高的任务，队列为空时返回None"""
+        with self._lock:
+            if not self._heap:
+                return None
+            _, _, job = heapq.heappop(self._heap)
+            self._pending[job.kind] -= 1
+            depth = self._pending[job.kind]
+        QUEUE_DEPTH.set(depth, kind=job.kind)
+        QUEUE_WAIT_SECONDS.observe(time.time() - job.enqueued_at, kind=job.kind)
+        return job
+
+    def pending(self, kind=None):
+        """返回待处理任务数量，可按任务类型过滤"""
+        with self._lock:
+            if kind is None:
+                return len(self._heap)
+            return self._pending.get(kind, 0)
+
+    def __len__(self):
+        return self.pending()
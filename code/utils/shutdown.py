@@ -0,0 +1,67 @@
+import signal
+import threading
+import time
+from config.settings import Config
+from utils.logger import logger
+
+class ShutdownController:
+    """优雅退出控制器：收到终止信号后停止调度新任务，并给进行中的传输留出宽限期"""
+
+    def __init__(self, grace_period=Config.SHUTDOWN_GRACE_PERIOD):
+        """
+        初始化退出控制器
+
+        参数:
+            grace_period: 收到信号后允许进行中的传输继续的时间（秒）
+        """
+        self.grace_period = grace_period
+        self._event = threading.Event()
+        self._requested_at = None
+        self._installed = False
+
+    def install(self):
+        """注册SIGINT和SIGTERM信号处理函数（仅主线程可调用）"""
+        if self._installed or threading.current_thread() is not threading.main_thread():
+            return
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self._handle_signal)
+        self._installed = True
+
+    def _handle_signal(self, signum, frame):
+        """信号处理函数：第一次信号请求优雅退出，第二次信号立即中断"""
+        if self._event.is_set():
+            logger.warning("再次收到终止信号，立即退出")
+            raise KeyboardInterrupt
+        logger.warning(f"收到终止信号 {signal.Signals(signum).name}，停止调度新任务，"
+                       f"进行中的传输将在 {self.grace_period} 秒内完成")
+        self.request()
+
+    def request(self):
+        """请求优雅退出"""
+        if not self._event.is_set():
+            self._requested_at = time.time()
+            self._event.set()
+
+    def requested(self):
+        """是否已请求退出"""
+        return self._event.is_set()
+
+    def grace_expired(self):
+        """宽限期是否已用完，用完后进行中的传输应当中止"""
+        if not self._event.is_set():
+            return False
+        return time.time() - self._requested_at > self.grace_period
+
+    def grace_remaining(self):
+        """宽限期剩余的秒数，未请求退出时返回None"""
+        if not self._event.is_set():
+            return None
+        return max(self.grace_period - (time.time() - self._requested_at), 0)
+
+    def reset(self):
+        """清除退出请求"""
+        self._event.clear()
+        self._requested_at = None
+
+# 创建全局退出控制器实例
+shutdown = ShutdownController()
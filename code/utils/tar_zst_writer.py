@@ -0,0 +1,237 @@
+import hashlib
+import os
+import tarfile
+import zlib
+from config.settings import Config
+from utils.logger import logger
+
+# zstandard为可选依赖，未安装时只能使用ZIP格式
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# tar格式常量
+TAR_BLOCK_SIZE = 512
+TAR_RECORD_SIZE = 10240
+# zstd帧头、块头和校验和的预留字节数
+ZSTD_FRAME_OVERHEAD = 1024
+
+def zstd_available():
+    """是否已安装zstandard"""
+    return zstandard is not None
+
+def tar_member_size(arcname, file_size):
+    """
+    成员在tar中占用的最大字节数（文件头 + PAX扩展头 + 按块对齐的数据）
+
+    参数:
+        arcname: 归档内路径
+        file_size: 文件大小
+
+    返回:
+        字节数
+    """
+    def blocks(size):
+        return (size + TAR_BLOCK_SIZE - 1) // TAR_BLOCK_SIZE * TAR_BLOCK_SIZE
+    # 非ASCII或过长的路径以及修改时间写在PAX扩展头中
+    pax_size = 2 * TAR_BLOCK_SIZE + blocks(len(arcname.encode('utf-8')) + 256)
+    return TAR_BLOCK_SIZE + pax_size + blocks(file_size)
+
+def zstd_bound(size):
+    """zstd压缩后数据大小的上限（与ZSTD_COMPRESSBOUND一致）"""
+    small = (128 * 1024 - size) >> 11 if size < 128 * 1024 else 0
+    return size + (size >> 8) + small
+
+class SplitFileWriter:
+    """按固定字节数切分写入的文件对象，依次写入 xxx.001、xxx.002 ...，用 cat 拼接即可还原"""
+
+    def __init__(self, path, part_size):
+        """
+        初始化写入器
+
+        参数:
+            path: 文件路径（不含分段序号）
+            part_size: 每个分段的字节数
+        """
+        self.path = path
+        self.part_size = part_size
+        self.part_paths = []
+        self.fp = None
+        self._next_part()
+
+    def _next_part(self):
+        """关闭当前分段并打开下一个分段"""
+        if self.fp:
+            self.fp.close()
+        self.part_paths.append(f"{self.path}.{len(self.part_paths) + 1:03d}")
+        self.fp = open(self.part_paths[-1], 'wb')
+
+    def write(self, data):
+        """写入数据，写满一个分段后继续写入下一个分段"""
+        view = memoryview(data)
+        while view:
+            room = self.part_size - self.fp.tell()
+            if room <= 0:
+                self._next_part()
+                continue
+            self.fp.write(view[:room])
+            view = view[room:]
+        return len(data)
+
+    def flush(self):
+        self.fp.flush()
+
+    def close(self):
+        """关闭文件，返回分段路径列表"""
+        if self.fp:
+            self.fp.close()
+            self.fp = None
+        return list(self.part_paths)
+
+class _ChecksumReader:
+    """读取文件的同时计算CRC32和SHA-256，写入tar时不需要再读一遍"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.crc = 0
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fp.read(size)
+        self.crc = zlib.crc32(data, self.crc)
+        self.digest.update(data)
+        return data
+
+class TarZstWriter:
+    """
+    tar.zst归档写入器：文件流式写入PAX格式的tar，再由多线程zstd压缩
+
+    解压: zstd -d xxx.tar.zst -c | tar -x，或 tar --zstd -xf xxx.tar.zst；
+    分段文件先用 cat xxx.tar.zst.* 拼接。
+    """
+
+    def __init__(self, path, level=Config.ZSTD_LEVEL, threads=Config.ZSTD_THREADS,
+                 long_distance=Config.ZSTD_LONG_DISTANCE, part_size=None):
+        """
+        初始化写入器
+
+        参数:
+            path: 输出文件路径
+            level: zstd压缩级别
+            threads: zstd压缩线程数
+            long_distance: 是否启用长距离匹配（适合大量相似文本）
+            part_size: 设置后按该字节数切分为 xxx.001、xxx.002 ...（只有一个分段时仍命名为xxx）
+        """
+        if zstandard is None:
+            raise RuntimeError("未安装zstandard，无法创建tar.zst归档")
+        self.path = path
+        self.fp = SplitFileWriter(path, part_size) if part_size else open(path, 'wb')
+        params = zstandard.ZstdCompressionParameters.from_level(
+            level, threads=threads, write_checksum=True, enable_ldm=long_distance,
+            window_log=Config.ZSTD_WINDOW_LOG if long_distance else 0)
+        self.stream = zstandard.ZstdCompressor(compression_params=params).stream_writer(self.fp, closefd=False)
+        self.tar = tarfile.open(fileobj=self.stream, mode='w|', format=tarfile.PAX_FORMAT)
+        self.member_count = 0
+        # 已写入成员的 (归档内路径, 大小, CRC32, SHA-256)
+        self.checksums = []
+        self._written = {}
+        # 已输出和已写入尚未输出的数据压缩后的字节数上限
+        self._bound = 0
+
+    @property
+    def spanned(self):
+        """输出是否已经写到第二个分段"""
+        return isinstance(self.fp, SplitFileWriter) and len(self.fp.part_paths) > 1
+
+    def fits(self, arcname, file_size, limit):
+        """
+        再写入一个文件并结束归档后，输出是否不超过limit字节
+
+        先按已写入数据的压缩上限判断，放不下时刷新zstd块，按已输出的精确字节数再判断，
+        可压缩的数据不会因为按上限估算而提前换卷。
+
+        参数:
+            arcname: 归档内路径
+            file_size: 文件大小
+            limit: 字节数上限
+
+        返回:
+            是否放得下
+        """
+        # 成员本身加上结束归档时补齐的记录
+        needed = zstd_bound(tar_member_size(arcname, file_size) + TAR_RECORD_SIZE) + ZSTD_FRAME_OVERHEAD
+        if self._bound + needed <= limit:
+            return True
+        self.stream.flush(zstandard.FLUSH_BLOCK)
+        # tarfile的流缓冲中最多还有一个记录的数据没有交给zstd
+        self._bound = self.stream.tell() + zstd_bound(TAR_RECORD_SIZE)
+        return self._bound + needed <= limit
+
+    def add_file(self, file_path, arcname):
+        """
+        写入一个文件
+
+        参数:
+            file_path: 文件路径
+            arcname: 归档内路径
+
+        返回:
+            文件大小
+        """
+        info = self.tar.gettarinfo(file_path, arcname.replace(os.sep, '/'))
+        if info.islnk():
+            # 硬链接到本分卷中已写入的文件（图片去重），只写入链接，解压时恢复为硬链接
+            self.tar.addfile(info)
+            self._forget_members()
+            self.member_count += 1
+            self._bound += zstd_bound(tar_member_size(info.name, 0))
+            _, size, crc, sha256 = self._written[info.linkname]
+            self.checksums.append((info.name, size, crc, sha256))
+            return size
+        with open(file_path, 'rb') as f:
+            reader = _ChecksumReader(f)
+            self.tar.addfile(info, reader)
+        self._forget_members()
+        self.member_count += 1
+        self._bound += zstd_bound(tar_member_size(info.name, info.size))
+        self.checksums.append((info.name, info.size, reader.crc, reader.digest.hexdigest()))
+        self._written[info.name] = self.checksums[-1]
+        return info.size
+
+    def _forget_members(self):
+        """
+        清空tarfile保存的成员列表：流式写入用不到，内存不随成员数增长；
+        列表中的TarInfo引用TarFile形成循环引用，不清空时多线程zstd上下文要等垃圾回收才释放，
+        若恰好在fork出的子进程中回收，会等待不存在的压缩线程而死锁
+        """
+        self.tar.members.clear()
+
+    def close(self):
+        """
+        结束tar和zstd帧并关闭文件
+
+        返回:
+            生成的文件路径列表
+        """
+        if self.tar is None:
+            return []
+        self.tar.close()
+        self.stream.close()
+        self.tar = None
+        if isinstance(self.fp, SplitFileWriter):
+            paths = self.fp.close()
+            if len(paths) == 1:
+                # 没有超过分段大小，使用不带分段序号的文件名
+                os.replace(paths[0], self.path)
+                return [self.path]
+            logger.info(f"tar.zst归档已切分为 {len(paths)} 个分段: {self.path}.001 ...")
+            return paths
+        self.fp.close()
+        return [self.path]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,338 @@
+import functools
+import inspect
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from config.settings import Config
+from utils.logger import logger
+from utils.atomic_file import atomic_write
+
+# OTLP 的状态码
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+class Span:
+    """
+    一段有开始和结束时间的操作（列表页、帖子、图片、下载、打包）
+
+    父子关系通过 parent_id 显式记录：帖子和图片任务由调度器交错执行，
+    图片的父节点（帖子）不一定在同一个调用栈中。
+    """
+
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'track', 'start_ns', 'end_ns',
+                 'attributes', 'status', 'status_message')
+
+    def __init__(self, tracer, name, trace_id, span_id, parent_id, track, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.track = track
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = STATUS_UNSET
+        self.status_message = None
+
+    def set(self, key, value):
+        """设置属性"""
+        self.attributes[key] = value
+
+    def error(self, message):
+        """标记为失败"""
+        self.status = STATUS_ERROR
+        self.status_message = str(message)
+
+    def end(self, **attributes):
+        """结束并记录（重复调用时忽略）"""
+        if self.end_ns is not None:
+            return
+        self.attributes.update(attributes)
+        self.end_ns = time.time_ns()
+        self.tracer._finish(self)
+
+    def __enter__(self):
+        self.tracer._push(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._pop(self)
+        if exc is not None:
+            self.error(f"{exc_type.__name__}: {exc}")
+        self.end()
+        return False
+
+class _NoopSpan:
+    """关闭追踪时使用的空操作，所有方法立即返回"""
+
+    name = None
+    span_id = None
+
+    def set(self, key, value):
+        pass
+
+    def error(self, message):
+        pass
+
+    def end(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = _NoopSpan()
+
+class _Activation:
+    """把已开始的Span设为当前线程的当前Span（用于在其下创建子Span），退出时恢复，不结束该Span"""
+
+    __slots__ = ('tracer', 'span')
+
+    def __init__(self, tracer, span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self):
+        self.tracer._push(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._pop(self.span)
+        return False
+
+class Tracer:
+    """
+    轻量级追踪：记录 列表页 -> 帖子 -> 图片 -> 下载 的Span，导出为 Chrome trace-event JSON
+    （chrome://tracing 或 Perfetto 打开）和 OTLP/JSON 文件（OpenTelemetry Collector 的 otlpjsonfile 接收器可读取）。
+
+    默认关闭，关闭时 span/start_span 返回空操作对象，traced 装饰的函数只多一次属性判断。
+    """
+
+    def __init__(self, enabled=Config.TRACE_ENABLED, max_spans=Config.TRACE_MAX_SPANS):
+        """
+        初始化追踪器
+
+        参数:
+            enabled: 是否记录Span
+            max_spans: 最多保存的Span数量，超过后丢弃新的Span并计数
+        """
+        self.enabled = enabled
+        self.max_spans = max_spans
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self._tracks = itertools.count(1)
+        self.reset()
+
+    def reset(self):
+        """清空已记录的Span（fork出的工作进程只导出自己的部分）"""
+        with self._lock:
+            self.spans = []
+            self.dropped = 0
+            self.track_names = {}
+        self._local = threading.local()
+        # 进程号参与ID生成，多个工作进程的追踪文件合并时ID不冲突
+        self._prefix = (os.getpid() & 0xffff) << 32
+        self._trace_prefix = os.urandom(8).hex()
+        self.start_time = time.time()
+
+    def _current_stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _push(self, span):
+        self._current_stack().append(span)
+
+    def _pop(self, span):
+        stack = self._current_stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        elif span in stack:
+            stack.remove(span)
+
+    def current(self):
+        """当前线程的当前Span，没有时返回None"""
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    def start_span(self, name, parent=None, track=False, **attributes):
+        """
+        开始一个Span（需要调用 end 结束，或用作上下文管理器）
+
+        参数:
+            name: Span名称
+            parent: 父Span，None表示使用当前线程的当前Span（没有时作为新追踪的根）
+            track: 是否在Chrome trace中单独占一行（帖子的图片与其他帖子交错执行，各自一行才能正确嵌套）
+            **attributes: 属性
+
+        返回:
+            Span，关闭追踪时返回空操作对象
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        if parent is None or parent is NOOP_SPAN:
+            parent = self.current()
+        span_id = self._prefix | next(self._ids)
+        if parent is None:
+            trace_id, parent_id = f"{self._trace_prefix}{span_id:016x}", None
+        else:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        if track or parent is None:
+            track_id = next(self._tracks)
+            label = attributes.get('url') or attributes.get('page') or ''
+            self.track_names[track_id] = f"{name} {label}".strip()
+        else:
+            track_id = parent.track
+        return Span(self, name, trace_id, span_id, parent_id, track_id, attributes)
+
+    def span(self, name, parent=None, track=False, **attributes):
+        """开始一个Span，用作上下文管理器（退出时结束，异常时标记为失败）"""
+        return self.start_span(name, parent, track, **attributes)
+
+    def use(self, span):
+        """
+        在上下文中把已开始的Span设为当前Span，其中创建的Span以它为父节点
+
+        参数:
+            span: start_span 返回的Span（可以为None或空操作对象）
+        """
+        if not self.enabled or span is None or span is NOOP_SPAN:
+            return NOOP_SPAN
+        return _Activation(self, span)
+
+    def _finish(self, span):
+        with self._lock:
+            if len(self.spans) >= self.max_spans:
+                self.dropped += 1
+                return
+            self.spans.append(span)
+
+    def chrome_trace(self):
+        """
+        返回 Chrome trace-event 格式的字典
+
+        每个Span为一个完整事件（ph='X'），按track分行：列表页和每个帖子各占一行，
+        图片和下载嵌套在帖子的行中。父子ID放在args中。
+        """
+        with self._lock:
+            spans = list(self.spans)
+            track_names = dict(self.track_names)
+        pid = os.getpid()
+        events = []
+        for span in spans:
+            args = dict(span.attributes, span_id=f"{span.span_id:016x}", trace_id=span.trace_id)
+            if span.parent_id is not None:
+                args['parent_id'] = f"{span.parent_id:016x}"
+            if span.status == STATUS_ERROR:
+                args['error'] = span.status_message
+            events.append({'name': span.name, 'cat': 'crawler', 'ph': 'X', 'pid': pid, 'tid': span.track,
+                           'ts': span.start_ns / 1000, 'dur': (span.end_ns - span.start_ns) / 1000,
+                           'args': args})
+        for track, label in track_names.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': track, 'args': {'name': label}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def otlp(self, service_name=Config.TRACE_SERVICE_NAME):
+        """返回 OTLP/JSON 格式（ExportTraceServiceRequest）的字典"""
+        with self._lock:
+            spans = list(self.spans)
+        otlp_spans = []
+        for span in spans:
+            entry = {
+                'traceId': span.trace_id,
+                'spanId': f"{span.span_id:016x}",
+                'name': span.name,
+                'kind': 1,  # SPAN_KIND_INTERNAL
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns),
+                'attributes': [_otlp_attribute(key, value) for key, value in span.attributes.items()],
+                'status': {'code': span.status},
+            }
+            if span.parent_id is not None:
+                entry['parentSpanId'] = f"{span.parent_id:016x}"
+            if span.status_message:
+                entry['status']['message'] = span.status_message
+            otlp_spans.append(entry)
+        resource = [_otlp_attribute('service.name', service_name), _otlp_attribute('process.pid', os.getpid())]
+        return {'resourceSpans': [{'resource': {'attributes': resource},
+                                   'scopeSpans': [{'scope': {'name': service_name}, 'spans': otlp_spans}]}]}
+
+    def write(self, trace_dir=Config.TRACE_DIR, suffix=''):
+        """
+        写入本次运行的 Chrome trace 文件（trace_时间.json）和 OTLP 文件（trace_时间.otlp.json）
+
+        参数:
+            trace_dir: 输出目录
+            suffix: 文件名后缀（如分片工作进程的标识）
+
+        返回:
+            (Chrome trace路径, OTLP路径)，关闭追踪或没有Span时返回None
+        """
+        if not self.enabled or not self.spans:
+            return None
+        name = f"trace_{datetime.fromtimestamp(self.start_time).strftime('%Y%m%d_%H%M%S')}"
+        if suffix:
+            name = f"{name}_{suffix}"
+        chrome_path = os.path.join(trace_dir, f"{name}.json")
+        otlp_path = os.path.join(trace_dir, f"{name}.otlp.json")
+        try:
+            atomic_write(chrome_path, json.dumps(self.chrome_trace(), ensure_ascii=False))
+            # OTLP文件每行一个导出请求
+            atomic_write(otlp_path, json.dumps(self.otlp(), ensure_ascii=False) + '\n')
+        except Exception as e:
+            logger.error(f"写入追踪文件失败: {e}")
+            return None
+        logger.info(f"追踪已写入: {chrome_path}（{len(self.spans)} 个Span"
+                    + (f"，超过上限丢弃 {self.dropped} 个" if self.dropped else "") + "）")
+        return chrome_path, otlp_path
+
+def traced(name, attributes=(), falsy_is_error=False):
+    """
+    装饰器：调用函数时记录一个Span（父节点为当前线程的当前Span）
+
+    参数:
+        name: Span名称
+        attributes: 作为属性记录的参数名（如 ('url',)）
+        falsy_is_error: 函数返回False或None时是否标记为失败（用于以返回值表示失败的函数）
+    """
+    def decorator(func):
+        parameters = list(inspect.signature(func).parameters)
+        positions = [(attr, parameters.index(attr)) for attr in attributes]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            span_attributes = {}
+            for attr, position in positions:
+                value = kwargs[attr] if attr in kwargs else args[position] if position < len(args) else None
+                if value is not None:
+                    span_attributes[attr] = value
+            with tracer.span(name, **span_attributes) as span:
+                result = func(*args, **kwargs)
+                if falsy_is_error and not result:
+                    span.error(f"返回{result!r}")
+                return result
+        return wrapper
+    return decorator
+
+def _otlp_attribute(key, value):
+    """OTLP属性：按类型使用 boolValue/intValue/doubleValue/stringValue"""
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+# 创建全局追踪器
+tracer = Tracer()
@@ -0,0 +1,434 @@
+import hashlib
+import os
+import struct
+import time
+import zlib
+
+# ZIP格式常量
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+READ_CHUNK_SIZE = 1024 * 1024
+# 目录结束记录大小：EOCD 22字节，ZIP64 EOCD 56字节 + 定位器 20字节
+END_RECORD_SIZE = 22
+ZIP64_END_RECORDS_SIZE = 56 + 20
+# 分段ZIP第一个分段开头的标记
+SPLIT_SIGNATURE = b'PK\x07\x08'
+
+def compress_bound(size):
+    """DEFLATE压缩后数据大小的上限（与zlib的deflateBound一致）"""
+    return size + (size >> 12) + (size >> 14) + (size >> 25) + 13
+
+def dos_datetime(mtime):
+    """将时间戳转换为ZIP使用的DOS日期和时间"""
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        t = time.localtime(315532800)  # 1980-01-01
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+def read_raw_member(fp, info):
+    """
+    从已有ZIP中读取成员的原始压缩数据，用于不解压直接复制到新的ZIP
+
+    参数:
+        fp: 以二进制方式打开的ZIP文件对象
+        info: zipfile.ZipInfo
+
+    返回:
+        压缩后的数据
+    """
+    fp.seek(info.header_offset)
+    header = fp.read(30)
+    if header[:4] != b'PK\x03\x04':
+        raise ValueError(f"无效的本地文件头: {info.filename}")
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    fp.seek(name_length + extra_length, os.SEEK_CUR)
+    return fp.read(info.compress_size)
+
+def zip_member_size(arcname, compress_size, file_size, offset=0):
+    """
+    一个成员在ZIP中占用的字节数（本地文件头 + 数据 + 中央目录记录）
+
+    参数:
+        arcname: 压缩包内路径
+        compress_size: 压缩后数据大小（未知时传入上限）
+        file_size: 原始数据大小
+        offset: 本地文件头的写入位置
+
+    返回:
+        字节数
+    """
+    name = arcname.replace(os.sep, '/').encode('utf-8')
+    zip64 = file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT
+    local = 30 + len(name) + (20 if zip64 else 0)
+    fields = sum(1 for value in (file_size, compress_size, offset) if value >= ZIP64_LIMIT)
+    central = 46 + len(name) + (4 + 8 * fields if fields else 0)
+    return local + compress_size + central
+
+class ZipMember:
+    """已写入的ZIP成员，用于生成中央目录"""
+
+    def __init__(self, arcname, method, crc, compress_size, file_size, mtime, mode, header_offset, disk=0):
+        self.arcname = arcname
+        self.method = method
+        self.crc = crc
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.mtime = mtime
+        self.mode = mode
+        self.header_offset = header_offset
+        # 本地文件头所在的分段序号（从0开始），普通ZIP始终为0
+        self.disk = disk
+        # 原始数据的SHA-256（流式写入时计算，用于校验清单）
+        self.sha256 = None
+
+class RawZipWriter:
+    """
+    标准ZIP写入器，可直接写入在其他进程中压缩好的数据
+
+    生成的文件符合PKWARE APPNOTE规范，超过4GB或65535个成员时自动使用ZIP64扩展，
+    任何解压工具都可以正常解压。
+    """
+
+    def __init__(self, path):
+        """
+        初始化写入器
+
+        参数:
+            path: 输出ZIP文件路径
+        """
+        self.path = path
+        self.fp = open(path, 'wb')
+        self.members = []
+        # 当前写入的分段序号，以及已写入成员的中央目录总大小
+        self.disk = 0
+        self.cd_size = 0
+
+    def _name_bytes(self, arcname):
+        """返回编码后的文件名和通用标志位（非ASCII文件名设置UTF-8标志）"""
+        arcname = arcname.replace(os.sep, '/')
+        try:
+            return arcname.encode('ascii'), 0
+        except UnicodeEncodeError:
+            return arcname.encode('utf-8'), 0x0800
+
+    def _local_header(self, member, zip64):
+        """构造本地文件头"""
+        name, flags = self._name_bytes(member.arcname)
+        dos_time, dos_date = dos_datetime(member.mtime)
+        if zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, member.file_size, member.compress_size)
+            compress_size = file_size = ZIP64_LIMIT
+            version = 45
+        else:
+            extra = b''
+            compress_size, file_size = member.compress_size, member.file_size
+            version = 20
+        header = struct.pack('<IHHHHHIIIHH', 0x04034b50, version, flags, member.method,
+                             dos_time, dos_date, member.crc, compress_size, file_size,
+                             len(name), len(extra))
+        return header + name + extra
+
+    def write_compressed(self, arcname, data, crc, file_size, method=ZIP_DEFLATED, mtime=None, mode=0o644):
+        """
+        写入已压缩好的成员数据
+
+        参数:
+            arcname: 压缩包内路径
+            data: 压缩后的数据（DEFLATE为不带zlib头的原始数据流）
+            crc: 原始数据的CRC32
+            file_size: 原始数据大小
+            method: 压缩方法，ZIP_DEFLATED 或 ZIP_STORED
+            mtime: 修改时间戳
+            mode: 文件权限位
+
+        返回:
+            写入的字节数（含文件头）
+        """
+        member = ZipMember(arcname, method, crc, len(data), file_size,
+                           mtime if mtime is not None else time.time(), mode, 0)
+        zip64 = member.file_size >= ZIP64_LIMIT or member.compress_size >= ZIP64_LIMIT
+        header = self._local_header(member, zip64)
+        self._write_header(member, header)
+        self._write_data(data)
+        self._add_member(member)
+        return len(header) + len(data)
+
+    def write_file(self, file_path, arcname, method=ZIP_DEFLATED, level=6, st=None):
+        """
+        流式压缩并写入一个文件，写完后回填文件头中的CRC和大小，内存占用与文件大小无关
+
+        参数:
+            file_path: 源文件路径
+            arcname: 压缩包内路径
+            method: 压缩方法
+            level: DEFLATE压缩级别
+            st: 已获取的stat结果，None时重新获取
+
+        返回:
+            写入的字节数（含文件头）
+        """
+        st = st or os.stat(file_path)
+        # 预估可能超过4GB时预留ZIP64扩展字段
+        zip64 = st.st_size * 1.05 >= ZIP64_LIMIT
+        member = ZipMember(arcname, method, 0, 0, 0, st.st_mtime, st.st_mode & 0xFFFF, 0)
+        header = self._local_header(member, zip64)
+        self._write_header(member, header)
+
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if method == ZIP_DEFLATED else None
+        crc = 0
+        digest = hashlib.sha256()
+        file_size = 0
+        compress_size = 0
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                digest.update(chunk)
+                file_size += len(chunk)
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                self._write_data(chunk)
+                compress_size += len(chunk)
+        if compressor:
+            tail = compressor.flush()
+            self._write_data(tail)
+            compress_size += len(tail)
+
+        member.crc = crc
+        member.sha256 = digest.hexdigest()
+        member.file_size = file_size
+        member.compress_size = compress_size
+        if not zip64 and (file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT):
+            raise ValueError(f"文件在压缩过程中增长超过4GB: {file_path}")
+
+        # 回填文件头
+        self._rewrite_header(member, self._local_header(member, zip64))
+        self._add_member(member)
+        return len(header) + compress_size
+
+    def _write_header(self, member, header):
+        """写入本地文件头并记录其位置"""
+        member.disk = self.disk
+        member.header_offset = self.fp.tell()
+        self.fp.write(header)
+
+    def _write_data(self, data):
+        """写入成员数据"""
+        self.fp.write(data)
+
+    def _rewrite_header(self, member, header):
+        """回填本地文件头（长度与原文件头相同）"""
+        end = self.fp.tell()
+        self.fp.seek(member.header_offset)
+        self.fp.write(header)
+        self.fp.seek(end)
+
+    def _add_member(self, member):
+        """登记已写入的成员，累计中央目录大小"""
+        self.members.append(member)
+        self.cd_size += len(self._central_directory_entry(member))
+
+    def member_size(self, arcname, compress_size, file_size):
+        """
+        在当前位置写入一个成员所需的字节数（本地文件头 + 数据 + 中央目录记录）
+
+        参数:
+            arcname: 压缩包内路径
+            compress_size: 压缩后数据大小（未知时传入上限）
+            file_size: 原始数据大小
+
+        返回:
+            字节数
+        """
+        return zip_member_size(arcname, compress_size, file_size, self.fp.tell())
+
+    def projected_size(self, needed=0):
+        """
+        再写入needed字节的成员后，关闭时ZIP文件的总大小
+
+        参数:
+            needed: member_size返回的字节数
+
+        返回:
+            字节数
+        """
+        size = self.fp.tell() + needed + self.cd_size
+        if len(self.members) + 1 >= ZIP_FILECOUNT_LIMIT or size >= ZIP64_LIMIT:
+            size += ZIP64_END_RECORDS_SIZE
+        return size + END_RECORD_SIZE
+
+    def _central_directory_entry(self, member):
+        """构造中央目录记录"""
+        name, flags = self._name_bytes(member.arcname)
+        dos_time, dos_date = dos_datetime(member.mtime)
+        extra_fields = []
+        file_size, compress_size, header_offset = member.file_size, member.compress_size, member.header_offset
+        if file_size >= ZIP64_LIMIT:
+            extra_fields.append(file_size)
+            file_size = ZIP64_LIMIT
+        if compress_size >= ZIP64_LIMIT:
+            extra_fields.append(compress_size)
+            compress_size = ZIP64_LIMIT
+        if header_offset >= ZIP64_LIMIT:
+            extra_fields.append(header_offset)
+            header_offset = ZIP64_LIMIT
+        extra = b''
+        if extra_fields:
+            extra = struct.pack(f'<HH{len(extra_fields)}Q', 0x0001, 8 * len(extra_fields), *extra_fields)
+        version = 45 if extra_fields else 20
+        return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, flags,
+                           member.method, dos_time, dos_date, member.crc, compress_size, file_size,
+                           len(name), len(extra), 0, member.disk, 0, (member.mode & 0xFFFF) << 16,
+                           header_offset) + name + extra
+
+    def close(self):
+        """写入中央目录和目录结束记录并关闭文件"""
+        if self.fp is None:
+            return
+        cd_offset = self.fp.tell()
+        for member in self.members:
+            self.fp.write(self._central_directory_entry(member))
+        cd_size = self.fp.tell() - cd_offset
+        count = len(self.members)
+
+        if count >= ZIP_FILECOUNT_LIMIT or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+            zip64_eocd_offset = self.fp.tell()
+            self.fp.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                                      count, count, cd_size, cd_offset))
+            self.fp.write(struct.pack('<IIQI', 0x07064b50, 0, zip64_eocd_offset, 1))
+            eocd_count = min(count, ZIP_FILECOUNT_LIMIT)
+            eocd_size = min(cd_size, ZIP64_LIMIT)
+            eocd_offset = min(cd_offset, ZIP64_LIMIT)
+        else:
+            eocd_count, eocd_size, eocd_offset = count, cd_size, cd_offset
+        self.fp.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, eocd_count, eocd_count,
+                                  eocd_size, eocd_offset, 0))
+        self.fp.close()
+        self.fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class SpannedZipWriter(RawZipWriter):
+    """
+    分段ZIP写入器（PKWARE APPNOTE 8.5 split archive）
+
+    按固定字节数切分为 xxx.z01、xxx.z02 ... xxx.zip，单个成员的数据可以跨越多个分段，
+    用于超过分卷大小的文件。7-Zip、WinRAR可直接解压，Info-ZIP可先用
+    `zip -s 0 xxx.zip --out 合并.zip` 合并后解压。
+    """
+
+    def __init__(self, path, segment_size):
+        """
+        初始化写入器
+
+        参数:
+            path: 最后一个分段的路径（xxx.zip），其余分段为 xxx.z01、xxx.z02 ...
+            segment_size: 每个分段的字节数
+        """
+        self.path = path
+        self.segment_size = segment_size
+        self.segment_paths = []
+        self.members = []
+        self.cd_size = 0
+        self.disk = -1
+        self.fp = None
+        self._next_segment()
+        self.fp.write(SPLIT_SIGNATURE)
+
+    def _next_segment(self):
+        """关闭当前分段并打开下一个分段"""
+        if self.fp:
+            self.fp.close()
+        self.disk += 1
+        if self.disk >= ZIP_FILECOUNT_LIMIT:
+            raise ValueError(f"分段数量超过上限: {self.path}")
+        segment_path = f"{os.path.splitext(self.path)[0]}.z{self.disk + 1:02d}"
+        self.fp = open(segment_path, 'wb')
+        self.segment_paths.append(segment_path)
+
+    def _room(self):
+        """当前分段剩余的字节数"""
+        return self.segment_size - self.fp.tell()
+
+    def _write_header(self, member, header):
+        """写入本地文件头（文件头不跨分段）并记录其所在分段和位置"""
+        if len(header) > self._room():
+            self._next_segment()
+        super()._write_header(member, header)
+
+    def _write_data(self, data):
+        """写入成员数据，写满一个分段后继续写入下一个分段"""
+        view = memoryview(data)
+        while view:
+            if self._room() <= 0:
+                self._next_segment()
+            n = min(len(view), self._room())
+            self.fp.write(view[:n])
+            view = view[n:]
+
+    def _rewrite_header(self, member, header):
+        """回填本地文件头，文件头可能位于之前的分段"""
+        if member.disk == self.disk:
+            super()._rewrite_header(member, header)
+            return
+        with open(self.segment_paths[member.disk], 'r+b') as f:
+            f.seek(member.header_offset)
+            f.write(header)
+
+    def close(self):
+        """
+        写入中央目录和目录结束记录，并将最后一个分段重命名为 xxx.zip
+
+        返回:
+            按顺序排列的分段路径列表
+        """
+        if self.fp is None:
+            return list(self.segment_paths)
+        cd_disk = None
+        cd_offset = 0
+        cd_size = 0
+        disk_entries = 0
+        for member in self.members:
+            record = self._central_directory_entry(member)
+            if len(record) > self._room():
+                self._next_segment()
+                disk_entries = 0
+            if cd_disk is None:
+                cd_disk, cd_offset = self.disk, self.fp.tell()
+            self.fp.write(record)
+            cd_size += len(record)
+            disk_entries += 1
+        if cd_disk is None:
+            cd_disk, cd_offset = self.disk, self.fp.tell()
+
+        count = len(self.members)
+        zip64 = count >= ZIP_FILECOUNT_LIMIT or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT
+        end_size = END_RECORD_SIZE + (ZIP64_END_RECORDS_SIZE if zip64 else 0)
+        if end_size > self._room():
+            self._next_segment()
+            disk_entries = 0
+
+        if zip64:
+            zip64_eocd_offset = self.fp.tell()
+            self.fp.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, self.disk, cd_disk,
+                                      disk_entries, count, cd_size, cd_offset))
+            self.fp.write(struct.pack('<IIQI', 0x07064b50, self.disk, zip64_eocd_offset, self.disk + 1))
+        self.fp.write(struct.pack('<IHHHHIIH', 0x06054b50, self.disk, cd_disk,
+                                  min(disk_entries, ZIP_FILECOUNT_LIMIT), min(count, ZIP_FILECOUNT_LIMIT),
+                                  min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0))
+        self.fp.close()
+        self.fp = None
+
+        os.replace(self.segment_paths[-1], self.path)
+        self.segment_paths[-1] = self.path
+        return list(self.segment_paths)